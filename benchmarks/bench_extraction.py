@@ -0,0 +1,126 @@
+"""Микробенчмарк извлечения кодов и ссылок.
+
+Сравнивает прежний алгоритм (два разбора HTML и шесть некомпилированных
+шаблонов на каждое письмо) с ExtractionEngine и с повторным опросом,
+который обслуживается кэшем по message_id.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_extraction [--size 200] [--rounds 5]
+"""
+import argparse
+import re
+import time
+from typing import Callable, List, Optional
+
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import make_corpus
+from models.message import Message
+from services.code_extractor import CodeExtractor
+
+LEGACY_CODE_PATTERNS = [
+    r'\b[0-9]{4,8}\b',
+    r'\b[A-Z0-9]{6,8}\b',
+    r'verification code[:\s]+([A-Z0-9]{4,8})',
+    r'confirmation code[:\s]+([A-Z0-9]{4,8})',
+    r'security code[:\s]+([A-Z0-9]{4,8})',
+    r'one-time code[:\s]+([A-Z0-9]{4,8})'
+]
+LEGACY_LINK_PATTERNS = [
+    r'https?://[^\s<>"]+?/verify[^\s<>"]+',
+    r'https?://[^\s<>"]+?/confirm[^\s<>"]+',
+    r'https?://[^\s<>"]+?/activate[^\s<>"]+',
+    r'https?://[^\s<>"]+?/validation[^\s<>"]+',
+]
+
+
+def legacy_extract_code(content: str) -> Optional[str]:
+    text_content = BeautifulSoup(content, 'html.parser').get_text()
+    for pattern in LEGACY_CODE_PATTERNS:
+        matches = re.findall(pattern, text_content, re.IGNORECASE)
+        if matches:
+            for match in matches:
+                if re.match(r'^\d{6}$', match):
+                    return match
+            return matches[0]
+    return None
+
+
+def legacy_extract_link(content: str) -> Optional[str]:
+    soup = BeautifulSoup(content, 'html.parser')
+    for a in soup.find_all('a'):
+        href = a.get('href', '')
+        if any(keyword in href.lower() for keyword in ['verify', 'confirm', 'activate', 'validation']):
+            return href
+    text_content = soup.get_text()
+    for pattern in LEGACY_LINK_PATTERNS:
+        matches = re.findall(pattern, text_content)
+        if matches:
+            return matches[0]
+    return None
+
+
+def build_messages(size: int) -> List[Message]:
+    return [
+        Message(
+            message_id=raw["id"],
+            subject=raw["subject"],
+            sender=raw["from"],
+            recipient=raw["to"],
+            date=raw["date"],
+            content=raw["body_text"],
+            html_content=raw["body_html"]
+        )
+        for raw in make_corpus(size)
+    ]
+
+
+def measure(name: str, fn: Callable[[], None], rounds: int, per_round: int):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"{name:<32} best {best * 1000:9.2f} ms/round   {best / per_round * 1e6:9.1f} us/message")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200, help="писем в корпусе")
+    parser.add_argument("--rounds", type=int, default=5, help="повторов каждого замера")
+    args = parser.parse_args()
+
+    messages = build_messages(args.size)
+    extractor = CodeExtractor(cache_size=args.size * 2)
+
+    # Новый движок должен находить те же коды на этом корпусе
+    mismatches = sum(
+        1 for msg in messages
+        if extractor.extract(msg.content).code != legacy_extract_code(msg.content)
+    )
+    print(f"corpus: {len(messages)} messages, code mismatches vs legacy: {mismatches}")
+
+    def legacy():
+        for msg in messages:
+            legacy_extract_code(msg.content)
+            legacy_extract_link(msg.content)
+
+    def engine():
+        for msg in messages:
+            extractor.extract(msg.content)
+
+    def memoized():
+        for msg in messages:
+            extractor.extract_message(msg)
+
+    memoized()  # прогрев кэша: так выглядит каждый следующий 5-секундный опрос
+    base = measure("legacy (2 parses + 6 regexes)", legacy, args.rounds, len(messages))
+    single = measure("engine (single pass)", engine, args.rounds, len(messages))
+    cached = measure("engine, repeated poll (memo)", memoized, args.rounds, len(messages))
+    print(f"speedup: single pass x{base / single:.1f}, repeated poll x{base / cached:.0f}")
+
+
+if __name__ == "__main__":
+    main()
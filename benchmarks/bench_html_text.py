@@ -0,0 +1,41 @@
+"""Сравнение backend'ов HTML -> текст на корпусе писем.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_html_text [--size 200] [--rounds 5]
+"""
+import argparse
+import time
+
+from benchmarks.corpus import make_corpus
+from services.html_text import AUTO_ORDER, create_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200, help="писем в корпусе")
+    parser.add_argument("--rounds", type=int, default=5, help="повторов каждого замера")
+    args = parser.parse_args()
+
+    documents = [raw["body_html"] for raw in make_corpus(args.size) if raw["body_html"]]
+    print(f"corpus: {len(documents)} HTML documents, "
+          f"{sum(len(d) for d in documents) // len(documents)} chars on average")
+
+    baseline = None
+    for name in reversed(AUTO_ORDER):
+        backend = create_backend(name)
+        if backend.name != name:
+            print(f"{name:<12} not installed")
+            continue
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            for html in documents:
+                backend.parse(html)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        baseline = baseline or best
+        print(f"{name:<12} {best / len(documents) * 1e6:9.1f} us/document   x{baseline / best:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Нагрузочный прогон API против локальной замены upstream.
+
+Виртуальные пользователи ведут себя как фронтенд: создают ящик, опрашивают
+входящие с If-None-Match, иногда запрашивают коды и отдельное письмо, в
+конце удаляют ящик. Приложение main.app вызывается в процессе через ASGI,
+а его общий HTTP-клиент направлен в benchmarks.fake_upstream.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_load [--users 50] [--duration 20] [--latency 0.05]
+    python -m benchmarks.bench_load --save baseline.json
+    python -m benchmarks.bench_load --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.fake_upstream import FakeUpstream, add_profile_arguments, profile_from_args
+
+API = "http://bench"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        result = {}
+        for name, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            result[name] = {
+                "count": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "rps": len(ordered) / elapsed,
+                "p50_ms": percentile(ordered, 0.50) * 1000,
+                "p99_ms": percentile(ordered, 0.99) * 1000,
+            }
+        return result
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def virtual_user(client: httpx.AsyncClient, recorder: Recorder, args: argparse.Namespace,
+                       rnd: random.Random, deadline: float):
+    while time.monotonic() < deadline:
+        response = await recorder.call(client, "create", "POST", "/api/email/create", json={"service": "temp-mail"})
+        if response.status_code != 200:
+            await asyncio.sleep(args.poll_interval)
+            continue
+        email = response.json()["email"]
+
+        etag: Optional[str] = None
+        for _ in range(args.polls):
+            if time.monotonic() >= deadline:
+                break
+            headers = {"If-None-Match": etag} if etag else {}
+            response = await recorder.call(client, "messages", "GET", f"/api/email/messages/{email}", headers=headers)
+            if response.status_code == 200:
+                etag = response.headers.get("etag")
+                messages = response.json()
+                if messages and rnd.random() < args.open_ratio:
+                    message_id = rnd.choice(messages)["message_id"]
+                    await recorder.call(client, "message", "GET", f"/api/email/messages/{email}/{message_id}")
+            if rnd.random() < args.codes_ratio:
+                await recorder.call(client, "codes", "GET", f"/api/email/codes/{email}")
+            # Пользователи опрашивают не синхронно
+            await asyncio.sleep(args.poll_interval * rnd.uniform(0.5, 1.5))
+
+        if rnd.random() < args.delete_ratio:
+            await recorder.call(client, "delete", "DELETE", f"/api/email/delete/{email}")
+
+
+def print_report(report: Dict[str, dict], baseline: Optional[Dict[str, dict]]):
+    print(f"{'endpoint':<10} {'count':>7} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, row in report.items():
+        line = (f"{name:<10} {row['count']:>7} {row['errors']:>6} {row['rps']:>8.1f} "
+                f"{row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        base = (baseline or {}).get(name)
+        if base:
+            line += (f"   p50 {row['p50_ms'] / base['p50_ms']:.2f}x"
+                     f"  p99 {row['p99_ms'] / base['p99_ms']:.2f}x"
+                     f"  rps {row['rps'] / base['rps']:.2f}x")
+        print(line)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, dict]:
+    # Настройки читаются при импорте main, поэтому окружение готовится заранее
+    workdir = tempfile.mkdtemp(prefix="neuromail-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/bench.db")
+    os.environ.setdefault("CACHE_URL", f"sqlite:///{workdir}/cache.db")
+    os.environ.setdefault("LOG_FILE", os.path.join(workdir, "app.log"))
+    os.environ.setdefault("METRICS_DIR", "")
+    os.environ.setdefault("MAIL_PROVIDERS", "glitchy")
+    import main
+
+    fake = FakeUpstream(profile_from_args(args))
+    # Все провайдеры, какой бы у них ни был base_url, попадают в заглушку
+    main.upstream._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app))
+    await main.app.router.startup()
+    try:
+        recorder = Recorder()
+        deadline = time.monotonic() + args.duration
+        started = time.perf_counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url=API,
+                                     timeout=60) as client:
+            await asyncio.gather(*(
+                virtual_user(client, recorder, args, random.Random(args.seed + n), deadline)
+                for n in range(args.users)
+            ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await main.app.router.shutdown()
+
+    report = recorder.report(elapsed)
+    total = sum(row["count"] for row in report.values())
+    print(f"{args.users} users, {elapsed:.1f}s, {total} requests, {total / elapsed:.1f} req/s; "
+          f"upstream calls: {dict(sorted(fake.requests.items()))}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность прогона, секунды")
+    parser.add_argument("--polls", type=int, default=10, help="опросов входящих на один ящик")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="пауза между опросами, секунды")
+    parser.add_argument("--codes-ratio", type=float, default=0.2, help="доля опросов с запросом кодов")
+    parser.add_argument("--open-ratio", type=float, default=0.1, help="доля опросов с открытием письма")
+    parser.add_argument("--delete-ratio", type=float, default=0.5, help="доля ящиков, удаляемых в конце")
+    parser.add_argument("--save", help="сохранить результат в JSON как baseline")
+    parser.add_argument("--baseline", help="сравнить с сохраненным результатом")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
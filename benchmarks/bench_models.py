@@ -0,0 +1,75 @@
+"""Микробенчмарк построения писем из ответа upstream.
+
+Меряет путь одного письма от словаря /see до тела ответа API: разбор
+даты и создание Message, извлечение кода и сериализацию в JSON.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_models [--size 200] [--rounds 5]
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Callable, List
+
+import orjson
+
+from benchmarks.corpus import make_corpus
+from models.message import Message
+from services.code_extractor import CodeExtractor
+
+
+def build_message(raw: dict) -> Message:
+    # То же, что EmailReader._build_message
+    return Message(
+        message_id=str(raw["id"]),
+        subject=raw.get("subject", ""),
+        sender=raw.get("from", ""),
+        recipient=raw.get("to", ""),
+        date=datetime.fromisoformat(raw["date"].replace("Z", "+00:00")),
+        content=raw.get("body_text", ""),
+        html_content=raw.get("body_html", ""),
+    )
+
+
+def measure(name: str, items: list, fn: Callable, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        timings.append(time.perf_counter() - started)
+    print(f"{name:<28} {min(timings) / len(items) * 1e6:9.1f} us/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200, help="писем в корпусе")
+    parser.add_argument("--rounds", type=int, default=5, help="повторов каждого замера")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size)
+    messages: List[Message] = [build_message(raw) for raw in corpus]
+    extractor = CodeExtractor()
+
+    def serialize(msg: Message):
+        # То же, что main.message_payload для полного списка
+        extracted = extractor.extract_message(msg)
+        return orjson.dumps({
+            "message_id": msg.message_id,
+            "subject": msg.subject,
+            "sender": msg.sender,
+            "date": msg.date,
+            "verification_code": extracted.code,
+            "verification_link": extracted.link,
+            "content": msg.content,
+            "html_content": msg.html_content
+        })
+
+    measure("Message from /see dict", corpus, build_message, args.rounds)
+    measure("extract (cold)", messages, lambda msg: extractor.extract(msg.body_text, msg.html_content), args.rounds)
+    measure("extract (memoized)", messages, extractor.extract_message, args.rounds)
+    measure("payload + orjson", messages, serialize, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Время запуска воркера: от старта процесса uvicorn до первого ответа.
+
+Запускает ``--workers`` процессов uvicorn с main:app одновременно, как это
+делает uvicorn --workers N (каждый на своем порту, чтобы время мерилось
+для каждого воркера отдельно), и ждет первого успешного ответа /health.
+Пул готовых ящиков отключен, а upstream указывает на закрытый локальный
+порт, поэтому сеть не нужна. Отдельно меряется время ``import main``,
+с ``--imports`` печатаются самые дорогие модули по ``python -X importtime``.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup [--runs 5] [--workers 4] [--imports 15]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+TIMEOUT = 60.0
+
+
+def child_env(workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "CACHE_URL": f"sqlite:///{workdir}/cache.db",
+        "LOG_FILE": os.path.join(workdir, "app.log"),
+        "METRICS_DIR": "",
+        "MAILBOX_POOL_SIZE": "0",
+        "UPSTREAM_BASE_URL": "http://127.0.0.1:9",
+    })
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def boot_workers(count: int, env: Dict[str, str]) -> List[float]:
+    """Запускает count воркеров одновременно; секунды до первого ответа каждого"""
+    ports = [free_port() for _ in range(count)]
+    started = time.perf_counter()
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for port in ports
+    ]
+    ready: Dict[int, float] = {}
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while len(ready) < count:
+                if time.perf_counter() - started > TIMEOUT:
+                    raise RuntimeError(f"Workers did not answer within {TIMEOUT:.0f}s")
+                for port, proc in zip(ports, procs):
+                    if port in ready:
+                        continue
+                    if proc.poll() is not None:
+                        raise RuntimeError(f"Worker on port {port} exited with code {proc.returncode}")
+                    try:
+                        if client.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                            ready[port] = time.perf_counter() - started
+                    except httpx.TransportError:
+                        pass
+                time.sleep(0.005)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return [ready[port] for port in ports]
+
+
+def import_time(env: Dict[str, str]) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(env: Dict[str, str], limit: int) -> List[str]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                         env=env, capture_output=True, text=True, check=True)
+    rows = []
+    # Строки вида "import time:   1234 |   5678 |     package.module"
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return [f"{cumulative / 1000:9.1f} {own / 1000:9.1f}  {name}" for cumulative, own, name in rows[:limit]]
+
+
+def summary(values: List[float]) -> str:
+    ms = sorted(v * 1000 for v in values)
+    return f"min {ms[0]:7.0f}  median {statistics.median(ms):7.0f}  max {ms[-1]:7.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="сколько раз запускать воркеры")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров, запускаемых одновременно")
+    parser.add_argument("--imports", type=int, default=0, help="показать N самых дорогих импортов")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="neuromail-startup-")
+    env = child_env(workdir)
+
+    imports = [import_time(env) for _ in range(args.runs)]
+    print(f"import main            {summary(imports)}")
+
+    first_request: List[float] = []
+    for run in range(args.runs):
+        times = boot_workers(args.workers, env)
+        first_request.extend(times)
+        print(f"run {run + 1}: " + ", ".join(f"{t * 1000:.0f}" for t in times) + " ms to first response")
+    print(f"time to first request  {summary(first_request)}  ({args.workers} workers x {args.runs} runs)")
+
+    if args.imports:
+        print(f"\n{'cumul ms':>9} {'self ms':>9}  module")
+        for line in top_imports(env, args.imports):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
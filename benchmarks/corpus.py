@@ -0,0 +1,94 @@
+"""Набор правдоподобных писем с кодами подтверждения для бенчмарков.
+
+Генерация детерминирована (фиксированный seed), чтобы результаты разных
+прогонов можно было сравнивать между собой.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+SENDERS = [
+    ("GitHub", "noreply@github.com"),
+    ("Discord", "noreply@discord.com"),
+    ("Steam Support", "noreply@steampowered.com"),
+    ("Telegram", "no-reply@telegram.org"),
+    ("Notion Team", "notify@mail.notion.so"),
+    ("Яндекс ID", "id@yandex.ru"),
+]
+
+SUBJECTS = [
+    "Your verification code",
+    "Confirm your email address",
+    "Код подтверждения",
+    "Activate your account",
+    "Security code for sign in",
+]
+
+PLAIN_TEMPLATES = [
+    "Hi there,\n\nYour verification code: {code}\n\nThe code expires in 10 minutes.\n"
+    "If you didn't request this, ignore this email.\n\nThanks,\nThe {brand} Team",
+    "Здравствуйте!\n\nВаш код подтверждения: {code}\nНикому не сообщайте этот код.\n",
+    "Please confirm your address by visiting https://{domain}/confirm?token={token}\n"
+    "or enter the one-time code {code} in the app.",
+]
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{subject}</title>
+<style>body{{font-family:Arial,sans-serif}} .btn{{background:#5865f2;color:#fff;padding:12px 24px}}</style>
+</head><body>
+<table width="100%" cellpadding="0" cellspacing="0"><tr><td align="center">
+<table width="600" cellpadding="0" cellspacing="0">
+<tr><td><img src="https://{domain}/static/logo.png" alt="{brand}" width="120"></td></tr>
+<tr><td><h1>Welcome to {brand}!</h1>
+<p>Thanks for signing up. Use the security code below to finish registration:</p>
+<p style="font-size:32px;letter-spacing:6px"><b>{code}</b></p>
+<p>Or click the button: <a class="btn" href="https://{domain}/verify?token={token}">Verify email</a></p>
+</td></tr>
+{filler}
+<tr><td><a href="https://{domain}/unsubscribe">Unsubscribe</a> &middot;
+<a href="https://{domain}/privacy">Privacy</a> &copy; 2024 {brand} Inc.</td></tr>
+</table></td></tr></table>
+</body></html>"""
+
+FILLER_ROW = (
+    '<tr><td><p>Discover new features in {brand}: faster sync, shared workspaces '
+    'and <a href="https://{domain}/blog/{n}">much more</a>. Read our latest news &amp; updates.</p></td></tr>'
+)
+
+
+def make_corpus(size: int = 200, seed: int = 42, filler_rows: int = 20) -> List[Dict]:
+    """Письма в формате ответа upstream (/see): id, from, to, subject, date, body_text, body_html"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    messages = []
+    for i in range(size):
+        brand, sender = rnd.choice(SENDERS)
+        domain = sender.split("@", 1)[1]
+        code = "".join(rnd.choice("0123456789") for _ in range(6))
+        token = "".join(rnd.choice("abcdef0123456789") for _ in range(32))
+        subject = rnd.choice(SUBJECTS)
+
+        if i % 3 == 0:
+            body_text = rnd.choice(PLAIN_TEMPLATES).format(code=code, brand=brand, domain=domain, token=token)
+            body_html = ""
+        else:
+            filler = "\n".join(
+                FILLER_ROW.format(brand=brand, domain=domain, n=n)
+                for n in range(rnd.randint(filler_rows // 2, filler_rows))
+            )
+            body_html = HTML_TEMPLATE.format(
+                subject=subject, brand=brand, domain=domain, code=code, token=token, filler=filler
+            )
+            # Как и у upstream, HTML-письма часто приходят без текстовой версии
+            body_text = "" if i % 2 else body_html
+
+        messages.append({
+            "id": f"msg-{i}",
+            "from": f"{brand} <{sender}>",
+            "to": "user@tempmail.example",
+            "subject": subject,
+            "date": (now - timedelta(minutes=i)).isoformat(),
+            "body_text": body_text,
+            "body_html": body_html,
+        })
+    return messages
@@ -0,0 +1,155 @@
+"""Локальная замена tempmail.glitchy.workers.dev для нагрузочных тестов.
+
+Отвечает на /get, /custom, /see, /message и /mailbox/{email} в формате
+настоящего сервиса. Задержка, доля ошибок и размер ящиков настраиваются,
+случайность детерминирована seed'ом.
+
+Можно подключить в процесс через httpx.ASGITransport (так делает
+bench_load) или запустить отдельным сервером и указать UPSTREAM_BASE_URL:
+    python -m benchmarks.fake_upstream --port 8025 --latency 0.08
+"""
+import argparse
+import asyncio
+import itertools
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from benchmarks.corpus import make_corpus
+
+
+@dataclass
+class UpstreamProfile:
+    latency: float = 0.05        # средняя задержка ответа, секунды
+    jitter: float = 0.5          # разброс задержки: latency * (1 +- jitter)
+    error_rate: float = 0.0      # доля ответов 503
+    inbox_size: int = 5          # писем в новом ящике
+    arrival_rate: float = 0.05   # вероятность нового письма при каждом /see
+    seed: int = 42
+
+
+class FakeUpstream:
+    def __init__(self, profile: UpstreamProfile):
+        self.profile = profile
+        self.random = random.Random(profile.seed)
+        # Тела писем берутся по кругу из корпуса, чтобы разбор был как в жизни
+        self.corpus = make_corpus(max(50, profile.inbox_size * 4), seed=profile.seed)
+        self.mailboxes: Dict[str, List[dict]] = {}
+        self.requests: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self.app = Starlette(routes=[
+            Route("/get", self.get),
+            Route("/custom", self.custom),
+            Route("/see", self.see),
+            Route("/message", self.message),
+            Route("/mailbox/{email}", self.mailbox, methods=["GET", "DELETE"]),
+        ])
+
+    async def _simulate(self, endpoint: str):
+        """Задержка и случайный сбой; возвращает ответ-ошибку или None"""
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        profile = self.profile
+        if profile.latency:
+            spread = profile.latency * profile.jitter
+            await asyncio.sleep(max(0.0, self.random.uniform(profile.latency - spread, profile.latency + spread)))
+        if profile.error_rate and self.random.random() < profile.error_rate:
+            return JSONResponse({"error": "Service Unavailable"}, status_code=503)
+        return None
+
+    def _new_message(self, email: str, age_minutes: int = 0) -> dict:
+        n = next(self._ids)
+        message = dict(self.corpus[n % len(self.corpus)], id=f"m{n}", to=email)
+        message["date"] = (datetime.now() - timedelta(minutes=age_minutes)).isoformat()
+        return message
+
+    def _open(self, email: str) -> dict:
+        self.mailboxes[email] = [
+            self._new_message(email, age) for age in range(self.profile.inbox_size, 0, -1)
+        ]
+        return {"mail": email}
+
+    async def get(self, request: Request):
+        failure = await self._simulate("get")
+        if failure:
+            return failure
+        username = "".join(self.random.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(10))
+        return JSONResponse(self._open(f"{username}@fake-upstream.test"))
+
+    async def custom(self, request: Request):
+        failure = await self._simulate("custom")
+        if failure:
+            return failure
+        return JSONResponse(self._open(f"{request.query_params['username']}@fake-upstream.test"))
+
+    async def see(self, request: Request):
+        failure = await self._simulate("see")
+        if failure:
+            return failure
+        email = request.query_params.get("mail", "")
+        inbox = self.mailboxes.setdefault(email, [])
+        if self.random.random() < self.profile.arrival_rate:
+            inbox.append(self._new_message(email))
+        return JSONResponse({"messages": inbox})
+
+    async def message(self, request: Request):
+        failure = await self._simulate("message")
+        if failure:
+            return failure
+        email = request.query_params.get("mail", "")
+        message_id = request.query_params.get("id", "")
+        for message in self.mailboxes.get(email, []):
+            if message["id"] == message_id:
+                return JSONResponse(message)
+        return JSONResponse({"error": "Not Found"}, status_code=404)
+
+    async def mailbox(self, request: Request):
+        failure = await self._simulate("mailbox")
+        if failure:
+            return failure
+        email = request.path_params["email"]
+        if email not in self.mailboxes:
+            return JSONResponse({"error": "Not Found"}, status_code=404)
+        if request.method == "DELETE":
+            del self.mailboxes[email]
+        return JSONResponse({"mail": email})
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка upstream, секунды")
+    parser.add_argument("--jitter", type=float, default=0.5, help="разброс задержки, доля от latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--inbox-size", type=int, default=5, help="писем в новом ящике")
+    parser.add_argument("--arrival-rate", type=float, default=0.05, help="вероятность нового письма на /see")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def profile_from_args(args: argparse.Namespace) -> UpstreamProfile:
+    return UpstreamProfile(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        inbox_size=args.inbox_size,
+        arrival_rate=args.arrival_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(FakeUpstream(profile_from_args(args)).app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,102 @@ class Settings(BaseSettings):
     # Database
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./emailbot.db")
     
-    # Logging
+    # Mail providers, in priority order: glitchy, fallback, fake.
+    # fallback is opt-in: mailbox addresses are sent to FALLBACK_BASE_URL, so it must be a temp-mail
+    # compatible mirror you operate or trust (see .env.example)
+    mail_providers: str = os.getenv("MAIL_PROVIDERS", "glitchy")
+    upstream_base_url: str = os.getenv("UPSTREAM_BASE_URL", "https://tempmail.glitchy.workers.dev")
+    fallback_base_url: str = os.getenv("FALLBACK_BASE_URL", "")
+    # Mailbox domains each provider serves, comma-separated; reads and deletes only go to a mailbox's
+    # providers. Domains of mailboxes created since startup are learned automatically
+    upstream_domains: str = os.getenv("UPSTREAM_DOMAINS", "")
+    fallback_domains: str = os.getenv("FALLBACK_DOMAINS", "")
+    hedge_enabled: bool = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+    hedge_percentile: float = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    hedge_min_delay: float = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+    hedge_default_delay: float = float(os.getenv("HEDGE_DEFAULT_DELAY", "1.0"))
+    
+    # Upstream HTTP client
+    upstream_http2: bool = os.getenv("UPSTREAM_HTTP2", "true").lower() == "true"
+    upstream_max_connections: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "50"))
+    upstream_max_keepalive: int = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+    upstream_keepalive_expiry: float = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+    upstream_connect_timeout: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+    upstream_read_timeout: float = float(os.getenv("UPSTREAM_READ_TIMEOUT", "15"))
+    upstream_pool_timeout: float = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5"))
+    
+    # Upstream rate limiting, per worker (0 disables): steady requests/s, burst, concurrent requests, max queue wait
+    upstream_rate_limit: float = float(os.getenv("UPSTREAM_RATE_LIMIT", "20"))
+    upstream_rate_burst: float = float(os.getenv("UPSTREAM_RATE_BURST", "20"))
+    upstream_max_in_flight: int = int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "20"))
+    upstream_queue_timeout: float = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))
+    
+    # Upstream failure handling
+    upstream_max_attempts: int = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+    retry_budget_ratio: float = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+    retry_backoff_base: float = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+    retry_backoff_cap: float = float(os.getenv("RETRY_BACKOFF_CAP", "4"))
+    breaker_failure_threshold: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    breaker_reset_timeout: float = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+    
+    # HTML parsing: auto, selectolax, lxml or bs4
+    html_parser_backend: str = os.getenv("HTML_PARSER_BACKEND", "auto")
+    
+    # CPU-heavy parsing of large messages: thread, process or inline pool; bodies shorter than the threshold (chars) stay on the event loop
+    cpu_pool_mode: str = os.getenv("CPU_POOL_MODE", "thread")
+    cpu_pool_workers: int = int(os.getenv("CPU_POOL_WORKERS", "2"))
+    cpu_inline_threshold: int = int(os.getenv("CPU_INLINE_THRESHOLD", "20000"))
+    cpu_batch_size: int = int(os.getenv("CPU_BATCH_SIZE", "16"))
+    # How often the event loop lag probe runs, seconds (0 disables it)
+    loop_lag_interval: float = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+    
+    # Inbox cache
+    inbox_cache_ttl: float = float(os.getenv("INBOX_CACHE_TTL", "3.0"))
+    # Cache backend: memory (per process) or sqlite (shared by all workers on the machine)
+    cache_backend: str = os.getenv("CACHE_BACKEND", "memory")
+    cache_url: str = os.getenv("CACHE_URL", "sqlite:///./data/db/cache.db")
+    
+    # Push updates (SSE)
+    inbox_watch_interval: float = float(os.getenv("INBOX_WATCH_INTERVAL", "5.0"))
+    # Adaptive polling: fast right after the mailbox is created or a code waiter arrives, slow for old idle ones
+    inbox_watch_fast_interval: float = float(os.getenv("INBOX_WATCH_FAST_INTERVAL", "1.5"))
+    inbox_watch_fast_period: float = float(os.getenv("INBOX_WATCH_FAST_PERIOD", "120"))
+    inbox_watch_slow_interval: float = float(os.getenv("INBOX_WATCH_SLOW_INTERVAL", "15"))
+    inbox_watch_slow_after: float = float(os.getenv("INBOX_WATCH_SLOW_AFTER", "900"))
+    code_wait_max_timeout: float = float(os.getenv("CODE_WAIT_MAX_TIMEOUT", "120"))
+    sse_keepalive_interval: float = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15.0"))
+    
+    # Pre-created mailbox pool (0 disables it)
+    mailbox_pool_size: int = int(os.getenv("MAILBOX_POOL_SIZE", "5"))
+    mailbox_pool_max_age: float = float(os.getenv("MAILBOX_POOL_MAX_AGE", "600"))
+    mailbox_pool_refill_concurrency: int = int(os.getenv("MAILBOX_POOL_REFILL_CONCURRENCY", "2"))
+    
+    # Mailbox lifetime (the frontend shows a 10h countdown) and the background sweeper
+    mailbox_ttl_hours: float = float(os.getenv("MAILBOX_TTL_HOURS", "10"))
+    mailbox_idle_ttl_hours: float = float(os.getenv("MAILBOX_IDLE_TTL_HOURS", "0"))
+    mailbox_sweep_interval: float = float(os.getenv("MAILBOX_SWEEP_INTERVAL", "60"))
+    mailbox_sweep_batch: int = int(os.getenv("MAILBOX_SWEEP_BATCH", "100"))
+    mailbox_sweep_concurrency: int = int(os.getenv("MAILBOX_SWEEP_CONCURRENCY", "5"))
+    mailbox_memory_idle: float = float(os.getenv("MAILBOX_MEMORY_IDLE", "1800"))
+    
+    # Batch API: max mailboxes per call and upstream calls in flight per batch
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+    batch_concurrency: int = int(os.getenv("BATCH_CONCURRENCY", "10"))
+    
+    # Static files: max-age for requests without the current ?v= hash (0 = revalidate every time)
+    static_files_max_age: int = int(os.getenv("STATIC_FILES_MAX_AGE", "0"))
+    
+    # Metrics: per-worker snapshots are merged from this directory (empty = this process only)
+    metrics_dir: str = os.getenv("METRICS_DIR", "data/metrics")
+    metrics_flush_interval: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+    
+    # Logging: JSON lines, shared by all workers
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
-    log_file: str = os.getenv("LOG_FILE", "app.log") 
\ No newline at end of file
+    log_file: str = os.getenv("LOG_FILE", "app.log")
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    log_rotation_mb: int = int(os.getenv("LOG_ROTATION_MB", "500"))
+    log_retention_days: float = float(os.getenv("LOG_RETENTION_DAYS", "10"))
+    # Share of successful requests that get an access log line; errors and slow requests are always logged
+    log_success_sample_rate: float = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "0.1"))
+    log_route_sample_rates: str = os.getenv("LOG_ROUTE_SAMPLE_RATES", "/health=0,/metrics=0,/static=0.01")
+    log_slow_request_ms: float = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000")) 
\ No newline at end of file
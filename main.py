@@ -1,22 +1,39 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, FileResponse
-from fastapi import Request
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, ORJSONResponse
+from fastapi import Query
+from fastapi import Request, Response
+from pydantic import BaseModel, Field
 from loguru import logger
-import uvicorn
 import os
+import orjson
+import asyncio
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Union
 from datetime import datetime
 from pathlib import Path
-import logging
+import time
+from starlette.routing import Match
 
 from services.email_creator import EmailCreator
-from services.email_reader import EmailReader
+from services.email_reader import EmailReader, InboxCache
 from services.code_extractor import CodeExtractor
+from services.cpu_pool import CpuOffloader
+from services.inbox_watcher import InboxWatcher
+from services.html_text import configure_backend
+from services.storage import Storage
+from services.http_client import UpstreamClient
+from services.mail_providers import build_router
+from services.mailbox_pool import MailboxPool
+from services.mailbox_sweeper import MailboxSweeper
+from services.batch import gather_bounded
+from services.concurrency import KeyedLock
+from services.log_pipeline import RequestLogSampler, setup_logging
+from services.shared_cache import create_cache_backend
+from services.page_cache import PageCache
+from services.static_assets import AssetManifest, CompressedStaticFiles
+from services import metrics
 from models.email_account import EmailAccount
 from models.message import Message
 from config import Settings
@@ -27,16 +44,27 @@ load_dotenv()
 # Initialize settings
 settings = Settings()
 
+# Один JSON-конвейер логов для loguru и stdlib logging; поток записи
+# запускается в startup, до этого записи копятся в его очереди
+log_writer = setup_logging(settings)
+request_sampler = RequestLogSampler(
+    settings.log_success_sample_rate,
+    settings.log_route_sample_rates,
+    settings.log_slow_request_ms
+)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Email Bot API",
     description="API for automated email account creation and management",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Добавляем обработчик событий запуска и остановки
 @app.on_event("startup")
 async def startup_event():
+    log_writer.start()
     logger.info("=== Starting up server ===")
     try:
         # Создаем необходимые директории
@@ -50,21 +78,24 @@ async def startup_event():
         for dir_path in required_dirs:
             try:
                 Path(dir_path).mkdir(parents=True, exist_ok=True)
-                logger.info(f"Created directory: {dir_path}")
+                logger.debug(f"Created directory: {dir_path}")
             except Exception as e:
                 logger.warning(f"Error creating directory {dir_path}: {e}")
         
-        # Настраиваем логирование
-        logging.basicConfig(
-            filename='data/logs/app.log',
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        logger.info("Logging initialized")
+        static_manifest.build()
+        register_pages()
+        await upstream.start()
+        loop_lag.start()
+        # Страницы рендерятся в фоне: воркер начинает принимать запросы, не дожидаясь Jinja2
+        page_cache.warm()
+        mailbox_pool.start()
+        mailbox_sweeper.start()
+        if settings.metrics_dir:
+            metrics.registry.configure(settings.metrics_dir)
+            metrics.registry.start(settings.metrics_flush_interval)
         
-        # Проверяем доступность сервисов
-        await email_creator.health_check()
-        await email_reader.health_check()
+        # Доступность upstream не проверяется здесь: это задержало бы каждый запуск
+        # воркера, а состояние сервисов и так видно в /health
         logger.info("All services initialized successfully")
         
     except Exception as e:
@@ -77,13 +108,21 @@ async def shutdown_event():
     logger.info("=== Server shutdown initiated ===")
     try:
         # Освобождаем ресурсы
-        await email_creator.cleanup()
-        await email_reader.cleanup()
+        await inbox_watcher.stop()
+        await mailbox_pool.stop()
+        await mailbox_sweeper.stop()
+        await upstream.close()
+        await storage.close()
+        await cache_backend.close()
+        await metrics.registry.stop()
+        await loop_lag.stop()
+        cpu_pool.shutdown()
         logger.info("Resources cleaned up successfully")
     except Exception as e:
         logger.error(f"Shutdown error: {str(e)}", exc_info=True)
     finally:
         logger.info("=== Server shutdown complete ===")
+        log_writer.stop()
 
 # Add CORS middleware
 app.add_middleware(
@@ -94,52 +133,163 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add cache control middleware
-@app.middleware("http")
-async def add_cache_control_headers(request: Request, call_next):
-    response = await call_next(request)
-    if request.url.path.startswith("/static"):
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-    return response
+class CompressionMiddleware(GZipMiddleware):
+    """gzip для JSON и статики без готовой сжатой копии; SSE не сжимается, иначе события застревают в буфере"""
 
-# Configure logging
-logger.remove()  # Remove default handler
-logger.add(
-    settings.log_file,
-    level=settings.log_level,
-    rotation="500 MB",
-    retention="10 days",
-    enqueue=True,
-    backtrace=True,
-    diagnose=True
-)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/email/stream/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
-# Add error logging middleware
+app.add_middleware(CompressionMiddleware, minimum_size=1024, compresslevel=6)
+
+# Add request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    started = time.perf_counter()
+    # Шаблон маршрута кладет track_metrics, он срабатывает раньше
+    route = getattr(request.state, "route_label", request.url.path)
     try:
         response = await call_next(request)
-        logger.info(f"Request: {request.method} {request.url.path} - Status: {response.status_code}")
-        return response
     except Exception as e:
-        logger.error(f"Request failed: {request.method} {request.url.path} - Error: {str(e)}")
+        logger.bind(method=request.method, path=request.url.path, route=route).error(
+            "Request failed: {} {} - Error: {}", request.method, request.url.path, e
+        )
         raise
+    duration_ms = (time.perf_counter() - started) * 1000
+    if request_sampler.should_log(route, response.status_code, duration_ms):
+        logger.bind(
+            method=request.method, path=request.url.path, route=route,
+            status=response.status_code, duration_ms=round(duration_ms, 1)
+        ).info("Request: {} {} - Status: {}", request.method, request.url.path, response.status_code)
+    return response
 
-# Mount static files with custom config
-app.mount("/static", StaticFiles(directory="static", html=True, check_dir=True), name="static")
+def route_label(request: Request) -> str:
+    """Шаблон пути вместо самого пути, чтобы адреса ящиков не плодили метки"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
 
-# Initialize templates with custom config
-templates = Jinja2Templates(directory="templates")
-templates.env.globals.update({
-    "static_url": lambda path: f"/static/{path}?v={os.path.getmtime(os.path.join('static', path))}"
-})
+@app.middleware("http")
+async def track_metrics(request: Request, call_next):
+    route = route_label(request)
+    request.state.route_label = route
+    status = 500
+    started = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=route)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=str(status))
+
+# Хэши статики считаются один раз в startup: ссылки с ?v=<hash> кэшируются навсегда
+static_manifest = AssetManifest("static")
+app.mount(
+    "/static",
+    CompressedStaticFiles(
+        directory="static", html=True, check_dir=True,
+        manifest=static_manifest, max_age=settings.static_files_max_age
+    ),
+    name="static"
+)
+
+_template_env = None
+
+def render_template(name: str) -> str:
+    """Jinja2 нужен только для рендера страниц в page_cache, поэтому загружается при первом рендере"""
+    global _template_env
+    if _template_env is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        _template_env = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape())
+        _template_env.globals["static_url"] = static_manifest.url
+    return _template_env.get_template(name).render()
+
+YANDEX_VERIFICATION_HTML = """<html>
+    <head>
+        <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+    </head>
+    <body>Verification: 80d47bc6703d08b0</body>
+</html>"""
+
+# Страницы без данных запроса отдаются готовыми из памяти
+page_cache = PageCache()
+
+def render_index() -> str:
+    # Главная перерисовывается и при изменении статики: ссылки ?v= должны
+    # указывать на новые хэши, иначе браузер закэширует новый файл под старым адресом
+    static_manifest.refresh()
+    return render_template("index.html")
+
+def register_pages():
+    """Вызывается в startup, когда манифест статики уже собран"""
+    page_cache.register(
+        "index",
+        render_index,
+        ["templates/index.html"] + [f"static/{path}" for path in static_manifest.hashes]
+    )
+    page_cache.register("yandex_verification", lambda: YANDEX_VERIFICATION_HTML)
 
 # Initialize services
-email_creator = EmailCreator(settings)
-email_reader = EmailReader(settings)
+configure_backend(settings.html_parser_backend)
+storage = Storage(settings.database_url)
+upstream = UpstreamClient(settings)
+mail_providers = build_router(settings, upstream)
+email_creator = EmailCreator(settings, storage, mail_providers)
+cache_backend = create_cache_backend(settings)
+email_reader = EmailReader(settings, storage, mail_providers, cache_backend)
 code_extractor = CodeExtractor()
+cpu_pool = CpuOffloader(
+    settings.cpu_pool_mode,
+    workers=settings.cpu_pool_workers,
+    inline_threshold=settings.cpu_inline_threshold,
+    batch_size=settings.cpu_batch_size,
+    parser_backend=settings.html_parser_backend
+)
+loop_lag = metrics.LoopLagMonitor(settings.loop_lag_interval)
+# Создание и удаление одного и того же ящика выполняются по очереди
+mailbox_locks = KeyedLock()
+inbox_watcher = InboxWatcher(
+    email_reader,
+    settings.inbox_watch_interval,
+    fast_interval=settings.inbox_watch_fast_interval,
+    fast_period=settings.inbox_watch_fast_period,
+    slow_interval=settings.inbox_watch_slow_interval,
+    slow_after=settings.inbox_watch_slow_after,
+    # Ожидающим код нужен только результат извлечения, текст готовит поток SSE
+    prepare=lambda messages: cpu_pool.prepare(code_extractor, messages)
+)
+mailbox_pool = MailboxPool(
+    email_creator,
+    size=settings.mailbox_pool_size,
+    max_age=settings.mailbox_pool_max_age,
+    refill_concurrency=settings.mailbox_pool_refill_concurrency
+)
+mailbox_sweeper = MailboxSweeper(
+    storage,
+    email_reader,
+    mail_providers,
+    ttl=settings.mailbox_ttl_hours * 3600,
+    idle_ttl=settings.mailbox_idle_ttl_hours * 3600,
+    interval=settings.mailbox_sweep_interval,
+    batch_size=settings.mailbox_sweep_batch,
+    concurrency=settings.mailbox_sweep_concurrency,
+    memory_idle=settings.mailbox_memory_idle
+)
+
+def update_service_gauges():
+    """Gauge состояния сервисов этого воркера; вызывается перед каждым сбросом метрик"""
+    metrics.MAILBOX_POOL_DEPTH.set(mailbox_pool.stats()["depth"])
+    for name, state in upstream.breakers.snapshot().items():
+        metrics.CIRCUIT_OPEN.set(1 if state["state"] == "open" else 0, endpoint=name)
+
+metrics.registry.add_collector(update_service_gauges)
 
 # Models for API requests/responses
 class CreateEmailRequest(BaseModel):
@@ -151,6 +301,28 @@ class CreateEmailResponse(BaseModel):
     email: str
     status: str = "success"
 
+class BatchCreateRequest(BaseModel):
+    service: str = "temp-mail"
+    count: int = 1
+    usernames: Optional[List[str]] = None
+
+class BatchEmailsRequest(BaseModel):
+    emails: List[str]
+
+class BatchMessagesRequest(BatchEmailsRequest):
+    view: str = Field("full", pattern="^(full|summary)$")
+    # email -> id последнего полученного письма, чтобы вернуть только новые
+    since_ids: Optional[Dict[str, str]] = None
+
+class WaitCodeResponse(BaseModel):
+    status: str
+    verification_code: Optional[str] = None
+    verification_link: Optional[str] = None
+    message_id: Optional[str] = None
+    subject: Optional[str] = None
+    sender: Optional[str] = None
+    date: Optional[datetime] = None
+
 class EmailMessage(BaseModel):
     subject: str
     sender: str
@@ -161,6 +333,43 @@ class EmailMessage(BaseModel):
     verification_link: Optional[str] = None
     html_content: Optional[str] = None
 
+class MessageSummary(BaseModel):
+    message_id: str
+    subject: str
+    sender: str
+    date: datetime
+    verification_code: Optional[str] = None
+    verification_link: Optional[str] = None
+
+def message_payload(msg: Message, summary: bool = False) -> dict:
+    """Письмо для списка в виде готового к orjson словаря, без повторной валидации моделью"""
+    extracted = code_extractor.extract_message(msg)
+    payload = {
+        "message_id": msg.message_id,
+        "subject": msg.subject,
+        "sender": msg.sender,
+        "date": msg.date,
+        "verification_code": extracted.code,
+        "verification_link": extracted.link
+    }
+    if not summary:
+        payload["content"] = msg.content
+        payload["html_content"] = msg.html_content
+    return payload
+
+def format_message(msg: Message) -> EmailMessage:
+    extracted = code_extractor.extract_message(msg)
+    return EmailMessage(
+        subject=msg.subject,
+        sender=msg.sender,
+        date=msg.date,
+        content=msg.content,
+        message_id=msg.message_id,
+        verification_code=extracted.code,
+        verification_link=extracted.link,
+        html_content=msg.html_content
+    )
+
 @app.get("/health")
 async def health_check():
     try:
@@ -188,9 +397,17 @@ async def health_check():
                     "path": str(Path("data").absolute())
                 },
                 "services": {
-                    "email_creator": True,
-                    "email_reader": True
-                }
+                    "email_creator": mail_providers.is_available("get"),
+                    "email_reader": mail_providers.is_available("see")
+                },
+                "cache_backend": cache_backend.name,
+                "upstream": upstream.health(),
+                "mailbox_locks": mailbox_locks.snapshot(),
+                "cpu_pool": cpu_pool.stats(),
+                "event_loop_lag": loop_lag.stats(),
+                "mail_providers": mail_providers.stats(),
+                "mailbox_pool": mailbox_pool.stats(),
+                "mailbox_sweeper": mailbox_sweeper.stats()
             }
         }
         
@@ -214,39 +431,83 @@ async def health_check():
             "error": str(e)
         }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Метрики всех воркеров в текстовом формате Prometheus"""
+    return PlainTextResponse(await metrics.registry.export(), media_type="text/plain; version=0.0.4")
+
+async def page_response(name: str, request: Request) -> Response:
+    page = await page_cache.get(name)
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": page.last_modified,
+        "Cache-Control": "public, no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        not_modified = etag_matches(if_none_match, page.etag)
+    else:
+        # If-Modified-Since учитывается, только если клиент не прислал ETag
+        not_modified = request.headers.get("if-modified-since") == page.last_modified
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    encoding, body = page.variant(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
 @app.get("/yandex_80d47bc6703d08b0.html")
-async def yandex_verification():
-    verification_html = """<html>
-    <head>
-        <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-    </head>
-    <body>Verification: 80d47bc6703d08b0</body>
-</html>"""
-    return HTMLResponse(content=verification_html, status_code=200)
+async def yandex_verification(request: Request):
+    return await page_response("yandex_verification", request)
 
 @app.get("/")
 async def root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return await page_response("index", request)
+
+def normalize_service(service: str) -> str:
+    """Валидация и нормализация service"""
+    service = service.lower().replace("_", "-").strip()
+    if service not in ["temp-mail", "tempmail"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Поддерживается только сервис temp-mail"
+        )
+    return service
+
+async def obtain_email(username: Optional[str] = None) -> Optional[str]:
+    # Без кастомного имени сначала берем готовый ящик из пула
+    account = None if username else mailbox_pool.acquire()
+    if account is not None:
+        await email_creator.register_account(account)
+        return account.email
+    if not username:
+        return await email_creator.create_email_account(service="temp-mail")
+    async with mailbox_locks.hold(f"username:{username.lower()}"):
+        return await email_creator.create_email_account(
+            service="temp-mail",
+            username=username
+        )
+
+async def remove_email(email: str) -> Optional[bool]:
+    """None - ящика и так нет, иначе удалось ли удалить его у сервиса"""
+    async with mailbox_locks.hold(email):
+        if not await email_creator.email_exists(email):
+            return None
+        success = await email_creator.delete_email_account(email)
+        await email_reader.forget_mailbox(email)
+        return success
 
 @app.post("/api/email/create", response_model=CreateEmailResponse)
 async def create_email(request: CreateEmailRequest):
     try:
-        # Валидация и нормализация service
-        service = request.service.lower().replace("_", "-").strip()
-        if service not in ["temp-mail", "tempmail"]:
-            raise HTTPException(
-                status_code=400,
-                detail="Поддерживается только сервис temp-mail"
-            )
+        service = normalize_service(request.service)
         
         logger.info(f"Creating new email account with service: {service}")
         
         # Создание email аккаунта с обработкой ошибок
         try:
-            email = await email_creator.create_email_account(
-                service="temp-mail",
-                username=request.username
-            )
+            email = await obtain_email(request.username)
         except Exception as e:
             logger.error(f"Failed to create email account: {str(e)}")
             raise HTTPException(
@@ -286,50 +547,169 @@ async def list_emails():
         logger.error(f"Error listing email accounts: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/email/messages/{email}", response_model=List[EmailMessage])
-async def get_messages(email: str):
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match против текущего ETag (слабое сравнение)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    weak = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == weak:
+            return True
+    return False
+
+@app.get("/api/email/messages/{email}", response_model=List[Union[EmailMessage, MessageSummary]])
+async def get_messages(
+    email: str,
+    request: Request,
+    since_id: Optional[str] = None,
+    after: Optional[datetime] = None,
+    view: str = Query("full", pattern="^(full|summary)$")
+):
+    """Письма ящика; since_id/after ограничивают ответ письмами, пришедшими позже.
+
+    view=summary отдает только заголовки, код и ссылку, тело письма
+    запрашивается отдельно через /api/email/messages/{email}/{message_id}.
+    """
     try:
-        logger.info(f"Getting messages for email: {email}")
-        messages = await email_reader.get_messages(email)
-        logger.info(f"Found {len(messages)} messages")
+        logger.debug("Getting messages for email: {}", email)
+        messages, etag = await email_reader.get_inbox(email)
+        logger.debug("Found {} messages", len(messages))
         
-        formatted_messages = []
+        if since_id or after:
+            messages = email_reader.select_new(email, messages, since_id, after)
+            # ETag описывает тело ответа, поэтому для дельты считается по ней
+            etag = InboxCache.compute_etag(messages)
+        if view == "summary":
+            # У краткого и полного списка разные тела, значит и ETag разный
+            etag = etag[:-1] + '-s"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        last_id = email_reader.high_water_mark(email)
+        if last_id:
+            headers["X-Last-Message-Id"] = last_id
+        
+        # Ящик не изменился с прошлого опроса - отвечаем 304 без тела
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        summary = view == "summary"
+        await cpu_pool.prepare(code_extractor, messages, with_text=not summary)
+        payload = []
         for msg in messages:
             try:
-                formatted_msg = EmailMessage(
-                    subject=msg.subject,
-                    sender=msg.sender,
-                    date=msg.date,
-                    content=msg.content,
-                    message_id=msg.message_id,
-                    verification_code=code_extractor.extract_code(msg.content),
-                    verification_link=code_extractor.extract_link(msg.content),
-                    html_content=msg.html_content
-                )
-                logger.debug(f"Formatted message: {formatted_msg}")
-                formatted_messages.append(formatted_msg)
+                payload.append(message_payload(msg, summary))
             except Exception as e:
                 logger.error(f"Error formatting message: {str(e)}", exc_info=True)
                 continue
                 
-        return formatted_messages
+        # Готовый ответ минует повторную сериализацию через response_model
+        return ORJSONResponse(payload, headers=headers)
     except Exception as e:
         logger.error(f"Error getting messages: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/email/stream/{email}")
+async def stream_messages(
+    email: str,
+    request: Request,
+    view: str = Query("full", pattern="^(full|summary)$")
+):
+    """Server-Sent Events: сначала весь список писем, затем только новые"""
+    logger.info(f"Opening message stream for email: {email}")
+
+    async def event_stream():
+        # Подписка создается внутри генератора: если клиент отключится до
+        # начала отдачи, генератор не запустится и finally с отпиской тоже
+        queue = inbox_watcher.subscribe(email)
+        try:
+            yield f"retry: {int(settings.inbox_watch_interval * 1000)}\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    messages = await asyncio.wait_for(queue.get(), timeout=settings.sse_keepalive_interval)
+                except asyncio.TimeoutError:
+                    # Комментарий-пинг не дает прокси закрыть простаивающее соединение
+                    yield ": keepalive\n\n"
+                    continue
+
+                await cpu_pool.prepare(code_extractor, messages, with_text=view != "summary")
+                payload = []
+                for msg in messages:
+                    try:
+                        payload.append(message_payload(msg, view == "summary"))
+                    except Exception as e:
+                        logger.error(f"Error formatting message: {str(e)}", exc_info=True)
+                yield f"event: messages\ndata: {orjson.dumps(payload).decode()}\n\n"
+        finally:
+            inbox_watcher.unsubscribe(email, queue)
+            logger.info(f"Closed message stream for email: {email}")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/email/codes/{email}", response_model=List[str])
 async def get_verification_codes(email: str):
     try:
         messages = await email_reader.get_messages(email)
+        await cpu_pool.prepare(code_extractor, messages)
         codes = [
             code for msg in messages
-            if (code := code_extractor.extract_code(msg.content)) is not None
+            if (code := code_extractor.extract_message(msg).code) is not None
         ]
         return codes
     except Exception as e:
         logger.error(f"Error getting verification codes: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/email/codes/{email}/wait", response_model=WaitCodeResponse)
+async def wait_verification_code(
+    email: str,
+    request: Request,
+    timeout: float = Query(60, gt=0),
+    sender: Optional[str] = None,
+    since_id: Optional[str] = None
+):
+    """Long-poll: держит запрос, пока в письме не найдется код или ссылка подтверждения.
+
+    sender - подстрока адреса или имени отправителя, since_id - пропустить
+    письма до этого включительно. Если за timeout секунд ничего не пришло,
+    возвращается status=timeout.
+    """
+    timeout = min(timeout, settings.code_wait_max_timeout)
+    sender = sender.lower() if sender else None
+
+    def match(msg: Message) -> bool:
+        if sender and sender not in msg.sender.lower():
+            return False
+        extracted = code_extractor.extract_message(msg)
+        return extracted.code is not None or extracted.link is not None
+
+    try:
+        msg = await inbox_watcher.wait_for(email, match, timeout, since_id, request.is_disconnected)
+    except Exception as e:
+        logger.error(f"Error waiting for verification code: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if msg is None:
+        return WaitCodeResponse(status="timeout")
+    extracted = code_extractor.extract_message(msg)
+    return WaitCodeResponse(
+        status="found",
+        verification_code=extracted.code,
+        verification_link=extracted.link,
+        message_id=msg.message_id,
+        subject=msg.subject,
+        sender=msg.sender,
+        date=msg.date
+    )
+
 @app.get("/api/email/messages/{email}/{message_id}", response_model=EmailMessage)
 async def get_message(email: str, message_id: str):
     try:
@@ -339,11 +719,7 @@ async def get_message(email: str, message_id: str):
             logger.error("Message ID is missing")
             raise HTTPException(status_code=400, detail="Message ID is required")
             
-        messages = await email_reader.get_messages(email)
-        logger.debug(f"Found {len(messages)} messages")
-        
-        # Ищем сообщение по ID
-        message = next((msg for msg in messages if str(msg.message_id) == str(message_id)), None)
+        message = await email_reader.get_message(email, str(message_id))
         
         if not message:
             logger.warning(f"Message {message_id} not found for email {email}")
@@ -352,17 +728,9 @@ async def get_message(email: str, message_id: str):
                 detail=f"Сообщение с ID {message_id} не найдено"
             )
             
+        await cpu_pool.prepare(code_extractor, [message], with_text=True)
         logger.info(f"Returning message: {message.subject}")
-        return EmailMessage(
-            subject=message.subject,
-            sender=message.sender,
-            date=message.date,
-            content=message.content,
-            message_id=message.message_id,
-            html_content=message.html_content,
-            verification_code=code_extractor.extract_code(message.content),
-            verification_link=code_extractor.extract_link(message.content)
-        )
+        return format_message(message)
         
     except HTTPException:
         raise
@@ -378,14 +746,12 @@ async def delete_email(email: str):
     try:
         logger.info(f"Attempting to delete email account: {email}")
         
-        # Проверяем существование email
-        if not await email_creator.email_exists(email):
+        success = await remove_email(email)
+        if success is None:
             logger.warning(f"Email account not found: {email}")
             # Возвращаем 200 даже если почта не найдена, так как результат тот же - почты нет
             return {"status": "success", "message": "Email account deleted or not found"}
             
-        # Удаляем почту
-        success = await email_creator.delete_email_account(email)
         if not success:
             logger.error(f"Failed to delete email account: {email}")
             raise HTTPException(
@@ -405,14 +771,93 @@ async def delete_email(email: str):
             detail=f"Ошибка при удалении почтового ящика: {str(e)}"
         )
 
-if __name__ == "__main__":
-    logger.add(
-        settings.log_file,
-        level=settings.log_level,
-        rotation="500 MB",
-        retention="10 days"
+def check_batch_size(size: int):
+    if size < 1 or size > settings.batch_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"За один запрос можно обработать от 1 до {settings.batch_max_items} ящиков"
+        )
+
+def batch_response(keys: list, results: list, render: Callable[[str, object], dict],
+                   key_field: str = "email") -> dict:
+    """Частичный результат пачки: ошибка одного ящика не отменяет остальные"""
+    items = []
+    failed = 0
+    for key, result in zip(keys, results):
+        if isinstance(result, BaseException):
+            failed += 1
+            items.append({key_field: key, "status": "error", "error": str(result) or type(result).__name__})
+        else:
+            items.append(render(key, result))
+    return {"results": items, "succeeded": len(items) - failed, "failed": failed}
+
+@app.post("/api/email/batch/create")
+async def batch_create_emails(request: BatchCreateRequest):
+    """Создает count ящиков или по ящику на каждое имя из usernames"""
+    normalize_service(request.service)
+    usernames = request.usernames if request.usernames is not None else [None] * request.count
+    check_batch_size(len(usernames))
+
+    async def create(username: Optional[str]) -> str:
+        email = await obtain_email(username)
+        if not email:
+            raise RuntimeError("Сервис не вернул адрес")
+        return email
+
+    results = await gather_bounded(create, usernames, settings.batch_concurrency)
+    response = batch_response(
+        usernames, results, lambda username, email: {"email": email, "status": "success"}, key_field="username"
     )
-    
+    logger.info(f"Batch create: {response['succeeded']} created, {response['failed']} failed")
+    return response
+
+@app.post("/api/email/batch/messages")
+async def batch_get_messages(request: BatchMessagesRequest):
+    """Письма нескольких ящиков за один запрос; since_ids - как since_id у одиночного запроса"""
+    emails = list(dict.fromkeys(request.emails))
+    check_batch_size(len(emails))
+    summary = request.view == "summary"
+    since_ids = request.since_ids or {}
+
+    async def read(email: str) -> List[Message]:
+        messages, _ = await email_reader.get_inbox(email)
+        if since_ids.get(email):
+            messages = email_reader.select_new(email, messages, since_ids[email], None)
+        # Одна пачка в пул на ящик, пока остальные ящики еще читаются
+        await cpu_pool.prepare(code_extractor, messages, with_text=not summary)
+        return messages
+
+    def render(email: str, messages: List[Message]) -> dict:
+        return {
+            "email": email,
+            "status": "success",
+            "messages": [message_payload(msg, summary) for msg in messages],
+            "last_message_id": email_reader.high_water_mark(email)
+        }
+
+    results = await gather_bounded(read, emails, settings.batch_concurrency)
+    return ORJSONResponse(batch_response(emails, results, render))
+
+@app.post("/api/email/batch/delete")
+async def batch_delete_emails(request: BatchEmailsRequest):
+    emails = list(dict.fromkeys(request.emails))
+    check_batch_size(len(emails))
+
+    async def delete(email: str) -> str:
+        success = await remove_email(email)
+        if success is None:
+            return "not_found"
+        if not success:
+            raise RuntimeError("Не удалось удалить почтовый ящик")
+        return "deleted"
+
+    results = await gather_bounded(delete, emails, settings.batch_concurrency)
+    response = batch_response(emails, results, lambda email, status: {"email": email, "status": status})
+    logger.info(f"Batch delete: {response['succeeded']} deleted or missing, {response['failed']} failed")
+    return response
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(
         "main:app",
         host=settings.api_host,
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from typing import Optional
 
@@ -8,7 +8,7 @@ class EmailAccount(BaseModel):
     email: str
     password: str
     service: str
-    created_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
     last_accessed: Optional[datetime] = None
     is_active: bool = True
     proxy: Optional[str] = None 
\ No newline at end of file
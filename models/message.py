@@ -1,36 +1,69 @@
-from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
-from typing import Optional, List
-from bs4 import BeautifulSoup
-
-class Message(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-    
-    message_id: str = Field(default="")
-    subject: str = Field(default="")
-    sender: str = Field(default="")
-    recipient: str = Field(default="")
-    date: datetime
-    content: str = Field(default="")
-    html_content: Optional[str] = Field(default=None)
-    attachments: List[str] = Field(default_factory=list)
-    
-    def __init__(self, **data):
-        # Ensure message_id is a string
-        if 'message_id' in data:
-            data['message_id'] = str(data['message_id'])
-            
-        # Convert potential None values to empty strings
-        for field in ['subject', 'sender', 'recipient', 'content']:
-            if field in data and data[field] is None:
-                data[field] = ""
-                
-        super().__init__(**data)
-        
-        # Если html_content не указан, используем обычный content
-        if not self.html_content:
-            self.html_content = self.content
-        # Если content пустой, но есть html_content, извлекаем текст
-        elif not self.content and self.html_content:
-            soup = BeautifulSoup(self.html_content, 'html.parser')
-            self.content = soup.get_text() 
\ No newline at end of file
+from typing import Any, Optional
+
+from services.html_text import html_to_text
+
+
+def as_aware(value: datetime) -> datetime:
+    """Naive-даты upstream считаются локальным временем, чтобы их можно было сравнивать с aware"""
+    return value if value.tzinfo else value.astimezone()
+
+
+class Message:
+    """Письмо внутри приложения.
+
+    Обычный класс со ``__slots__`` без валидации: данные upstream и базы уже
+    разобраны вызывающим кодом. Текст из HTML строится только при первом
+    обращении к ``content``, результат извлечения кода и ссылки
+    (``extracted``) заполняет CodeExtractor. Наружу письмо отдается через
+    pydantic-модели и словари из main.py.
+    """
+
+    __slots__ = ("message_id", "subject", "sender", "recipient", "date",
+                 "body_text", "html_content", "_content", "extracted")
+
+    def __init__(self, *, date: datetime, message_id: Any = "", subject: Optional[str] = "",
+                 sender: Optional[str] = "", recipient: Optional[str] = "", content: Optional[str] = "",
+                 html_content: Optional[str] = None):
+        self.message_id = str(message_id)
+        self.subject = subject or ""
+        self.sender = sender or ""
+        self.recipient = recipient or ""
+        self.date = date
+        # Текстовая версия как пришла от сервиса, может быть пустой
+        self.body_text = content or ""
+        # Пустой html_content не дублирует content: письмо без HTML-версии так и передается
+        self.html_content = html_content or None
+        self._content: Optional[str] = self.body_text or None
+        self.extracted: Any = None
+
+    @property
+    def content(self) -> str:
+        """Текст письма; если сервис прислал только HTML, извлекается из него один раз"""
+        if self._content is None:
+            self._content = html_to_text(self.html_content) if self.html_content else ""
+        return self._content
+
+    @content.setter
+    def content(self, value: str):
+        self._content = value
+
+    @property
+    def content_ready(self) -> bool:
+        """Текст уже есть и обращение к content не запустит разбор HTML"""
+        return self._content is not None
+
+    @property
+    def source(self) -> str:
+        """Исходное тело для ETag и порога разбора в пуле, без преобразования HTML в текст"""
+        return self.html_content or self.body_text
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        return f"Message(message_id={self.message_id!r}, sender={self.sender!r}, subject={self.subject!r})"
@@ -0,0 +1,24 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, List, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def gather_bounded(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    limit: int
+) -> List[Union[R, BaseException]]:
+    """Вызывает func для каждого элемента, не больше limit одновременно.
+
+    Результаты возвращаются в порядке items; ошибка одного элемента не
+    прерывает остальные и возвращается на его месте как исключение.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
@@ -0,0 +1,161 @@
+import time
+from collections import deque
+from typing import Deque, Dict
+from loguru import logger
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: upstream-эндпоинт считается недоступным"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Upstream endpoint '{name}' is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Автомат closed -> open -> half-open для одного upstream-эндпоинта.
+
+    После ``failure_threshold`` ошибок подряд запросы отклоняются сразу в
+    течение ``reset_timeout`` секунд. Затем пропускается ограниченное число
+    пробных запросов: успех закрывает автомат, ошибка снова открывает его.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.probe_started_at = 0.0
+        self.total_failures = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.half_open_calls = 0
+            logger.info(f"Circuit '{self.name}' half-open, probing upstream")
+        if self.state == self.HALF_OPEN:
+            now = time.monotonic()
+            # Зависшая проба (например, отмененный запрос) не должна блокировать автомат навсегда
+            if self.half_open_calls >= self.half_open_max_calls and now - self.probe_started_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.half_open_calls = 0
+            self.half_open_calls += 1
+            self.probe_started_at = now
+        return True
+
+    def release(self):
+        """Разрешенный allow() запрос не дошел до upstream: пробное место освобождается"""
+        if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit '{self.name}' closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit '{self.name}' opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        state = self.state
+        # Открытый автомат с истекшим таймаутом на деле уже готов к пробе
+        if state == self.OPEN and self.retry_after() == 0:
+            state = self.HALF_OPEN
+        return {
+            "state": state,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 1) if state == self.OPEN else 0
+        }
+
+
+class RetryBudget:
+    """Ограничивает долю повторных запросов относительно обычных.
+
+    За скользящее окно разрешается не больше ``min_retries`` повторов плюс
+    ``ratio`` от числа первичных запросов, поэтому при сбое upstream
+    повторы не умножают нагрузку.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self.exhausted = 0
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        self._requests.append(time.monotonic())
+
+    def try_retry(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        return True
+
+    def snapshot(self) -> dict:
+        self._trim(time.monotonic())
+        return {
+            "requests": len(self._requests),
+            "retries": len(self._retries),
+            "exhausted": self.exhausted
+        }
+
+
+class BreakerRegistry:
+    """Автоматы по именам эндпоинтов, создаются при первом обращении"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            self._breakers[name] = breaker
+        return breaker
+
+    def is_open(self, name: str) -> bool:
+        breaker = self._breakers.get(name)
+        return breaker is not None and breaker.snapshot()["state"] == CircuitBreaker.OPEN
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: breaker.snapshot() for name, breaker in sorted(self._breakers.items())}
@@ -1,72 +1,177 @@
 import re
-from typing import Optional
-from bs4 import BeautifulSoup
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
 from loguru import logger
 
-class CodeExtractor:
-    def __init__(self):
-        # Common patterns for verification codes
-        self.code_patterns = [
-            r'\b[0-9]{4,8}\b',  # 4-8 digit numbers
-            r'\b[A-Z0-9]{6,8}\b',  # 6-8 character alphanumeric codes
-            r'verification code[:\s]+([A-Z0-9]{4,8})',  # Codes preceded by "verification code"
-            r'confirmation code[:\s]+([A-Z0-9]{4,8})',  # Codes preceded by "confirmation code"
-            r'security code[:\s]+([A-Z0-9]{4,8})',  # Codes preceded by "security code"
-            r'one-time code[:\s]+([A-Z0-9]{4,8})'  # Codes preceded by "one-time code"
-        ]
-        
-        # Common patterns for verification links
-        self.link_patterns = [
-            r'https?://[^\s<>"]+?/verify[^\s<>"]+',
-            r'https?://[^\s<>"]+?/confirm[^\s<>"]+',
-            r'https?://[^\s<>"]+?/activate[^\s<>"]+',
-            r'https?://[^\s<>"]+?/validation[^\s<>"]+',
-        ]
-    
-    def extract_code(self, content: str) -> Optional[str]:
+from models.message import Message
+from services.html_text import get_backend
+from services.metrics import CACHE_REQUESTS, EXTRACTION_LATENCY
+
+
+@dataclass
+class ExtractionResult:
+    """Результат разбора одного письма: код, ссылка и все найденные кандидаты в коды"""
+    code: Optional[str] = None
+    link: Optional[str] = None
+    candidates: List[str] = field(default_factory=list)
+
+
+class ExtractionEngine:
+    """Однопроходный извлекатель кодов и ссылок.
+
+    HTML разбирается один раз настроенным парсером (services.html_text), а все
+    шаблоны кодов собраны в одно скомпилированное регулярное выражение. Приоритет выбора совпадает со
+    старым порядком шаблонов: 4-8 цифр, затем 6-8 символов, затем коды
+    после фраз вида "verification code".
+    """
+
+    # Порядок важен: фразы с кодом проверяются раньше общих шаблонов,
+    # иначе слово "security" приняли бы за буквенно-цифровой код
+    CODE_SCANNER = re.compile(
+        r'(?P<label>verification|confirmation|security|one-time) code[:\s]+(?P<labeled>[A-Z0-9]{4,8})'
+        r'|\b(?P<digits>[0-9]{4,8})\b'
+        r'|\b(?P<alnum>[A-Z0-9]{6,8})\b',
+        re.IGNORECASE
+    )
+    LABELS = ('verification', 'confirmation', 'security', 'one-time')
+
+    LINK_KEYWORDS = ('verify', 'confirm', 'activate', 'validation')
+    LINK_SCANNER = re.compile(r'https?://[^\s<>"]+?/(?P<keyword>verify|confirm|activate|validation)[^\s<>"]+')
+
+    SIX_DIGITS = re.compile(r'\d{6}')
+
+    def extract(self, content: str, html: Optional[str] = None) -> ExtractionResult:
+        """content - текстовая версия письма, html - HTML-версия, если она есть.
+
+        Коды ищутся в текстовой версии, а если ее нет - в тексте из HTML.
+        Ссылки сначала ищутся среди href HTML-версии, затем в тексте.
+        """
+        if html:
+            html_text, hrefs = self._parse(html)
+            text_content = content or html_text
+        else:
+            text_content, hrefs = self._parse(content)
+        code, candidates = self._find_code(text_content)
+        return ExtractionResult(
+            code=code,
+            link=self._find_link(text_content, hrefs),
+            candidates=candidates
+        )
+
+    def _parse(self, content: str) -> Tuple[str, List[str]]:
+        # Обычный текст без разметки и сущностей не нужно пропускать через парсер
+        if '<' not in content and '&' not in content:
+            return content, []
         try:
-            # Try to parse HTML content
-            soup = BeautifulSoup(content, 'html.parser')
-            text_content = soup.get_text()
-        except:
-            text_content = content
-            
+            return get_backend().parse(content)
+        except Exception:
+            return content, []
+
+    def _find_code(self, text_content: str) -> Tuple[Optional[str], List[str]]:
+        digits: List[str] = []
+        alnum: List[str] = []
+        labeled: List[List[str]] = [[] for _ in self.LABELS]
+        candidates: List[str] = []
+
+        for match in self.CODE_SCANNER.finditer(text_content):
+            value = match.group('labeled')
+            if value is not None:
+                labeled[self.LABELS.index(match.group('label').lower())].append(value)
+                # Код после фразы - тоже кандидат для общих шаблонов
+                if value.isdigit():
+                    digits.append(value)
+                elif len(value) >= 6:
+                    alnum.append(value)
+            elif match.group('digits') is not None:
+                value = match.group('digits')
+                digits.append(value)
+            else:
+                value = match.group('alnum')
+                alnum.append(value)
+            if value not in candidates:
+                candidates.append(value)
+
+        for bucket in [digits, alnum] + labeled:
+            if bucket:
+                # Предпочитаем коды ровно из 6 цифр
+                code = next((m for m in bucket if self.SIX_DIGITS.fullmatch(m)), bucket[0])
+                return code, candidates
+        return None, candidates
+
+    def _find_link(self, text_content: str, hrefs: List[str]) -> Optional[str]:
+        # Сначала ссылки из тегов <a>
+        for href in hrefs:
+            lowered = href.lower()
+            if any(keyword in lowered for keyword in self.LINK_KEYWORDS):
+                return href
+
+        # Затем ссылки в тексте, в порядке приоритета ключевых слов
+        best = None
+        best_rank = len(self.LINK_KEYWORDS)
+        for match in self.LINK_SCANNER.finditer(text_content):
+            rank = self.LINK_KEYWORDS.index(match.group('keyword'))
+            if rank < best_rank:
+                best, best_rank = match.group(0), rank
+                if rank == 0:
+                    break
+        return best
+
+
+class CodeExtractor:
+    def __init__(self, cache_size: int = 2048):
+        self.engine = ExtractionEngine()
+        self.cache_size = cache_size
+        # message_id -> ((текст, HTML), результат); тело сверяется, чтобы не отдать чужой результат
+        self._cache: "OrderedDict[str, Tuple[Tuple[str, Optional[str]], ExtractionResult]]" = OrderedDict()
+
+    def extract(self, content: str, html: Optional[str] = None) -> ExtractionResult:
         try:
-            # Search for verification codes using patterns
-            for pattern in self.code_patterns:
-                matches = re.findall(pattern, text_content, re.IGNORECASE)
-                if matches:
-                    # Return the first match that looks most like a verification code
-                    for match in matches:
-                        # Prefer matches that are exactly 6 digits
-                        if re.match(r'^\d{6}$', match):
-                            return match
-                    return matches[0]
-                    
-            return None
+            with EXTRACTION_LATENCY.time():
+                return self.engine.extract(content or "", html)
         except Exception as e:
-            logger.error(f"Error extracting verification code: {str(e)}")
-            return None
-    
+            logger.error(f"Error extracting verification data: {str(e)}")
+            return ExtractionResult()
+
+    def extract_message(self, message: Message) -> ExtractionResult:
+        """Разбирает письмо один раз и запоминает результат в самом письме и по message_id.
+
+        Код ищется в текстовой версии письма, как его видит пользователь, а
+        href кнопок подтверждения берутся из HTML-версии: клиент в кратком
+        списке тела письма не получает. Кэш по message_id нужен для копий письма, пришедших из базы или от
+        другого воркера.
+        """
+        result = self.cached(message)
+        if result is not None:
+            return result
+        CACHE_REQUESTS.inc(cache="extraction", result="miss")
+        result = self.extract(message.body_text, message.html_content)
+        self.remember(message, result)
+        return result
+
+    def cached(self, message: Message) -> Optional[ExtractionResult]:
+        """Готовый результат из письма или из кэша по message_id, без разбора"""
+        if message.extracted is not None:
+            CACHE_REQUESTS.inc(cache="extraction", result="hit")
+            return message.extracted
+        cached = self._cache.get(message.message_id)
+        if cached is not None and cached[0] == (message.body_text, message.html_content):
+            self._cache.move_to_end(message.message_id)
+            CACHE_REQUESTS.inc(cache="extraction", result="hit")
+            message.extracted = cached[1]
+            return cached[1]
+        return None
+
+    def remember(self, message: Message, result: ExtractionResult):
+        """Запоминает результат, посчитанный в другом месте (например, в пуле CPU)"""
+        message.extracted = result
+        if message.message_id:
+            self._cache[message.message_id] = ((message.body_text, message.html_content), result)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def extract_code(self, content: str) -> Optional[str]:
+        return self.extract(content).code
+
     def extract_link(self, content: str) -> Optional[str]:
-        try:
-            # Try to parse HTML content
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            # First try to find verification links in anchor tags
-            for a in soup.find_all('a'):
-                href = a.get('href', '')
-                if any(keyword in href.lower() for keyword in ['verify', 'confirm', 'activate', 'validation']):
-                    return href
-            
-            # If no anchor tags found, try regex patterns
-            text_content = soup.get_text() if soup else content
-            for pattern in self.link_patterns:
-                matches = re.findall(pattern, text_content)
-                if matches:
-                    return matches[0]
-                    
-            return None
-        except Exception as e:
-            logger.error(f"Error extracting verification link: {str(e)}")
-            return None 
\ No newline at end of file
+        return self.extract(content).link
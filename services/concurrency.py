@@ -0,0 +1,166 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from services.metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_QUEUE_DEPTH, UPSTREAM_QUEUE_WAIT
+
+# Примитивы asyncio создаются при первом использовании: в Python 3.8 они
+# привязываются к event loop в момент создания, а объекты сервисов
+# создаются при импорте main, до запуска loop'а uvicorn.
+
+
+class UpstreamBusyError(Exception):
+    """Запрос простоял в очереди к upstream дольше допустимого"""
+
+    def __init__(self, waited: float):
+        super().__init__(f"Upstream queue wait exceeded {waited:.1f}s")
+        self.waited = waited
+
+
+class TokenBucket:
+    """Ровный темп запросов: ``rate`` в секунду, не больше ``burst`` подряд.
+
+    Ожидающие обслуживаются по очереди, поэтому при всплеске запросы уходят
+    равномерным потоком, а не пачкой, на которую upstream ответит 429.
+    ``rate`` <= 0 отключает ограничение.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if not self.enabled:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            # Цикл, а не одно ожидание: пока спали, throttle мог отодвинуть следующий запрос
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def throttle(self, seconds: float):
+        """Upstream попросил подождать: следующий запрос уйдет не раньше чем через seconds"""
+        if self.enabled and seconds > 0:
+            self._refill()
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class UpstreamLimiter:
+    """Общие для всех запросов процесса к upstream ограничения.
+
+    Запрос сначала занимает одно из ``max_in_flight`` мест, затем ждет
+    токен. Глубина очереди, число запросов в работе и время ожидания
+    попадают в метрики; дольше ``queue_timeout`` секунд запрос не ждет.
+    """
+
+    def __init__(self, rate: float, burst: float, max_in_flight: int, queue_timeout: float = 0):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def _acquire(self) -> bool:
+        """Занимает место и токен; True - место в семафоре занято и его надо освободить"""
+        acquired = False
+        if self.max_in_flight > 0:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            await self._semaphore.acquire()
+            acquired = True
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            if acquired:
+                self._semaphore.release()
+            raise
+        return acquired
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        self.waiting += 1
+        UPSTREAM_QUEUE_DEPTH.inc()
+        try:
+            if self.queue_timeout > 0:
+                acquired = await asyncio.wait_for(self._acquire(), self.queue_timeout)
+            else:
+                acquired = await self._acquire()
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise UpstreamBusyError(time.perf_counter() - started) from None
+        finally:
+            self.waiting -= 1
+            UPSTREAM_QUEUE_DEPTH.dec()
+        UPSTREAM_QUEUE_WAIT.observe(time.perf_counter() - started, endpoint=endpoint)
+
+        self.in_flight += 1
+        UPSTREAM_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            UPSTREAM_IN_FLIGHT.dec()
+            if acquired:
+                self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "rate": self.bucket.rate,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
+
+
+class KeyedLock:
+    """Отдельный asyncio.Lock на каждый ключ (адрес ящика).
+
+    Изменяющие операции над одним ящиком выполняются по очереди, над
+    разными - параллельно. Замок удаляется, когда его никто не держит и не ждет.
+    """
+
+    def __init__(self):
+        # ключ -> [замок, сколько корутин держат или ждут его]
+        self._locks: Dict[str, List] = {}
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self._locks[key] = entry
+        elif entry[0].locked():
+            self.contended += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+    def snapshot(self) -> dict:
+        return {"active": len(self._locks), "contended": self.contended}
@@ -0,0 +1,138 @@
+"""Разбор больших писем вне event loop.
+
+Извлечение кода и ссылки и преобразование HTML в текст - синхронная работа
+на CPU. Для письма в несколько сотен килобайт это десятки миллисекунд, и
+все это время воркер не отвечает на другие запросы. CpuOffloader готовит
+письма ящика заранее: письма короче ``inline_threshold`` разбираются как
+раньше, по месту (пул для них дороже самой работы), остальные уходят в пул
+пачками по ``batch_size`` - одна задача на пачку, а не на письмо.
+
+``thread`` - пул потоков: loop не стоит, но из-за GIL разбор не идет
+параллельно с остальным Python-кодом. ``process`` - пул процессов: разбор
+идет на других ядрах, зато тело письма и результат копируются между
+процессами. ``inline`` отключает пул.
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from models.message import Message
+from services.code_extractor import CodeExtractor, ExtractionEngine, ExtractionResult
+from services.html_text import configure_backend, html_to_text
+from services.metrics import CPU_OFFLOADED
+
+MODES = ("thread", "process", "inline")
+
+# Движок в процессе пула (или общий для потоков): регулярные выражения
+# компилируются один раз на процесс
+_engine: Optional[ExtractionEngine] = None
+
+
+def _init_process(parser_backend: str):
+    configure_backend(parser_backend)
+
+
+# (текст и HTML для извлечения, HTML для преобразования в текст); None - эта часть уже сделана
+BatchItem = Tuple[Optional[Tuple[str, Optional[str]]], Optional[str]]
+
+
+def _prepare_batch(items: Sequence[BatchItem]) -> List[Tuple[Optional[ExtractionResult], Optional[str]]]:
+    """Выполняется в пуле"""
+    global _engine
+    if _engine is None:
+        _engine = ExtractionEngine()
+    results = []
+    for bodies, html in items:
+        extracted = None
+        if bodies is not None:
+            try:
+                extracted = _engine.extract(*bodies)
+            except Exception as e:
+                logger.error(f"Error extracting verification data: {str(e)}")
+                extracted = ExtractionResult()
+        results.append((extracted, html_to_text(html) if html is not None else None))
+    return results
+
+
+class CpuOffloader:
+    def __init__(self, mode: str = "thread", workers: int = 2, inline_threshold: int = 20000,
+                 batch_size: int = 16, parser_backend: str = "auto"):
+        mode = (mode or "inline").lower()
+        if mode not in MODES:
+            logger.warning(f"Unknown CPU pool mode: {mode}, using thread")
+            mode = "thread"
+        if workers <= 0:
+            mode = "inline"
+        self.mode = mode
+        self.workers = workers
+        self.inline_threshold = inline_threshold
+        self.batch_size = max(1, batch_size)
+        self.parser_backend = parser_backend
+        self._executor: Optional[Executor] = None
+        self.offloaded = 0
+        self.batches = 0
+
+    def _pool(self) -> Executor:
+        # Пул создается при первом большом письме: воркер, которому оно не
+        # попадется, не тратит время и память на запуск процессов
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_process, initargs=(self.parser_backend,)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu-pool")
+            logger.info(f"CPU pool started: {self.mode}, {self.workers} workers")
+        return self._executor
+
+    async def prepare(self, extractor: CodeExtractor, messages: Sequence[Message], with_text: bool = False):
+        """Заранее извлекает код и ссылку (и текст, если with_text) для больших писем.
+
+        После вызова extract_message и content у этих писем не разбирают HTML
+        в event loop. Маленькие и уже разобранные письма не трогаются.
+        """
+        if self.mode == "inline" or not messages:
+            return
+        pending: List[Message] = []
+        items: List[BatchItem] = []
+        for message in messages:
+            if len(message.source) < self.inline_threshold:
+                continue
+            need_extract = extractor.cached(message) is None
+            need_text = with_text and not message.content_ready
+            if not (need_extract or need_text):
+                continue
+            pending.append(message)
+            bodies = (message.body_text, message.html_content) if need_extract else None
+            items.append((bodies, message.html_content if need_text else None))
+        if not items:
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        chunks = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        self.batches += len(chunks)
+        self.offloaded += len(items)
+        CPU_OFFLOADED.inc(len(items), mode=self.mode)
+        done = await asyncio.gather(*(loop.run_in_executor(pool, _prepare_batch, chunk) for chunk in chunks))
+        for message, (extracted, text) in zip(pending, (result for batch in done for result in batch)):
+            if extracted is not None:
+                extractor.remember(message, extracted)
+            if text is not None:
+                message.content = text
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "started": self._executor is not None,
+            "offloaded": self.offloaded,
+            "batches": self.batches
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,116 +1,369 @@
-from imap_tools import MailBox, AND
-from typing import List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime, timedelta
 from loguru import logger
-import httpx
+import hashlib
 import re
-from bs4 import BeautifulSoup
 import asyncio
-from tenacity import retry, stop_after_attempt, wait_exponential
+import os
+import time
 
-from models.message import Message
+from models.message import Message, as_aware
+from services.storage import Storage
+from services.mail_providers import ProviderRouter
+from services.circuit_breaker import CircuitOpenError
+from services.metrics import CACHE_REQUESTS, instrument
+from services.shared_cache import CacheBackend, MemoryCacheBackend
 from config import Settings
 
-class EmailReader:
-    BASE_URL = "https://tempmail.glitchy.workers.dev"
-    FALLBACK_URL = "https://api.internal-mail.org" # Альтернативный сервис
-    SEE_MESSAGES_URL = f"{BASE_URL}/see"
-    GET_MESSAGE_URL = f"{BASE_URL}/message"
+class InboxCache:
+    """Короткоживущий кэш входящих с объединением параллельных запросов.
+
+    Пока запись свежее ``ttl`` секунд, ящик отдается из кэша. Если запись
+    устарела, первый запрос запускает загрузку, а все параллельные запросы
+    к тому же ящику ждут ее результат вместо собственного похода в upstream.
+    С общим backend'ом (``sqlite``) записи видны всем воркерам, а загрузку
+    ящика выполняет один воркер: остальные ждут, пока он положит результат.
+    """
+
+    # Сколько воркер, взявший загрузку ящика, может ее держать
+    FETCH_LEASE = 10.0
+    PEER_POLL = 0.05
+
+    def __init__(self, ttl: float, backend: Optional[CacheBackend] = None):
+        self.ttl = ttl
+        self.backend = backend or MemoryCacheBackend()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[List[Message]]],
+        max_age: Optional[float] = None
+    ) -> Tuple[List[Message], str]:
+        """max_age позволяет вызывающему потребовать запись свежее, чем ttl"""
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        entry = await self._fresh_entry(key, ttl)
+        if entry is not None:
+            CACHE_REQUESTS.inc(cache="inbox", result="hit" if entry[3] == os.getpid() else "peer_hit")
+            return entry[1], entry[2]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            CACHE_REQUESTS.inc(cache="inbox", result="coalesced")
+        else:
+            CACHE_REQUESTS.inc(cache="inbox", result="miss")
+            future = asyncio.ensure_future(self._load(key, fetch, ttl))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего клиента не должна отменять общую загрузку
+        return await asyncio.shield(future)
+
+    async def _fresh_entry(self, key: str, ttl: float) -> Optional[tuple]:
+        # Запись: (time.time() загрузки, письма, ETag, pid загрузившего воркера)
+        entry = await self.backend.get(f"inbox:{key}")
+        if entry is not None and time.time() - entry[0] < ttl:
+            return entry
+        return None
+
+    async def _load(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[List[Message]]],
+        ttl: float
+    ) -> Tuple[List[Message], str]:
+        """ttl - допустимый возраст записи для этого запроса (с учетом max_age)"""
+        lease = f"inbox-fetch:{key}"
+        if self.backend.shared and not await self.backend.add(lease, os.getpid(), self.FETCH_LEASE):
+            entry = await self._wait_for_peer(key, lease, ttl)
+            if entry is not None:
+                CACHE_REQUESTS.inc(cache="inbox", result="peer_wait")
+                return entry[1], entry[2]
+        try:
+            messages = await fetch()
+            etag = self.compute_etag(messages)
+            await self.backend.set(f"inbox:{key}", (time.time(), messages, etag, os.getpid()), self.ttl)
+        finally:
+            if self.backend.shared:
+                await self.backend.delete(lease)
+        return messages, etag
+
+    async def _wait_for_peer(self, key: str, lease: str, ttl: float) -> Optional[tuple]:
+        """Ждет, пока ящик загрузит другой воркер; None - он не справился, грузим сами"""
+        deadline = time.monotonic() + self.FETCH_LEASE
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.PEER_POLL)
+            entry = await self._fresh_entry(key, ttl)
+            if entry is not None:
+                return entry
+            if await self.backend.get(lease) is None:
+                break
+        return None
+
+    async def invalidate(self, key: str):
+        await self.backend.delete(f"inbox:{key}")
+
+    async def prune(self) -> int:
+        """Выбрасывает устаревшие записи, чтобы кэш не рос с числом ящиков"""
+        return await self.backend.prune()
+
+    @staticmethod
+    def compute_etag(messages: List[Message]) -> str:
+        digest = hashlib.sha1()
+        for msg in messages:
+            for part in (msg.message_id, msg.date.isoformat(), msg.subject, msg.sender, msg.source):
+                digest.update(part.encode("utf-8", "surrogatepass"))
+                digest.update(b"\0")
+        return f'W/"{digest.hexdigest()}"'
+
+
+class MailboxState:
+    """Что процесс уже знает о ящике: готовые объекты писем и high-water mark.
 
-    def __init__(self, settings: Settings):
+    Каждое новое письмо получает порядковый номер, поэтому клиент может
+    запросить только письма, пришедшие после известного ему message_id.
+    """
+
+    def __init__(self):
+        self.messages: Dict[str, Message] = {}
+        self.seq: Dict[str, int] = {}
+        self.last_seq = 0
+        self.last_id: Optional[str] = None
+        self.last_date: Optional[datetime] = None
+        # id писем, уже записанных в базу, чтобы не переписывать их на каждом опросе
+        self.persisted: Set[str] = set()
+        self.last_access = time.monotonic()
+
+    def add(self, messages: List[Message]) -> List[Message]:
+        """Нумерует новые письма; возвращает список, где известные письма
+        заменены уже имеющимися объектами, с готовым текстом и результатом извлечения"""
+        fresh = [msg for msg in messages if msg.message_id not in self.messages]
+        for msg in sorted(fresh, key=lambda m: as_aware(m.date)):
+            if msg.message_id in self.messages:
+                continue
+            self.last_seq += 1
+            self.messages[msg.message_id] = msg
+            self.seq[msg.message_id] = self.last_seq
+            self.last_id = msg.message_id
+            self.last_date = msg.date
+        return [self.messages.get(msg.message_id, msg) for msg in messages]
+
+
+class EmailReader:
+    def __init__(self, settings: Settings, storage: Storage, providers: ProviderRouter,
+                 cache_backend: Optional[CacheBackend] = None):
         self.settings = settings
-        self.client = httpx.AsyncClient(timeout=30.0)
-        self.use_fallback = False
-        
-    async def __del__(self):
-        await self.client.aclose()
+        self.storage = storage
+        self.providers = providers
+        self.inbox_cache = InboxCache(settings.inbox_cache_ttl, cache_backend)
+        self._mailboxes: Dict[str, MailboxState] = {}
+        # Обращения к ящикам, еще не записанные в last_accessed
+        self._touched: Dict[str, datetime] = {}
         
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    async def get_messages(self, email: str, since: Optional[datetime] = None) -> List[Message]:
+    async def get_messages(
+        self,
+        email: str,
+        since: Optional[datetime] = None,
+        since_id: Optional[str] = None,
+        after: Optional[datetime] = None
+    ) -> List[Message]:
+        if since is None:
+            messages, _ = await self.get_inbox(email)
+        else:
+            messages = await self._fetch_messages(email, since)
+        return self.select_new(email, messages, since_id, after)
+
+    def select_new(
+        self,
+        email: str,
+        messages: List[Message],
+        since_id: Optional[str] = None,
+        after: Optional[datetime] = None
+    ) -> List[Message]:
+        """Оставляет только письма новее since_id и/или даты after.
+
+        Незнакомый since_id (например, после перезапуска воркера) игнорируется,
+        и клиент получает полный список.
+        """
+        state = self._mailboxes.get(email)
+        if since_id and state is not None and since_id in state.seq:
+            mark = state.seq[since_id]
+            # Письма без номера (из базы другого воркера) считаем новыми
+            messages = [m for m in messages if state.seq.get(m.message_id, mark + 1) > mark]
+        if after is not None:
+            after = as_aware(after)
+            messages = [m for m in messages if as_aware(m.date) > after]
+        return messages
+
+    def high_water_mark(self, email: str) -> Optional[str]:
+        """id последнего известного письма ящика"""
+        state = self._mailboxes.get(email)
+        return state.last_id if state else None
+
+    def _mailbox(self, email: str) -> MailboxState:
+        state = self._mailboxes.get(email)
+        if state is None:
+            state = MailboxState()
+            self._mailboxes[email] = state
+        return state
+
+    def touch(self, email: str):
+        self._touched[email] = datetime.now()
+        state = self._mailboxes.get(email)
+        if state is not None:
+            state.last_access = time.monotonic()
+
+    def drain_touched(self) -> Dict[str, datetime]:
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def evict_idle(self, max_idle: float) -> int:
+        """Забывает ящики, к которым этот процесс не обращался max_idle секунд"""
+        deadline = time.monotonic() - max_idle
+        idle = [email for email, state in self._mailboxes.items() if state.last_access < deadline]
+        for email in idle:
+            self._forget_local(email)
+        return len(idle)
+
+    async def get_inbox(self, email: str, max_age: Optional[float] = None) -> Tuple[List[Message], str]:
+        """Входящие за последние сутки и их ETag, через кэш"""
+        self.touch(email)
+        messages, etag = await self.inbox_cache.get_or_fetch(email, lambda: self._fetch_messages(email), max_age)
+        # Письма мог загрузить другой воркер - нумеруем их и здесь, чтобы работал since_id.
+        # Из общего кэша приходят свежие копии после pickle: берем вместо них объекты
+        # процесса, иначе текст и код извлекались бы заново на каждом опросе
+        messages = self._mailbox(email).add(messages)
+        return messages, etag
+
+    async def _fetch_messages(self, email: str, since: Optional[datetime] = None) -> List[Message]:
         if not since:
             since = datetime.now() - timedelta(days=1)
             
+        messages: List[Message] = []
         try:
             messages = await self._get_temp_mail_messages(email, since)
-            if not messages and self.use_fallback:
-                # Если основной сервис не работает, пробуем альтернативный
-                messages = await self._get_fallback_messages(email, since)
-            return messages
+            if messages:
+                await self._persist_messages(email, messages)
+                return messages
+        except CircuitOpenError as e:
+            # Все провайдеры недоступны - не ждем их
+            logger.warning(f"Mail services unavailable for {email}: {str(e)}")
         except Exception as e:
             logger.error(f"Error reading messages for {email}: {str(e)}")
-            if not self.use_fallback:
-                self.use_fallback = True
-                return await self._get_fallback_messages(email, since)
+        if not messages:
+            # Upstream пуст или недоступен - отдаем уже сохраненные письма
+            messages = await self._get_stored_messages(email, since)
+        return messages
+
+    async def _persist_messages(self, email: str, messages: List[Message]):
+        """Сохраняет в базу только письма, которых там еще нет"""
+        saved = self._mailbox(email).persisted
+        fresh = [msg for msg in messages if msg.message_id not in saved]
+        if not fresh:
+            return
+        try:
+            await self.storage.save_messages(email, fresh)
+            saved.update(msg.message_id for msg in fresh)
+        except Exception as e:
+            logger.error(f"Error saving messages for {email}: {str(e)}")
+
+    async def _get_stored_messages(self, email: str, since: datetime) -> List[Message]:
+        try:
+            return await self.storage.get_messages(email, since)
+        except Exception as e:
+            logger.error(f"Error reading stored messages for {email}: {str(e)}")
             return []
+
+    async def forget_mailbox(self, email: str):
+        """Сбрасывает все, что известно о ящике, включая запись общего кэша"""
+        await self.inbox_cache.invalidate(email)
+        self._forget_local(email)
+
+    def _forget_local(self, email: str):
+        self._mailboxes.pop(email, None)
+        self._touched.pop(email, None)
     
+    @instrument("EmailReader.list_messages")
     async def _get_temp_mail_messages(self, email: str, since: datetime) -> List[Message]:
-        try:
-            logger.info(f"Fetching messages for {email}")
-            
-            for attempt in range(3):
-                try:
-                    params = {"mail": email}
-                    response = await self.client.get(self.SEE_MESSAGES_URL, params=params)
-                    response.raise_for_status()
-                    
-                    data = response.json()
-                    logger.debug(f"Raw API response: {data}")
-                    
-                    if not data.get("messages"):
-                        logger.info("No messages found")
-                        return []
-                    
-                    messages = []
-                    for msg_data in data["messages"]:
-                        try:
-                            if not msg_data.get("id"):
-                                continue
-                                
-                            date = self._parse_date(msg_data.get("date", ""))
-                            
-                            if date >= since:
-                                message = Message(
-                                    message_id=str(msg_data["id"]),
-                                    subject=msg_data.get("subject", ""),
-                                    sender=msg_data.get("from", ""),
-                                    recipient=msg_data.get("to", ""),
-                                    date=date,
-                                    content=msg_data.get("body_text", ""),
-                                    html_content=msg_data.get("body_html", "")
-                                )
-                                messages.append(message)
-                        except Exception as e:
-                            logger.error(f"Error processing message: {str(e)}", exc_info=True)
-                            continue
-                    
-                    return messages
-                    
-                except httpx.HTTPError as he:
-                    logger.warning(f"HTTP error on attempt {attempt + 1}: {str(he)}")
-                    if attempt < 2:
-                        await asyncio.sleep(2 ** attempt)
-                    continue
-                    
-            logger.warning("All attempts failed, switching to fallback service")
-            self.use_fallback = True
+        """Входящие из upstream; ошибки upstream пробрасываются вызывающему"""
+        logger.debug("Fetching messages for {}", email)
+        
+        # Повторы, circuit breaker и хеджирование резервным провайдером - внутри providers
+        raw_messages = await self.providers.list_messages(email)
+        logger.debug("Raw API response: {}", raw_messages)
+        
+        if not raw_messages:
+            logger.debug("No messages found")
             return []
+        
+        state = self._mailbox(email)
+        since = as_aware(since)
+        messages = []
+        new_messages = []
+        for msg_data in raw_messages:
+            try:
+                if not msg_data.get("id"):
+                    continue
                 
-        except Exception as e:
-            logger.error(f"Error reading temp mail messages: {str(e)}", exc_info=True)
-            self.use_fallback = True
-            return []
+                # Уже известные письма не собираются заново
+                message = state.messages.get(str(msg_data["id"]))
+                if message is None:
+                    message = self._build_message(msg_data)
+                    new_messages.append(message)
+                
+                if as_aware(message.date) >= since:
+                    messages.append(message)
+            except Exception as e:
+                logger.error(f"Error processing message: {str(e)}", exc_info=True)
+                continue
+        
+        state.add(new_messages)
+        if new_messages:
+            logger.info(f"{len(new_messages)} new messages for {email}")
+        return messages
             
-    async def _get_fallback_messages(self, email: str, since: datetime) -> List[Message]:
-        """Альтернативный метод получения сообщений"""
+    async def get_message(self, email: str, message_id: str) -> Optional[Message]:
+        """Одно письмо по id: из памяти процесса, затем из базы, затем через /message upstream"""
+        self.touch(email)
+        state = self._mailboxes.get(email)
+        if state is not None and message_id in state.messages:
+            return state.messages[message_id]
+
         try:
-            logger.info(f"Using fallback service for {email}")
-            # Здесь будет код для работы с альтернативным сервисом
-            # Пока возвращаем пустой список
-            return []
+            message = await self.storage.get_message(email, message_id)
         except Exception as e:
-            logger.error(f"Error reading fallback messages: {str(e)}", exc_info=True)
-            return []
-            
+            logger.error(f"Error reading stored message {message_id}: {str(e)}")
+            message = None
+        if message is not None:
+            return message
+
+        message = await self._get_temp_mail_message(email, message_id)
+        if message is not None:
+            state = self._mailbox(email)
+            state.add([message])
+            await self._persist_messages(email, [message])
+        return message
+
+    @instrument("EmailReader.get_message")
+    async def _get_temp_mail_message(self, email: str, message_id: str) -> Optional[Message]:
+        try:
+            logger.info(f"Fetching message {message_id} for {email}")
+            msg_data = await self.providers.get_message(email, message_id)
+            return self._build_message(msg_data) if msg_data else None
+        except Exception as e:
+            logger.error(f"Error fetching message {message_id}: {str(e)}")
+            return None
+
+    def _build_message(self, msg_data: dict) -> Message:
+        return Message(
+            message_id=str(msg_data["id"]),
+            subject=msg_data.get("subject", ""),
+            sender=msg_data.get("from", ""),
+            recipient=msg_data.get("to", ""),
+            date=self._parse_date(msg_data.get("date", "")),
+            content=msg_data.get("body_text", ""),
+            html_content=msg_data.get("body_html", "")
+        )
+
     def _parse_date(self, date_str: str) -> datetime:
         """Безопасный парсинг даты"""
         try:
@@ -0,0 +1,132 @@
+import re
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+from loguru import logger
+
+
+# Начало или конец блочного элемента. Парсеры склеивают текст соседних
+# элементов без разделителя ("<td>482913</td><td>Thanks" -> "482913Thanks"),
+# и код теряет границу слова, поэтому перед такими тегами вставляется перевод строки
+BLOCK_TAG = re.compile(
+    r'<(?=/?(?:p|div|br|hr|tr|td|th|li|ul|ol|dl|dt|dd|h[1-6]|table|thead|tbody|tfoot|caption'
+    r'|section|article|header|footer|nav|aside|blockquote|pre|address|center|form|fieldset)\b)',
+    re.IGNORECASE
+)
+
+
+def break_blocks(html: str) -> str:
+    return BLOCK_TAG.sub('\n<', html)
+
+
+class HtmlTextBackend(ABC):
+    """Преобразование HTML письма в текст и список ссылок"""
+
+    name = ""
+
+    @abstractmethod
+    def parse(self, html: str) -> Tuple[str, List[str]]:
+        """Возвращает текст документа (блоки разделены переводом строки) и href всех тегов <a>"""
+
+    def to_text(self, html: str) -> str:
+        return self.parse(html)[0].strip()
+
+
+def _soup(html: str):
+    # bs4 нужен только как запасной парсер, поэтому не импортируется при старте
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, 'html.parser')
+
+
+class SoupBackend(HtmlTextBackend):
+    """Чистый Python через BeautifulSoup и html.parser - медленный, но всегда доступен"""
+
+    name = "bs4"
+
+    def parse(self, html: str) -> Tuple[str, List[str]]:
+        soup = _soup(break_blocks(html))
+        return soup.get_text(), [a.get('href', '') for a in soup.find_all('a')]
+
+    def to_text(self, html: str) -> str:
+        return _soup(break_blocks(html)).get_text().strip()
+
+
+class LxmlBackend(HtmlTextBackend):
+    """Парсер libxml2 через lxml"""
+
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+        self._fromstring = lxml.html.fromstring
+        self._fallback = SoupBackend()
+
+    def parse(self, html: str) -> Tuple[str, List[str]]:
+        if not html.strip():
+            return html, []
+        try:
+            root = self._fromstring(break_blocks(html))
+        except ValueError:
+            # lxml не принимает строки с XML-декларацией кодировки
+            return self._fallback.parse(html)
+        return root.text_content(), [a.get('href', '') for a in root.iter('a')]
+
+
+class SelectolaxBackend(HtmlTextBackend):
+    """Парсер lexbor через selectolax - самый быстрый из доступных"""
+
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def parse(self, html: str) -> Tuple[str, List[str]]:
+        tree = self._parser(break_blocks(html))
+        if tree.root is None:
+            return "", []
+        hrefs = [node.attributes.get('href') or '' for node in tree.css('a')]
+        return tree.root.text(deep=True, separator=''), hrefs
+
+
+BACKENDS = {
+    SelectolaxBackend.name: SelectolaxBackend,
+    LxmlBackend.name: LxmlBackend,
+    SoupBackend.name: SoupBackend,
+}
+AUTO_ORDER = (SelectolaxBackend.name, LxmlBackend.name, SoupBackend.name)
+
+_backend: Optional[HtmlTextBackend] = None
+
+
+def create_backend(name: str) -> HtmlTextBackend:
+    """Создает backend по имени; "auto" выбирает самый быстрый из установленных"""
+    name = (name or "auto").lower()
+    candidates = AUTO_ORDER if name == "auto" else (name,)
+    for candidate in candidates:
+        backend_cls = BACKENDS.get(candidate)
+        if backend_cls is None:
+            logger.warning(f"Unknown HTML parser backend: {candidate}")
+            continue
+        try:
+            return backend_cls()
+        except ImportError:
+            logger.warning(f"HTML parser backend {candidate} is not installed")
+    return SoupBackend()
+
+
+def configure_backend(name: str) -> HtmlTextBackend:
+    global _backend
+    _backend = create_backend(name)
+    logger.info(f"HTML parser backend: {_backend.name}")
+    return _backend
+
+
+def get_backend() -> HtmlTextBackend:
+    global _backend
+    if _backend is None:
+        _backend = create_backend("auto")
+    return _backend
+
+
+def html_to_text(html: str) -> str:
+    return get_backend().to_text(html)
@@ -0,0 +1,158 @@
+import asyncio
+import importlib.util
+import random
+import time
+from typing import Optional
+import httpx
+from loguru import logger
+
+from config import Settings
+from services.circuit_breaker import BreakerRegistry, CircuitOpenError, RetryBudget
+from services.concurrency import UpstreamBusyError, UpstreamLimiter
+from services.metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+
+
+class UpstreamClient:
+    """Общий HTTP-клиент для всех обращений к почтовым сервисам.
+
+    Один пул соединений на процесс: EmailCreator и EmailReader переиспользуют
+    уже установленные TLS-соединения, а при HTTP/2 мультиплексируют запросы
+    к одному хосту в одном соединении. Клиент создается при первом обращении
+    или в startup и закрывается в shutdown.
+
+    Все запросы идут через ``request``: у каждого эндпоинта свой circuit
+    breaker, а повторы ограничены общим бюджетом и делаются с джиттером.
+    Каждая попытка, включая повторы, проходит через общий ограничитель
+    темпа и числа одновременных запросов.
+    """
+
+    # Ответы, после которых имеет смысл повторить запрос
+    RETRY_STATUSES = {429, 502, 503, 504}
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self._client: Optional[httpx.AsyncClient] = None
+        self.breakers = BreakerRegistry(settings.breaker_failure_threshold, settings.breaker_reset_timeout)
+        self.retry_budget = RetryBudget(ratio=settings.retry_budget_ratio)
+        self.limiter = UpstreamLimiter(
+            settings.upstream_rate_limit,
+            settings.upstream_rate_burst,
+            settings.upstream_max_in_flight,
+            settings.upstream_queue_timeout
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build()
+        return self._client
+
+    @property
+    def http2(self) -> bool:
+        # HTTP/2 в httpx требует пакет h2 (httpx[http2])
+        return self.settings.upstream_http2 and importlib.util.find_spec("h2") is not None
+
+    def _build(self) -> httpx.AsyncClient:
+        settings = self.settings
+        if settings.upstream_http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=settings.upstream_max_connections,
+                max_keepalive_connections=settings.upstream_max_keepalive,
+                keepalive_expiry=settings.upstream_keepalive_expiry
+            ),
+            timeout=httpx.Timeout(
+                settings.upstream_read_timeout,
+                connect=settings.upstream_connect_timeout,
+                pool=settings.upstream_pool_timeout
+            )
+        )
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Запрос к upstream с circuit breaker'ом эндпоинта и ограниченными повторами.
+
+        Сетевые ошибки, 5xx и 429 считаются сбоями. Остальные ответы, включая
+        4xx, возвращаются как есть. Если автомат открыт, сразу поднимается
+        CircuitOpenError.
+        """
+        breaker = self.breakers.get(endpoint)
+        self.retry_budget.record_request()
+        delay = self.settings.retry_backoff_base
+        attempt = 1
+        while True:
+            if not breaker.allow():
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome="circuit_open")
+                raise CircuitOpenError(endpoint, breaker.retry_after())
+            started = time.perf_counter()
+            try:
+                async with self.limiter.slot(endpoint):
+                    started = time.perf_counter()
+                    response = await self.client.request(method, url, **kwargs)
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome=str(response.status_code))
+                if response.status_code < 500 and response.status_code != 429:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if response.status_code == 429:
+                    # Замедляем все запросы процесса, а не только этот
+                    self.limiter.bucket.throttle(self._retry_after(response))
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                error: Exception = httpx.HTTPStatusError(
+                    f"Upstream {endpoint} returned {response.status_code}", request=response.request, response=response
+                )
+            except UpstreamBusyError:
+                # Перегружены мы сами, а не upstream: ошибку не засчитываем, а
+                # занятое пробное место half-open автомата возвращаем
+                breaker.release()
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome="queue_timeout")
+                raise
+            except httpx.TransportError as e:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome=type(e).__name__)
+                breaker.record_failure()
+                error = e
+
+            if attempt >= self.settings.upstream_max_attempts or not self.retry_budget.try_retry():
+                raise error
+            # Decorrelated jitter: паузы растут, но не синхронизируются между запросами
+            delay = min(self.settings.retry_backoff_cap,
+                        random.uniform(self.settings.retry_backoff_base, delay * 3))
+            logger.warning(f"Upstream {endpoint} attempt {attempt} failed: {error}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _retry_after(self, response: httpx.Response) -> float:
+        try:
+            return min(self.settings.retry_backoff_cap, float(response.headers.get("retry-after", "")))
+        except ValueError:
+            # Retry-After в виде даты или без заголовка
+            return self.settings.retry_backoff_base
+
+    def health(self) -> dict:
+        return {
+            "breakers": self.breakers.snapshot(),
+            "retry_budget": self.retry_budget.snapshot(),
+            "limiter": self.limiter.snapshot()
+        }
+
+    async def start(self):
+        client = self.client
+        logger.info(
+            f"Upstream HTTP client ready: http2={self.http2}, "
+            f"max_connections={self.settings.upstream_max_connections}, "
+            f"keepalive={self.settings.upstream_max_keepalive}"
+        )
+        return client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            try:
+                await self._client.aclose()
+                logger.info("Upstream HTTP client closed")
+            except Exception as e:
+                logger.error(f"Error closing upstream HTTP client: {e}")
+        self._client = None
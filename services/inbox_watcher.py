@@ -0,0 +1,190 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from loguru import logger
+
+from models.message import Message
+from services.email_reader import EmailReader, as_aware
+
+
+class _MailboxWatch:
+    """Состояние наблюдения за одним ящиком"""
+
+    def __init__(self, email: str):
+        self.email = email
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.seen_ids: Set[str] = set()
+        self.snapshot: Optional[List[Message]] = None
+        self.task: Optional[asyncio.Task] = None
+        # Моменты (time.monotonic) создания ящика и прихода последнего ожидающего код
+        self.created = time.monotonic()
+        self.last_wait = 0.0
+        self.wakeup = asyncio.Event()
+
+
+class InboxWatcher:
+    """Один фоновый опрос upstream на каждый активный ящик.
+
+    Сколько бы вкладок ни было открыто на один адрес, upstream опрашивается
+    одной задачей, а новые письма раздаются всем подписчикам. Новый подписчик
+    сначала получает весь текущий список, затем только новые письма.
+
+    Интервал опроса адаптивный: письмо с кодом обычно приходит в первые
+    минуты после создания ящика или после того, как клиент начал ждать код,
+    поэтому в течение ``fast_period`` секунд ящик опрашивается каждые
+    ``fast_interval`` секунд, затем каждые ``interval``, а после ``slow_after``
+    секунд тишины - каждые ``slow_interval``.
+    """
+
+    QUEUE_SIZE = 16
+    # Как часто ожидающий код проверяет, не отключился ли клиент
+    DISCONNECT_CHECK = 5.0
+
+    def __init__(self, reader: EmailReader, interval: float, fast_interval: Optional[float] = None,
+                 fast_period: float = 0.0, slow_interval: Optional[float] = None, slow_after: float = 0.0,
+                 prepare: Optional[Callable[[List[Message]], Awaitable[None]]] = None):
+        self.reader = reader
+        # Подготовка писем (разбор больших писем в пуле) до раздачи подписчикам
+        self.prepare = prepare
+        self.interval = interval
+        self.fast_interval = fast_interval or interval
+        self.fast_period = fast_period
+        self.slow_interval = slow_interval or interval
+        self.slow_after = slow_after
+        self._watches: Dict[str, _MailboxWatch] = {}
+
+    def poll_interval(self, quiet_for: float) -> float:
+        if quiet_for < self.fast_period:
+            return self.fast_interval
+        if self.slow_after and quiet_for >= self.slow_after:
+            return self.slow_interval
+        return self.interval
+
+    def subscribe(self, email: str) -> asyncio.Queue:
+        watch = self._watches.get(email)
+        if watch is None:
+            watch = _MailboxWatch(email)
+            self._watches[email] = watch
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        watch.subscribers.add(queue)
+        if watch.snapshot is not None:
+            queue.put_nowait(list(watch.snapshot))
+        if watch.task is None or watch.task.done():
+            watch.task = asyncio.ensure_future(self._run(watch))
+        logger.debug(f"Subscribed to {email}, subscribers: {len(watch.subscribers)}")
+        return queue
+
+    async def wait_for(
+        self,
+        email: str,
+        match: Callable[[Message], bool],
+        timeout: float,
+        since_id: Optional[str] = None,
+        disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Optional[Message]:
+        """Ждет письмо, для которого match вернет True; None - не дождались.
+
+        Письма, уже лежащие в ящике, тоже проверяются (кроме пришедших не позже
+        since_id), иначе письмо, успевшее прийти до вызова, было бы пропущено.
+        Из нескольких подходящих писем возвращается самое новое.
+        """
+        queue = self.subscribe(email)
+        watch = self._watches[email]
+        watch.last_wait = time.monotonic()
+        # Опрос мог спать с медленным интервалом - будим его
+        watch.wakeup.set()
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    messages = await asyncio.wait_for(queue.get(), timeout=min(remaining, self.DISCONNECT_CHECK))
+                except asyncio.TimeoutError:
+                    if disconnected is not None and await disconnected():
+                        return None
+                    continue
+                if since_id:
+                    messages = self.reader.select_new(email, messages, since_id, None)
+                for msg in sorted(messages, key=lambda m: as_aware(m.date), reverse=True):
+                    if match(msg):
+                        return msg
+        finally:
+            self.unsubscribe(email, queue)
+
+    def unsubscribe(self, email: str, queue: asyncio.Queue):
+        watch = self._watches.get(email)
+        if watch is None:
+            return
+        watch.subscribers.discard(queue)
+        if not watch.subscribers:
+            # Последний подписчик ушел - останавливаем опрос ящика
+            if watch.task and not watch.task.done():
+                watch.task.cancel()
+            self._watches.pop(email, None)
+            logger.debug(f"Stopped watching {email}")
+
+    @property
+    def active_mailboxes(self) -> int:
+        return len(self._watches)
+
+    async def stop(self):
+        tasks = [w.task for w in self._watches.values() if w.task and not w.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._watches.clear()
+
+    async def _run(self, watch: _MailboxWatch):
+        await self._load_created(watch)
+        while watch.subscribers:
+            interval = self.poll_interval(time.monotonic() - max(watch.created, watch.last_wait))
+            watch.wakeup.clear()
+            try:
+                # Запись кэша моложе интервала - кто-то уже сходил в upstream за нас
+                messages, _ = await self.reader.get_inbox(watch.email, max_age=interval)
+                if self.prepare is not None:
+                    await self.prepare(messages)
+                self._publish(watch, messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error watching mailbox {watch.email}: {str(e)}")
+            try:
+                await asyncio.wait_for(watch.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _load_created(self, watch: _MailboxWatch):
+        try:
+            account = await self.reader.storage.get_account(watch.email)
+        except Exception as e:
+            logger.debug("Can't load account {}: {}", watch.email, e)
+            return
+        if account is not None:
+            age = (datetime.now().astimezone() - as_aware(account.created_at)).total_seconds()
+            watch.created = time.monotonic() - max(0.0, age)
+
+    def _publish(self, watch: _MailboxWatch, messages: List[Message]):
+        # Первая загрузка отдается целиком, даже пустая
+        first = watch.snapshot is None
+        fresh = [msg for msg in messages if msg.message_id not in watch.seen_ids]
+        watch.snapshot = list(messages)
+        watch.seen_ids.update(msg.message_id for msg in messages)
+        if not fresh and not first:
+            return
+
+        for queue in list(watch.subscribers):
+            if queue.full():
+                # Медленный клиент: заменяем накопленные события полным списком
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(list(watch.snapshot))
+            else:
+                queue.put_nowait(fresh)
@@ -0,0 +1,243 @@
+"""Единый конвейер логов: loguru -> ограниченная очередь -> JSON-строки в файл.
+
+Обработчик loguru только кладет запись в очередь, поэтому запрос не ждет
+диска. Отдельный поток пачками сериализует записи через orjson и дописывает
+их в файл в режиме O_APPEND: строки нескольких воркеров не перемешиваются,
+а ротацию выполняет тот воркер, который первым заметил превышение размера.
+Если очередь переполнена, записи отбрасываются и считаются.
+"""
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import orjson
+from loguru import logger
+
+from config import Settings
+from services.metrics import LOG_RECORDS_DROPPED
+
+try:
+    import fcntl
+except ImportError:  # Windows: ротация между процессами без блокировки небезопасна и отключается
+    fcntl = None
+
+_STOP = object()
+
+
+def format_record(record: dict) -> bytes:
+    entry = dict(record["extra"])
+    entry.update({
+        "ts": record["time"].isoformat(timespec="milliseconds"),
+        "level": record["level"].name,
+        "msg": record["message"],
+        "logger": record["name"],
+        "func": record["function"],
+        "line": record["line"],
+        "pid": record["process"].id,
+    })
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_tb = record["exception"]
+        entry["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
+    return orjson.dumps(entry, default=str) + b"\n"
+
+
+class JsonLogWriter:
+    ROTATION_CHECK_INTERVAL = 1.0
+
+    def __init__(self, path: str, queue_size: int = 10000, max_bytes: int = 500 * 1024 * 1024,
+                 retention_days: float = 10, batch_size: int = 256):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._fd: Optional[int] = None
+        self._inode = 0
+        self._checked_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="json-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Дописывает накопленные записи и останавливает поток"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, message):
+        """Обработчик loguru: вызывается в потоке, который пишет в лог, и не блокирует его"""
+        try:
+            self.queue.put_nowait(message.record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def _run(self):
+        reported = 0
+        while True:
+            batch: List[dict] = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is _STOP for record in batch)
+            lines = []
+            for record in batch:
+                if record is _STOP:
+                    continue
+                try:
+                    lines.append(format_record(record))
+                except Exception as e:
+                    lines.append(orjson.dumps({"level": "ERROR", "msg": f"Unserializable log record: {e}"}) + b"\n")
+            if self.dropped != reported:
+                lines.append(orjson.dumps({
+                    "ts": datetime.now().astimezone().isoformat(timespec="milliseconds"),
+                    "level": "WARNING",
+                    "msg": "Log queue overflow, records dropped",
+                    "dropped": self.dropped - reported,
+                    "pid": os.getpid(),
+                }) + b"\n")
+                reported = self.dropped
+            try:
+                self._write(b"".join(lines))
+            except OSError:
+                # Писать логи некуда - не роняем процесс, следующая пачка попробует снова
+                self._close()
+            if stop:
+                self._close()
+                return
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write(self, data: bytes):
+        if self._fd is None:
+            self._open()
+        self._check_rotation()
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def _check_rotation(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.ROTATION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self._inode:
+            # Файл ротировал другой воркер - переходим на новый
+            self._close()
+            self._open()
+            return
+        if self.max_bytes and stat.st_size >= self.max_bytes and fcntl is not None:
+            self._rotate()
+
+    def _rotate(self):
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stat = os.stat(self.path)
+            # Пока ждали блокировку, файл мог уже ротировать другой воркер
+            if stat.st_ino == self._inode and stat.st_size >= self.max_bytes:
+                os.rename(self.path, f"{self.path}.{datetime.now():%Y-%m-%d_%H-%M-%S}")
+        self._close()
+        self._open()
+        self._cleanup()
+
+    def _cleanup(self):
+        deadline = time.time() - self.retention_days * 86400
+        for rotated in self.path.parent.glob(f"{self.path.name}.*"):
+            if rotated.suffix == ".lock":
+                continue
+            try:
+                if rotated.stat().st_mtime < deadline:
+                    rotated.unlink()
+            except OSError:
+                pass
+
+
+class RequestLogSampler:
+    """Решает, писать ли строку об успешном запросе.
+
+    Ошибки (status >= 400) и медленные запросы пишутся всегда, остальные -
+    с вероятностью из ``route_rates`` (``"/health=0,/api/email/messages/{email}=0.05"``)
+    или ``default_rate``.
+    """
+
+    def __init__(self, default_rate: float = 1.0, route_rates: str = "", slow_ms: float = 1000.0):
+        self.default_rate = default_rate
+        self.slow_ms = slow_ms
+        self.route_rates: Dict[str, float] = {}
+        for item in route_rates.split(","):
+            route, _, rate = item.strip().rpartition("=")
+            if route:
+                self.route_rates[route] = float(rate)
+
+    def should_log(self, route: str, status: int, duration_ms: float) -> bool:
+        if status >= 400 or duration_ms >= self.slow_ms:
+            return True
+        rate = self.route_rates.get(route, self.default_rate)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class InterceptHandler(logging.Handler):
+    """Перенаправляет stdlib logging (httpx, asyncio и т.п.) в loguru"""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # Ищем кадр, откуда вызвали stdlib logging, чтобы loguru указал настоящий модуль и строку
+        frame, depth = sys._getframe(), 0
+        while frame is not None and (depth == 0 or frame.f_code.co_filename == logging.__file__):
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
+
+def setup_logging(settings: Settings) -> JsonLogWriter:
+    """Направляет loguru и logging в JsonLogWriter; поток записи запускает вызывающий (writer.start())"""
+    writer = JsonLogWriter(
+        settings.log_file,
+        queue_size=settings.log_queue_size,
+        max_bytes=settings.log_rotation_mb * 1024 * 1024,
+        retention_days=settings.log_retention_days
+    )
+    logger.remove()
+    # diagnose/backtrace выключены: значения переменных в трейсбеке дороги и могут содержать письма
+    logger.add(writer.write, level=settings.log_level, format="{message}", backtrace=False, diagnose=False)
+    level = logging.getLevelName(settings.log_level.upper())
+    logging.basicConfig(handlers=[InterceptHandler()], level=level if isinstance(level, int) else logging.INFO,
+                        force=True)
+    # Каждый запрос к upstream уже виден в метриках, строка на запрос от httpx не нужна
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return writer
@@ -0,0 +1,396 @@
+import asyncio
+import itertools
+import random
+import string
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, TypeVar
+from loguru import logger
+
+from config import Settings
+from services.circuit_breaker import CircuitOpenError
+from services.http_client import UpstreamClient
+
+T = TypeVar("T")
+
+
+class MailProvider(ABC):
+    """Сервис временной почты.
+
+    Письма возвращаются в формате ответа temp-mail (/see): словари с полями
+    id, from, to, subject, date, body_text, body_html. ``domains`` - домены
+    адресов, которые обслуживает провайдер: заданные в настройках и
+    запомненные при создании ящиков.
+    """
+
+    name = ""
+    domains: Set[str] = frozenset()
+
+    @abstractmethod
+    async def create_mailbox(self) -> str:
+        """Новый случайный адрес"""
+
+    @abstractmethod
+    async def create_custom_mailbox(self, username: str) -> str:
+        """Новый адрес с заданным именем"""
+
+    @abstractmethod
+    async def list_messages(self, email: str) -> List[dict]:
+        """Все письма ящика"""
+
+    @abstractmethod
+    async def get_message(self, email: str, message_id: str) -> Optional[dict]:
+        """Одно письмо или None, если его нет"""
+
+    @abstractmethod
+    async def mailbox_exists(self, email: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete_mailbox(self, email: str) -> bool:
+        pass
+
+    def is_available(self, endpoint: str) -> bool:
+        """False, пока circuit breaker эндпоинта открыт"""
+        return True
+
+
+class TempMailProvider(MailProvider):
+    """HTTP API temp-mail (tempmail.glitchy.workers.dev и совместимые зеркала)"""
+
+    def __init__(self, name: str, base_url: str, upstream: UpstreamClient, domains: Iterable[str] = ()):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.upstream = upstream
+        self.domains = {d.strip().lower() for d in domains if d.strip()}
+
+    def is_available(self, endpoint: str) -> bool:
+        return not self.upstream.breakers.is_open(f"{self.name}:{endpoint}")
+
+    async def _request(self, endpoint: str, method: str, path: str, **kwargs):
+        # У каждого провайдера свои circuit breaker'ы
+        return await self.upstream.request(f"{self.name}:{endpoint}", method, f"{self.base_url}{path}", **kwargs)
+
+    async def create_mailbox(self) -> str:
+        response = await self._request("get", "GET", "/get")
+        response.raise_for_status()
+        return self._mail_from(response.json())
+
+    async def create_custom_mailbox(self, username: str) -> str:
+        response = await self._request("custom", "GET", "/custom", params={"username": username})
+        response.raise_for_status()
+        return self._mail_from(response.json())
+
+    async def list_messages(self, email: str) -> List[dict]:
+        response = await self._request("see", "GET", "/see", params={"mail": email})
+        response.raise_for_status()
+        return response.json().get("messages") or []
+
+    async def get_message(self, email: str, message_id: str) -> Optional[dict]:
+        response = await self._request("message", "GET", "/message", params={"mail": email, "id": message_id})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        # Сервис может вернуть письмо как есть или обернутым в "message"
+        msg_data = data.get("message", data) if isinstance(data, dict) else None
+        if not isinstance(msg_data, dict) or str(msg_data.get("id", "")) != message_id:
+            return None
+        return msg_data
+
+    async def mailbox_exists(self, email: str) -> bool:
+        response = await self._request("mailbox", "GET", f"/mailbox/{email}")
+        return response.status_code == 200
+
+    async def delete_mailbox(self, email: str) -> bool:
+        response = await self._request("mailbox", "DELETE", f"/mailbox/{email}")
+        if response.status_code != 200:
+            logger.error(f"Failed to delete mailbox {email} at {self.name}, status: {response.status_code}")
+        return response.status_code == 200
+
+    @staticmethod
+    def _mail_from(data: dict) -> str:
+        if not data.get("mail"):
+            raise Exception("Сервис не вернул адрес почты")
+        return data["mail"]
+
+
+class FakeMailProvider(MailProvider):
+    """Локальный сервис в памяти для тестов и бенчмарков.
+
+    Письма добавляются через ``deliver``; ``latency`` имитирует задержку сети.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, domain: str = "fake.local"):
+        self.latency = latency
+        self.domain = domain
+        self.domains = {domain}
+        self.mailboxes: Dict[str, List[dict]] = {}
+        self._ids = itertools.count(1)
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_mailbox(self) -> str:
+        username = "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(10))
+        return await self.create_custom_mailbox(username)
+
+    async def create_custom_mailbox(self, username: str) -> str:
+        await self._delay()
+        email = f"{username}@{self.domain}"
+        self.mailboxes.setdefault(email, [])
+        return email
+
+    async def list_messages(self, email: str) -> List[dict]:
+        await self._delay()
+        return list(self.mailboxes.get(email, []))
+
+    async def get_message(self, email: str, message_id: str) -> Optional[dict]:
+        await self._delay()
+        return next((m for m in self.mailboxes.get(email, []) if m["id"] == message_id), None)
+
+    async def mailbox_exists(self, email: str) -> bool:
+        await self._delay()
+        return email in self.mailboxes
+
+    async def delete_mailbox(self, email: str) -> bool:
+        await self._delay()
+        return self.mailboxes.pop(email, None) is not None
+
+    def deliver(self, email: str, subject: str, body_text: str = "", body_html: str = "",
+                sender: str = "noreply@example.com") -> dict:
+        message = {
+            "id": str(next(self._ids)),
+            "from": sender,
+            "to": email,
+            "subject": subject,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "body_text": body_text,
+            "body_html": body_html,
+        }
+        self.mailboxes.setdefault(email, []).append(message)
+        return message
+
+
+class LatencyTracker:
+    """Скользящее окно времени успешных ответов для выбора задержки хеджирования"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def mailbox_domain(email: str) -> str:
+    return email.rpartition("@")[2].lower()
+
+
+class ProviderRouter:
+    """Направляет операции к провайдерам с отказоустойчивостью и хеджированием.
+
+    Создание ящика идет к следующему провайдеру только после ошибки, и домен
+    созданного адреса запоминается за создавшим его провайдером. Все
+    остальные операции идут только к владельцам ящика - провайдерам, которые
+    обслуживают его домен (реплики одного сервиса); если домен не известен
+    никому, владельцем считается основной провайдер. Чужой провайдер ящика
+    не знает и ответил бы пустым списком или 404.
+
+    Чтение (list_messages, get_message) хеджируется между владельцами: если
+    первый не ответил за ``hedge_percentile`` своего обычного времени ответа,
+    параллельно спрашивается следующий. Непустой ответ принимается сразу,
+    а пустой ответ реплики - только когда первый владелец уже упал: реплика
+    могла еще не получить письмо.
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, providers: List[MailProvider], hedge_enabled: bool = True,
+                 hedge_percentile: float = 0.95, hedge_min_delay: float = 0.05,
+                 hedge_default_delay: float = 1.0):
+        if not providers:
+            raise ValueError("Нужен хотя бы один почтовый провайдер")
+        self.providers = providers
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self._latency: Dict[str, LatencyTracker] = {}
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    @property
+    def primary(self) -> MailProvider:
+        return self.providers[0]
+
+    def hedge_delay(self, provider: MailProvider, operation: str) -> float:
+        tracker = self._latency.get(f"{provider.name}:{operation}")
+        if tracker is None or len(tracker) < self.MIN_SAMPLES:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, tracker.percentile(self.hedge_percentile))
+
+    async def _timed(self, provider: MailProvider, operation: str, call: Callable[[MailProvider], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        result = await call(provider)
+        key = f"{provider.name}:{operation}"
+        self._latency.setdefault(key, LatencyTracker()).record(time.monotonic() - started)
+        return result
+
+    def owners(self, email: str) -> List[MailProvider]:
+        """Провайдеры, обслуживающие ящик, в порядке приоритета"""
+        domain = mailbox_domain(email)
+        return [p for p in self.providers if domain in p.domains] or [self.primary]
+
+    async def _created(self, provider: MailProvider, created: Awaitable[str]) -> str:
+        email = await created
+        domain = mailbox_domain(email)
+        if domain not in provider.domains:
+            provider.domains = set(provider.domains) | {domain}
+            logger.info(f"Mail provider {provider.name} serves domain {domain}")
+        return email
+
+    async def _failover(self, operation: str, call: Callable[[MailProvider], Awaitable[T]],
+                        providers: Optional[List[MailProvider]] = None) -> T:
+        error: Optional[Exception] = None
+        for provider in providers or self.providers:
+            try:
+                return await self._timed(provider, operation, call)
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    logger.warning(f"{operation} failed at {provider.name}: {str(e)}")
+                error = e
+        raise error
+
+    async def _hedged(self, operation: str, call: Callable[[MailProvider], Awaitable[T]],
+                      providers: List[MailProvider]) -> T:
+        if not self.hedge_enabled or len(providers) == 1:
+            return await self._failover(operation, call, providers)
+
+        spare = list(providers)
+        tasks: Dict[asyncio.Future, MailProvider] = {}
+        errors: List[Exception] = []
+        # Пустые ответы реплик, отложенные до ответа первого владельца
+        held: List[T] = []
+
+        def launch():
+            provider = spare.pop(0)
+            tasks[asyncio.ensure_future(self._timed(provider, operation, call))] = provider
+            return provider
+
+        first = launch()
+        timeout: Optional[float] = self.hedge_delay(first, operation)
+        try:
+            while True:
+                done, _ = await asyncio.wait(set(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                failed = False
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        failed = True
+                        continue
+                    result = task.result()
+                    if provider is not first and not result and first in tasks.values():
+                        held.append(result)
+                        continue
+                    if provider is not first:
+                        self.hedge_wins += 1
+                    return result
+                if held and first not in tasks.values():
+                    # Первый владелец упал - пустой ответ реплики и есть ответ
+                    self.hedge_wins += 1
+                    return held[0]
+
+                # Первый не успел или упал - подключаем следующего провайдера
+                if (failed or not done) and spare:
+                    provider = launch()
+                    if not failed:
+                        self.hedged_requests += 1
+                    timeout = self.hedge_delay(provider, operation)
+                    continue
+                if not tasks:
+                    raise errors[-1]
+                if not spare:
+                    timeout = None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def create_mailbox(self) -> str:
+        return await self._failover("create_mailbox", lambda p: self._created(p, p.create_mailbox()))
+
+    async def create_custom_mailbox(self, username: str) -> str:
+        return await self._failover(
+            "create_custom_mailbox", lambda p: self._created(p, p.create_custom_mailbox(username))
+        )
+
+    async def list_messages(self, email: str) -> List[dict]:
+        return await self._hedged("list_messages", lambda p: p.list_messages(email), self.owners(email))
+
+    async def get_message(self, email: str, message_id: str) -> Optional[dict]:
+        return await self._hedged(
+            "get_message", lambda p: p.get_message(email, message_id), self.owners(email)
+        )
+
+    async def mailbox_exists(self, email: str) -> bool:
+        return await self._failover("mailbox_exists", lambda p: p.mailbox_exists(email), self.owners(email))
+
+    async def delete_mailbox(self, email: str) -> bool:
+        return await self._failover("delete_mailbox", lambda p: p.delete_mailbox(email), self.owners(email))
+
+    def is_available(self, endpoint: str) -> bool:
+        return any(p.is_available(endpoint) for p in self.providers)
+
+    def stats(self) -> dict:
+        return {
+            "providers": [p.name for p in self.providers],
+            "domains": {p.name: sorted(p.domains) for p in self.providers},
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay": {
+                p.name: round(self.hedge_delay(p, "list_messages"), 3) for p in self.providers
+            }
+        }
+
+
+def build_router(settings: Settings, upstream: UpstreamClient) -> ProviderRouter:
+    """Провайдеры из MAIL_PROVIDERS в порядке приоритета"""
+    known = {
+        "glitchy": lambda: TempMailProvider(
+            "glitchy", settings.upstream_base_url, upstream, settings.upstream_domains.split(",")
+        ),
+        "fallback": lambda: TempMailProvider(
+            "fallback", settings.fallback_base_url, upstream, settings.fallback_domains.split(",")
+        ),
+        "fake": lambda: FakeMailProvider(),
+    }
+    providers = []
+    for name in (n.strip().lower() for n in settings.mail_providers.split(",")):
+        if not name:
+            continue
+        if name not in known:
+            logger.warning(f"Unknown mail provider: {name}")
+            continue
+        if name == "fallback" and not settings.fallback_base_url:
+            logger.warning("Mail provider fallback is enabled but FALLBACK_BASE_URL is not set, skipping it")
+            continue
+        providers.append(known[name]())
+    return ProviderRouter(
+        providers,
+        hedge_enabled=settings.hedge_enabled,
+        hedge_percentile=settings.hedge_percentile,
+        hedge_min_delay=settings.hedge_min_delay,
+        hedge_default_delay=settings.hedge_default_delay
+    )
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+from loguru import logger
+
+from models.email_account import EmailAccount
+from services.batch import gather_bounded
+from services.email_creator import EmailCreator
+from services.metrics import CACHE_REQUESTS
+
+
+class MailboxPool:
+    """Запас заранее созданных адресов для мгновенной выдачи.
+
+    Фоновая задача держит в пуле до ``size`` готовых ящиков и пополняет его
+    после каждой выдачи. Ящики старше ``max_age`` секунд выбрасываются,
+    чтобы пользователь не получил адрес, который upstream уже забыл, и
+    удаляются у провайдера, как это делает MailboxSweeper.
+    """
+
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, creator: EmailCreator, size: int, max_age: float, refill_concurrency: int = 2):
+        self.creator = creator
+        self.size = size
+        self.max_age = max_age
+        self.refill_concurrency = max(1, refill_concurrency)
+        self._ready: Deque[Tuple[float, EmailAccount]] = deque()
+        # Устаревшие ящики, которые еще нужно удалить у провайдера
+        self._stale: List[EmailAccount] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.delete_failures = 0
+        self.refill_errors = 0
+
+    def start(self):
+        if self.size > 0 and (self._task is None or self._task.done()):
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Mailbox pool started, target size: {self.size}")
+
+    async def stop(self):
+        # Флаг нужен вдобавок к cancel: wait_for до Python 3.12 теряет отмену,
+        # если событие пришло одновременно с ней (выдача прямо перед остановкой)
+        self._stopping = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        # Ящики из пула никому не выданы, и после остановки их никто не выдаст
+        self._stale.extend(account for _, account in self._ready)
+        self._ready.clear()
+        await self._discard_stale()
+
+    def acquire(self) -> Optional[EmailAccount]:
+        """Готовый ящик из пула или None, если пул пуст"""
+        self._expire()
+        if not self._ready:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache="mailbox_pool", result="miss")
+            self._notify()
+            return None
+        _, account = self._ready.popleft()
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache="mailbox_pool", result="hit")
+        self._notify()
+        # Время жизни ящика для пользователя начинается с момента выдачи
+        account.created_at = datetime.now()
+        return account
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "depth": len(self._ready),
+            "target": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "expired": self.expired,
+            "delete_failures": self.delete_failures,
+            "refill_errors": self.refill_errors,
+            "running": self._task is not None and not self._task.done()
+        }
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.max_age
+        while self._ready and self._ready[0][0] < deadline:
+            self._stale.append(self._ready.popleft()[1])
+            self.expired += 1
+
+    async def _discard_stale(self):
+        """Удаляет выброшенные из пула ящики у провайдера"""
+        if not self._stale:
+            return
+        emails = [account.email for account in self._stale]
+        self._stale = []
+        results = await gather_bounded(self.creator.providers.delete_mailbox, emails, self.refill_concurrency)
+        failed = [email for email, result in zip(emails, results) if result is not True]
+        self.delete_failures += len(failed)
+        if failed:
+            # Повторять не нужно: сервис сам забудет ящик со временем
+            logger.warning(f"Failed to delete {len(failed)} expired pool mailboxes upstream")
+
+    async def _create_one(self):
+        account = await self.creator.prepare_account()
+        self._ready.append((time.monotonic(), account))
+
+    async def _run(self):
+        backoff = 1.0
+        while not self._stopping:
+            self._expire()
+            await self._discard_stale()
+            missing = self.size - len(self._ready)
+            if missing > 0:
+                batch = min(missing, self.refill_concurrency)
+                results = await asyncio.gather(
+                    *(self._create_one() for _ in range(batch)), return_exceptions=True
+                )
+                errors = [r for r in results if isinstance(r, Exception)]
+                self.refill_errors += len(errors)
+                if len(errors) == batch:
+                    logger.warning(f"Mailbox pool refill failed: {errors[0]}, retrying in {backoff:.0f}s")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.MAX_BACKOFF)
+                else:
+                    backoff = 1.0
+                continue
+
+            # Пул полон: ждем выдачи или момента, когда пора проверить устаревшие ящики
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(1.0, self.max_age / 4))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,127 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+from loguru import logger
+
+from services.batch import gather_bounded
+from services.email_reader import EmailReader
+from services.mail_providers import ProviderRouter
+from services.metrics import MAILBOXES_EXPIRED
+from services.storage import Storage
+
+
+class MailboxSweeper:
+    """Фоновое удаление истекших ящиков.
+
+    Ящик живет ``ttl`` секунд с момента выдачи (столько же показывает
+    таймер на фронтенде), а при ``idle_ttl`` > 0 еще и удаляется, если к нему
+    столько не обращались. Истекшие аккаунты забираются из базы пачками,
+    удаляются у сервиса параллельно, но не больше ``concurrency`` запросов
+    одновременно, затем удаляются из базы вместе с письмами и забываются
+    в памяти процесса.
+    """
+
+    # Через сколько аккаунт, помеченный другим (упавшим) воркером, забирается снова
+    STALE_CLAIM = 600.0
+
+    def __init__(self, storage: Storage, reader: EmailReader, providers: ProviderRouter,
+                 ttl: float, idle_ttl: float = 0, interval: float = 60.0, batch_size: int = 100,
+                 concurrency: int = 5, memory_idle: float = 1800.0):
+        self.storage = storage
+        self.reader = reader
+        self.providers = providers
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.memory_idle = memory_idle
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.upstream_failures = 0
+        self.messages_pruned = 0
+        self.evicted_from_memory = 0
+        self.last_run: Optional[datetime] = None
+
+    def start(self):
+        if self.ttl > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Mailbox sweeper started, ttl: {self.ttl / 3600:g}h")
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        # Накопленные обращения не должны потеряться при перезапуске
+        await self.storage.touch_accounts(self.reader.drain_touched())
+
+    def stats(self) -> dict:
+        return {
+            "ttl_hours": round(self.ttl / 3600, 2),
+            "expired": self.expired,
+            "upstream_delete_failures": self.upstream_failures,
+            "messages_pruned": self.messages_pruned,
+            "evicted_from_memory": self.evicted_from_memory,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "running": self._task is not None and not self._task.done()
+        }
+
+    async def _run(self):
+        # Первый проход не в момент запуска: воркер сначала обслуживает запросы,
+        # а перезапускаемые воркеры не чистят базу одновременно
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Mailbox sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        """Один проход; возвращает число удаленных ящиков"""
+        await self.storage.touch_accounts(self.reader.drain_touched())
+        self.evicted_from_memory += self.reader.evict_idle(self.memory_idle)
+        await self.reader.inbox_cache.prune()
+
+        now = datetime.now()
+        created_before = now - timedelta(seconds=self.ttl)
+        idle_before = now - timedelta(seconds=self.idle_ttl) if self.idle_ttl > 0 else None
+        stale_claim_before = now - timedelta(seconds=self.STALE_CLAIM)
+
+        removed = 0
+        while True:
+            emails = await self.storage.claim_expired_accounts(
+                created_before, idle_before, self.batch_size, stale_claim_before
+            )
+            if emails:
+                removed += await self._remove(emails)
+            if len(emails) < self.batch_size:
+                break
+
+        # Письма старше срока жизни ящика уже никому не покажут
+        while True:
+            pruned = await self.storage.delete_messages_before(created_before)
+            self.messages_pruned += pruned
+            if pruned == 0:
+                break
+
+        self.last_run = now
+        if removed:
+            logger.info(f"Mailbox sweep removed {removed} expired mailboxes")
+        return removed
+
+    async def _remove(self, emails: List[str]) -> int:
+        results = await gather_bounded(self.providers.delete_mailbox, emails, self.concurrency)
+        # Сервис сам забудет ящик со временем, поэтому локальная запись удаляется в любом случае
+        self.upstream_failures += sum(1 for result in results if result is not True)
+        deleted = await self.storage.delete_accounts(emails)
+        for email in emails:
+            await self.reader.forget_mailbox(email)
+        self.expired += deleted
+        MAILBOXES_EXPIRED.inc(deleted)
+        return deleted
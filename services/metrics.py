@@ -0,0 +1,425 @@
+import asyncio
+import bisect
+import functools
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, сжатие файлов мертвых процессов отключено
+    fcntl = None
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики по корзинам (последняя - +Inf), сумма
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0.0] * (len(self.buckets) + 2)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    """Метрики процесса в формате Prometheus с агрегацией по воркерам uvicorn.
+
+    Каждый воркер периодически сбрасывает свои значения в ``<dir>/<pid>.json``.
+    При запросе /metrics обслуживающий воркер складывает файлы всех
+    процессов: счетчики и гистограммы суммируются (включая завершившиеся
+    воркеры, чтобы значения не откатывались назад после перезапуска), а
+    gauge учитываются только у живых процессов.
+
+    Gauge, которые снимаются с состояния сервисов, обновляют функции из
+    ``add_collector`` перед каждым сбросом, поэтому в файле каждого воркера
+    лежит его текущее значение. Работа с файлами идет в пуле потоков, а не в
+    event loop.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self.directory: Optional[Path] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """collector обновляет gauge перед каждым сбросом и выдачей метрик"""
+        self._collectors.append(collector)
+
+    # Обмен между процессами
+
+    def configure(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def start(self, interval: float):
+        if self.directory is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._flush_periodically(interval))
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.flush(self.take_snapshot())
+
+    async def _flush_periodically(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.flush, self.take_snapshot())
+            except Exception as e:
+                logger.warning(f"Failed to flush metrics: {e}")
+
+    def snapshot(self) -> dict:
+        # Строки гистограмм копируются: снимок пишется в файл из другого потока
+        return {
+            name: [[list(key), list(value) if isinstance(value, list) else value]
+                   for key, value in metric.values.items()]
+            for name, metric in self._metrics.items()
+        }
+
+    def take_snapshot(self) -> dict:
+        """Обновляет gauge через collector'ы и снимает значения процесса; вызывается из event loop"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return self.snapshot()
+
+    def flush(self, snapshot: Optional[dict] = None):
+        if self.directory is None:
+            return
+        if snapshot is None:
+            snapshot = self.snapshot()
+        path = self.directory / f"{os.getpid()}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"pid": os.getpid(), "metrics": snapshot}))
+        os.replace(tmp, path)
+
+    def _collect(self, snapshot: dict) -> Dict[str, Dict[LabelValues, object]]:
+        """Значения всех процессов, сложенные вместе"""
+        if self.directory is None:
+            return {name: {tuple(key): value for key, value in rows} for name, rows in snapshot.items()}
+
+        self.flush(snapshot)
+        self._compact()
+        merged: Dict[str, Dict[LabelValues, object]] = {name: {} for name in self._metrics}
+        with open(self.directory / ".lock", "w") as lock:
+            # Разделяемая блокировка: файлы не сворачиваются, пока мы их читаем
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+            snapshots = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        for data in snapshots:
+            alive = data.get("pid") is None or _pid_alive(data["pid"])
+            for name, rows in data["metrics"].items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                target = merged[name]
+                for key, value in rows:
+                    key = tuple(key)
+                    if metric.kind == "histogram":
+                        current = target.get(key)
+                        target[key] = [a + b for a, b in zip(current, value)] if current else list(value)
+                    else:
+                        target[key] = target.get(key, 0.0) + value
+        return merged
+
+    def _compact(self):
+        """Сворачивает файлы завершившихся воркеров в один, чтобы каталог не рос"""
+        if fcntl is None:
+            return
+        with open(self.directory / ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+            dead = []
+            for path in self.directory.glob("*.json"):
+                if path.stem.isdigit() and not _pid_alive(int(path.stem)):
+                    dead.append(path)
+            if not dead:
+                return
+            archive_path = self.directory / "archive.json"
+            archive: Dict[str, Dict[str, object]] = {}
+            if archive_path.exists():
+                for name, rows in json.loads(archive_path.read_text())["metrics"].items():
+                    archive[name] = {json.dumps(key): value for key, value in rows}
+            for path in dead:
+                try:
+                    rows_by_name = json.loads(path.read_text())["metrics"]
+                except (OSError, ValueError):
+                    rows_by_name = {}
+                for name, rows in rows_by_name.items():
+                    metric = self._metrics.get(name)
+                    if metric is None or metric.kind == "gauge":
+                        continue
+                    bucket = archive.setdefault(name, {})
+                    for key, value in rows:
+                        key = json.dumps(key)
+                        current = bucket.get(key)
+                        if current is None:
+                            bucket[key] = value
+                        elif metric.kind == "histogram":
+                            bucket[key] = [a + b for a, b in zip(current, value)]
+                        else:
+                            bucket[key] = current + value
+            tmp = archive_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"pid": None, "metrics": {
+                name: [[json.loads(key), value] for key, value in rows.items()] for name, rows in archive.items()
+            }}))
+            os.replace(tmp, archive_path)
+            for path in dead:
+                path.unlink()
+
+    async def export(self) -> str:
+        """Метрики всех воркеров для /metrics; файлы читаются и блокируются вне event loop"""
+        snapshot = self.take_snapshot()
+        return await asyncio.get_running_loop().run_in_executor(None, self.render, snapshot)
+
+    def render(self, snapshot: Optional[dict] = None) -> str:
+        """Текстовый формат Prometheus 0.0.4"""
+        if snapshot is None:
+            snapshot = self.take_snapshot()
+        lines = []
+        for name, values in self._collect(snapshot).items():
+            metric = self._metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(list(metric.buckets) + [float("inf")], value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served")
+UPSTREAM_REQUESTS = registry.counter(
+    "upstream_requests_total", "Upstream HTTP attempts by endpoint and outcome", ("endpoint", "outcome"))
+UPSTREAM_LATENCY = registry.histogram(
+    "upstream_request_duration_seconds", "Upstream HTTP attempt latency", ("endpoint",))
+UPSTREAM_QUEUE_DEPTH = registry.gauge(
+    "upstream_queue_depth", "Upstream requests waiting for a rate limiter slot")
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "upstream_requests_in_flight", "Upstream requests currently in flight")
+UPSTREAM_QUEUE_WAIT = registry.histogram(
+    "upstream_queue_wait_seconds", "Time an upstream request waited for the rate limiter", ("endpoint",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+SERVICE_CALLS = registry.counter(
+    "service_calls_total", "EmailCreator/EmailReader calls by method and outcome", ("method", "outcome"))
+SERVICE_LATENCY = registry.histogram(
+    "service_call_duration_seconds", "EmailCreator/EmailReader call latency", ("method",))
+EXTRACTION_LATENCY = registry.histogram(
+    "extraction_duration_seconds", "Verification code/link extraction time per message",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+MAILBOX_POOL_DEPTH = registry.gauge(
+    "mailbox_pool_depth", "Ready mailboxes in the pre-created pool")
+MAILBOXES_EXPIRED = registry.counter(
+    "mailboxes_expired_total", "Mailboxes removed by the TTL sweeper")
+LOG_RECORDS_DROPPED = registry.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full")
+EVENT_LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up a periodic probe",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+CPU_OFFLOADED = registry.counter(
+    "cpu_offload_items_total", "Messages parsed in the CPU pool instead of the event loop", ("mode",))
+CIRCUIT_OPEN = registry.gauge(
+    "upstream_circuit_open", "Workers whose circuit breaker for the endpoint is open", ("endpoint",))
+
+
+def instrument(method: str) -> Callable:
+    """Декоратор для асинхронных методов сервисов: время и исход каждого вызова"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                SERVICE_LATENCY.observe(time.perf_counter() - started, method=method)
+                SERVICE_CALLS.inc(method=method, outcome=outcome)
+        return wrapper
+    return decorator
+
+
+class LoopLagMonitor:
+    """Меряет задержку event loop: задача засыпает на ``interval`` и смотрит,
+    насколько позже она проснулась. Большая задержка значит, что loop занят
+    синхронной работой и все запросы воркера ждут."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            self.max = max(self.max, self.last)
+            EVENT_LOOP_LAG.observe(self.last)
+
+    def stats(self) -> dict:
+        return {"last_ms": round(self.last * 1000, 1), "max_ms": round(self.max * 1000, 1)}
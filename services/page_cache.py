@@ -0,0 +1,134 @@
+"""Готовые HTML-страницы в памяти.
+
+Страницы, которые не зависят от запроса (главная, страница верификации),
+рендерятся один раз и дальше отдаются готовыми байтами, заранее сжатыми
+gzip (и brotli, если он установлен), с ETag и Last-Modified. Страница
+перерисовывается, только если изменился один из ее исходных файлов
+(шаблон, подключенная статика); mtime проверяются не чаще раза в
+``check_interval`` секунд. Last-Modified - время самого нового из них.
+
+Рендер идет в пуле потоков: пока новая версия страницы готовится, запросы
+получают предыдущую. Ждет только самый первый рендер страницы.
+"""
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from services.static_assets import ENCODINGS, accepted_encodings, brotli
+
+
+@dataclass
+class CachedPage:
+    body: bytes
+    etag: str
+    last_modified: str
+    # Content-Encoding -> сжатое тело
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+    source_mtimes: Tuple[Optional[float], ...] = ()
+    checked_at: float = 0.0
+
+    def variant(self, accept_encoding: str) -> Tuple[Optional[str], bytes]:
+        """Сжатая копия, которую примет клиент, или исходное тело"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, _ in ENCODINGS:
+            if encoding in self.encoded and accepted.get(encoding, 0) > 0:
+                return encoding, self.encoded[encoding]
+        return None, self.body
+
+
+class PageCache:
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval = check_interval
+        self._pages: Dict[str, CachedPage] = {}
+        # name -> (функция рендера, исходные файлы)
+        self._sources: Dict[str, Tuple[Callable[[], str], Tuple[str, ...]]] = {}
+        # name -> рендер, который сейчас идет в пуле потоков
+        self._building: Dict[str, "asyncio.Future[CachedPage]"] = {}
+
+    def register(self, name: str, render: Callable[[], str], sources: Sequence[str] = ()):
+        """render возвращает HTML; sources - файлы, изменение которых требует перерисовки"""
+        self._sources[name] = (render, tuple(sources))
+
+    async def get(self, name: str) -> CachedPage:
+        page = self._pages.get(name)
+        if page is None:
+            # shield: отмена одного запроса не отменяет рендер для остальных
+            return await asyncio.shield(self._rebuild(name))
+        if self._stale(name, page):
+            self._rebuild(name)
+        return page
+
+    def warm(self):
+        """Запускает рендер всех еще не готовых страниц, например в фоне после старта"""
+        for name in self._sources:
+            if name not in self._pages:
+                self._rebuild(name)
+
+    def _rebuild(self, name: str) -> "asyncio.Future[CachedPage]":
+        """Рендер страницы в пуле потоков; параллельные вызовы получают один и тот же"""
+        loop = asyncio.get_running_loop()
+        future = self._building.get(name)
+        # Future закрытого loop (например, после тестового клиента) уже не завершится
+        if future is None or future.done() or future.get_loop() is not loop:
+            future = loop.run_in_executor(None, self._build, name)
+            future.add_done_callback(lambda done: self._built(name, done))
+            self._building[name] = future
+        return future
+
+    def _built(self, name: str, future: "asyncio.Future[CachedPage]"):
+        if self._building.get(name) is future:
+            del self._building[name]
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            # Остается предыдущая версия страницы, если она была
+            logger.error(f"Failed to render page {name}: {error}")
+            return
+        self._pages[name] = future.result()
+
+    def _stale(self, name: str, page: CachedPage) -> bool:
+        sources = self._sources[name][1]
+        if not sources:
+            return False
+        now = time.monotonic()
+        if now - page.checked_at < self.check_interval:
+            return False
+        page.checked_at = now
+        return self._mtimes(sources) != page.source_mtimes
+
+    @staticmethod
+    def _mtimes(paths: Sequence[str]) -> Tuple[Optional[float], ...]:
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _build(self, name: str) -> CachedPage:
+        render, sources = self._sources[name]
+        mtimes = self._mtimes(sources)
+        known = [mtime for mtime in mtimes if mtime is not None]
+        body = render().encode("utf-8")
+        encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(body, quality=11)
+        page = CachedPage(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()[:16]}"',
+            last_modified=formatdate(max(known) if known else time.time(), usegmt=True),
+            encoded={encoding: data for encoding, data in encoded.items() if len(data) < len(body)},
+            source_mtimes=mtimes,
+            checked_at=time.monotonic()
+        )
+        logger.info(f"Page {name} rendered: {len(body)} bytes")
+        return page
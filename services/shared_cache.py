@@ -0,0 +1,186 @@
+"""Кэш, общий для воркеров uvicorn.
+
+``memory`` живет в памяти процесса и годится для одного воркера. ``sqlite``
+хранит записи в отдельном файле SQLite (WAL), поэтому письма, загруженные
+одним воркером, видны остальным, а удаление записи сразу инвалидирует ее
+во всех процессах. Значения сериализуются через pickle: файл кэша пишут
+только процессы самого приложения.
+"""
+import asyncio
+import pickle
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from config import Settings
+from services.storage import sqlite_path
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class CacheBackend(ABC):
+    """Ключ -> значение со сроком жизни"""
+
+    name = ""
+    # Видят ли записи другие процессы
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        """Значение или None, если записи нет или она истекла"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float):
+        ...
+
+    @abstractmethod
+    async def add(self, key: str, value: Any, ttl: float) -> bool:
+        """Записывает значение, только если ключа нет; True - записали"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def prune(self) -> int:
+        """Удаляет истекшие записи, возвращает их число"""
+
+    async def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    async def add(self, key: str, value: Any, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    async def prune(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry[0] <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Кэш в файле SQLite, общий для всех процессов на машине.
+
+    Как и Storage, работает в одном выделенном потоке. Сроки жизни считаются
+    по time.time(), одинаковому для всех процессов. Запись на диск не
+    синхронизируется: потеря кэша при сбое питания ничего не ломает.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, database_url: str):
+        self.path = sqlite_path(database_url)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cache")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(CACHE_SCHEMA)
+            self._conn = conn
+            logger.info(f"SQLite cache opened: {self.path}")
+        return self._conn
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connection(), *args))
+
+    async def get(self, key: str) -> Optional[Any]:
+        def _get(conn: sqlite3.Connection):
+            return conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        row = await self._run(_get)
+        return pickle.loads(row[0]) if row else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def _set(conn: sqlite3.Connection):
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, data, time.time() + ttl)
+            )
+        await self._run(_set)
+
+    async def add(self, key: str, value: Any, ttl: float) -> bool:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def _add(conn: sqlite3.Connection) -> bool:
+            now = time.time()
+            # Истекшая запись не мешает; вставку выиграет ровно один процесс
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, data, now + ttl)
+            )
+            return cursor.rowcount == 1
+        return await self._run(_add)
+
+    async def delete(self, key: str):
+        await self._run(lambda conn: conn.execute("DELETE FROM cache WHERE key = ?", (key,)))
+
+    async def prune(self) -> int:
+        def _prune(conn: sqlite3.Connection) -> int:
+            return conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),)).rowcount
+        return await self._run(_prune)
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, _close)
+        self._executor.shutdown(wait=False)
+
+
+def create_cache_backend(settings: Settings) -> CacheBackend:
+    name = (settings.cache_backend or "memory").lower()
+    if name == SQLiteCacheBackend.name:
+        backend: CacheBackend = SQLiteCacheBackend(settings.cache_url)
+    else:
+        if name != MemoryCacheBackend.name:
+            logger.warning(f"Unknown cache backend: {name}, using memory")
+        backend = MemoryCacheBackend()
+    logger.info(f"Cache backend: {backend.name}")
+    return backend
@@ -0,0 +1,216 @@
+"""Версионирование и отдача статики.
+
+Хэши файлов считаются при старте и пересчитываются, когда у файла меняются
+mtime или размер, поэтому ссылки вида ``/static/js/app.js?v=<hash>``
+меняются только вместе с содержимым и могут кэшироваться браузером навсегда. Заранее сжатые копии (``.br``, ``.gz``)
+создаются командой
+
+    python -m services.static_assets [--dir static]
+
+и отдаются вместо оригинала, если клиент их принимает.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Сжатые копии в порядке предпочтения: (Content-Encoding, расширение)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE = {".js", ".css", ".html", ".svg", ".json", ".txt", ".xml", ".ico"}
+
+
+class AssetManifest:
+    """Относительный путь файла -> короткий хэш его содержимого"""
+
+    def __init__(self, directory: str, url_prefix: str = "/static"):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.hashes: Dict[str, str] = {}
+        # путь -> (mtime, размер), по которым считался хэш
+        self._stats: Dict[str, Tuple[float, int]] = {}
+
+    def build(self) -> "AssetManifest":
+        self.hashes, self._stats = {}, {}
+        self.refresh()
+        logger.info(f"Static manifest built: {len(self.hashes)} files")
+        return self
+
+    def refresh(self) -> int:
+        """Пересчитывает хэши новых и измененных файлов, возвращает их число"""
+        hashes, stats = {}, {}
+        changed = 0
+        for path in self.directory.rglob("*"):
+            if not path.is_file() or path.suffix in (".br", ".gz"):
+                continue
+            relative = path.relative_to(self.directory).as_posix()
+            stat = path.stat()
+            key = (stat.st_mtime, stat.st_size)
+            if self._stats.get(relative) == key:
+                hashes[relative], stats[relative] = self.hashes[relative], key
+                continue
+            hashes[relative], stats[relative] = self._digest(path), key
+            changed += 1
+        # Словари заменяются целиком: их читают запросы статики, пока идет пересчет
+        self.hashes, self._stats = hashes, stats
+        if changed:
+            logger.debug(f"Static manifest refreshed: {changed} files")
+        return changed
+
+    def current(self, path: str, stat_result: os.stat_result) -> Optional[str]:
+        """Хэш файла, пересчитанный, если файл изменился после сборки манифеста"""
+        digest = self.hashes.get(path)
+        if digest is None:
+            return None
+        key = (stat_result.st_mtime, stat_result.st_size)
+        if self._stats.get(path) != key:
+            digest = self._digest(self.directory / path)
+            self.hashes = {**self.hashes, path: digest}
+            self._stats = {**self._stats, path: key}
+        return digest
+
+    @staticmethod
+    def _digest(path: Path) -> str:
+        return hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+
+    def url(self, path: str) -> str:
+        path = path.lstrip("/")
+        digest = self.hashes.get(path)
+        if digest is None:
+            return f"{self.url_prefix}/{path}"
+        return f"{self.url_prefix}/{path}?v={digest}"
+
+    def is_current(self, path: str, version: Optional[str], stat_result: Optional[os.stat_result] = None) -> bool:
+        if version is None:
+            return False
+        if stat_result is not None:
+            return self.current(path, stat_result) == version
+        return self.hashes.get(path) == version
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Разбор Accept-Encoding: кодировка -> q"""
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+class CompressedStaticFiles(StaticFiles):
+    """StaticFiles с заранее сжатыми копиями и кэшированием по версии из манифеста.
+
+    Запрос с актуальным ``?v=`` получает immutable-кэш на год, остальные -
+    ``max_age`` (0 означает ревалидацию по ETag при каждом обращении).
+    """
+
+    def __init__(self, *args, manifest: AssetManifest, max_age: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+        self.max_age = max_age
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        variant = self._compressed_variant(str(full_path), stat_result, request_headers)
+        if variant is not None:
+            encoding, variant_path, variant_stat = variant
+            response: Response = FileResponse(
+                variant_path, status_code=status_code, stat_result=variant_stat,
+                media_type=guess_type(str(full_path))[0] or "text/plain"
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.headers.add_vary_header("Accept-Encoding")
+        else:
+            # Несжатый файл при необходимости сожмет CompressionMiddleware, он же добавит Vary
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+        relative = Path(self.get_path(scope)).as_posix()
+        version = QueryParams(scope.get("query_string", b"")).get("v")
+        # Хэш сверяется с файлом на диске: измененный файл под старым ?v= не получит immutable
+        if self.manifest.is_current(relative, version, stat_result):
+            response.headers["Cache-Control"] = IMMUTABLE
+        elif self.max_age > 0:
+            response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def _compressed_variant(full_path: str, stat_result: os.stat_result,
+                            request_headers: Headers) -> Optional[Tuple[str, str, os.stat_result]]:
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, suffix in ENCODINGS:
+            if accepted.get(encoding, 0) <= 0:
+                continue
+            try:
+                variant_stat = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            # Копия старше оригинала - файл поменяли, а сжать заново забыли
+            if variant_stat.st_mtime >= stat_result.st_mtime:
+                return encoding, full_path + suffix, variant_stat
+        return None
+
+
+def precompress(directory: str, min_size: int = 1024) -> int:
+    """Создает .gz (и .br, если установлен brotli) рядом с текстовыми файлами"""
+    written = 0
+    for path in Path(directory).rglob("*"):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE or path.stat().st_size < min_size:
+            continue
+        data = path.read_bytes()
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(data):
+                continue
+            target = path.with_name(path.name + suffix)
+            tmp = target.with_name(target.name + ".tmp")
+            tmp.write_bytes(compressed)
+            os.replace(tmp, target)
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заранее сжимает статику (.gz, .br)")
+    parser.add_argument("--dir", default="static")
+    parser.add_argument("--min-size", type=int, default=1024, help="не сжимать файлы меньше, байт")
+    args = parser.parse_args()
+    written = precompress(args.dir, args.min_size)
+    if brotli is None:
+        print("brotli is not installed, only .gz variants were written")
+    print(f"{written} compressed files written to {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from loguru import logger
+
+from models.email_account import EmailAccount
+from models.message import Message, as_aware
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    email TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    service TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    last_accessed TEXT,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    proxy TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    email TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    subject TEXT NOT NULL DEFAULT '',
+    sender TEXT NOT NULL DEFAULT '',
+    recipient TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    html_content TEXT,
+    PRIMARY KEY (email, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_email_date ON messages (email, date);
+"""
+
+ACCOUNT_COLUMNS = "email, password, service, created_at, last_accessed, is_active, proxy"
+MESSAGE_COLUMNS = "message_id, subject, sender, recipient, date, content, html_content"
+
+
+def utc_isoformat(value: datetime) -> str:
+    """Дата письма для колонки date: всегда в UTC.
+
+    Даты сравниваются в SQL как строки, поэтому naive-время и разные
+    смещения перед записью и сравнением приводятся к одному виду.
+    """
+    return as_aware(value).astimezone(timezone.utc).isoformat()
+
+
+def sqlite_path(database_url: str) -> str:
+    """Путь к файлу базы из URL вида sqlite:///./emailbot.db или sqlite:////data/db/emailbot.db"""
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        raise ValueError(f"Поддерживается только SQLite, получено: {database_url}")
+    return database_url[len(prefix):] or ":memory:"
+
+
+class Storage:
+    """Хранилище аккаунтов и писем в SQLite.
+
+    Все запросы выполняются в одном выделенном потоке, поэтому event loop не
+    блокируется, а соединение используется только из своего потока. WAL
+    позволяет воркерам uvicorn читать базу параллельно с записью.
+    """
+
+    def __init__(self, database_url: str):
+        self.path = sqlite_path(database_url)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            logger.info(f"SQLite storage opened: {self.path}")
+        return self._conn
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connection(), *args))
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, _close)
+        self._executor.shutdown(wait=False)
+
+    # Аккаунты
+
+    async def add_account(self, account: EmailAccount):
+        def _add(conn: sqlite3.Connection):
+            conn.execute(
+                f"INSERT OR REPLACE INTO accounts ({ACCOUNT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    account.email, account.password, account.service,
+                    account.created_at.isoformat(),
+                    account.last_accessed.isoformat() if account.last_accessed else None,
+                    int(account.is_active), account.proxy
+                )
+            )
+        await self._run(_add)
+
+    async def get_account(self, email: str) -> Optional[EmailAccount]:
+        def _get(conn: sqlite3.Connection):
+            return conn.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts WHERE email = ?", (email,)).fetchone()
+        row = await self._run(_get)
+        return self._account_from_row(row) if row else None
+
+    async def list_accounts(self) -> List[EmailAccount]:
+        def _list(conn: sqlite3.Connection):
+            return conn.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts ORDER BY created_at").fetchall()
+        return [self._account_from_row(row) for row in await self._run(_list)]
+
+    async def account_exists(self, email: str) -> bool:
+        def _exists(conn: sqlite3.Connection):
+            return conn.execute("SELECT 1 FROM accounts WHERE email = ?", (email,)).fetchone() is not None
+        return await self._run(_exists)
+
+    async def delete_account(self, email: str) -> bool:
+        """Удаляет аккаунт вместе с сохраненными письмами"""
+        def _delete(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                deleted = conn.execute("DELETE FROM accounts WHERE email = ?", (email,)).rowcount
+                conn.execute("DELETE FROM messages WHERE email = ?", (email,))
+            return deleted > 0
+        return await self._run(_delete)
+
+    async def touch_accounts(self, accessed: Dict[str, datetime]):
+        """Записывает last_accessed пачкой (время последнего обращения к ящику)"""
+        rows = [(when.isoformat(), email) for email, when in accessed.items()]
+        if not rows:
+            return
+
+        def _touch(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("UPDATE accounts SET last_accessed = ? WHERE email = ? AND is_active = 1", rows)
+        await self._run(_touch)
+
+    async def claim_expired_accounts(
+        self,
+        created_before: datetime,
+        idle_before: Optional[datetime],
+        limit: int,
+        stale_claim_before: datetime
+    ) -> List[str]:
+        """Помечает истекшие аккаунты неактивными и возвращает их адреса.
+
+        Пометка делается в одной транзакции с выборкой, поэтому воркеры не
+        забирают одни и те же ящики. Аккаунты, помеченные раньше
+        ``stale_claim_before`` и так и не удаленные (воркер упал), забираются снова.
+        """
+        def _claim(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    """
+                    SELECT email FROM accounts
+                    WHERE (is_active = 1 AND (created_at < ? OR COALESCE(last_accessed, created_at) < ?))
+                       OR (is_active = 0 AND last_accessed < ?)
+                    ORDER BY created_at LIMIT ?
+                    """,
+                    (
+                        created_before.isoformat(),
+                        idle_before.isoformat() if idle_before else "",
+                        stale_claim_before.isoformat(),
+                        limit
+                    )
+                ).fetchall()
+                emails = [row[0] for row in rows]
+                now = datetime.now().isoformat()
+                conn.executemany(
+                    "UPDATE accounts SET is_active = 0, last_accessed = ? WHERE email = ?",
+                    [(now, email) for email in emails]
+                )
+            return emails
+        return await self._run(_claim)
+
+    async def delete_accounts(self, emails: List[str]) -> int:
+        """Удаляет аккаунты пачкой вместе с письмами"""
+        if not emails:
+            return 0
+
+        def _delete(conn: sqlite3.Connection):
+            params = [(email,) for email in emails]
+            with conn:
+                conn.execute("BEGIN")
+                before = conn.total_changes
+                conn.executemany("DELETE FROM accounts WHERE email = ?", params)
+                deleted = conn.total_changes - before
+                conn.executemany("DELETE FROM messages WHERE email = ?", params)
+            return deleted
+        return await self._run(_delete)
+
+    @staticmethod
+    def _account_from_row(row) -> EmailAccount:
+        email, password, service, created_at, last_accessed, is_active, proxy = row
+        return EmailAccount(
+            email=email,
+            password=password,
+            service=service,
+            created_at=datetime.fromisoformat(created_at),
+            last_accessed=datetime.fromisoformat(last_accessed) if last_accessed else None,
+            is_active=bool(is_active),
+            proxy=proxy
+        )
+
+    # Письма
+
+    async def save_messages(self, email: str, messages: Iterable[Message]):
+        rows = [
+            (
+                email, msg.message_id, msg.subject, msg.sender, msg.recipient,
+                utc_isoformat(msg.date), msg.body_text, msg.html_content
+            )
+            for msg in messages
+        ]
+        if not rows:
+            return
+
+        def _save(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO messages (email, {MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+        await self._run(_save)
+
+    async def get_messages(self, email: str, since: Optional[datetime] = None) -> List[Message]:
+        def _get(conn: sqlite3.Connection):
+            if since is None:
+                return conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE email = ? ORDER BY date DESC", (email,)
+                ).fetchall()
+            return conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE email = ? AND date >= ? ORDER BY date DESC",
+                (email, utc_isoformat(since))
+            ).fetchall()
+        return [self._message_from_row(row) for row in await self._run(_get)]
+
+    async def get_message(self, email: str, message_id: str) -> Optional[Message]:
+        def _get(conn: sqlite3.Connection):
+            return conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE email = ? AND message_id = ?", (email, message_id)
+            ).fetchone()
+        row = await self._run(_get)
+        return self._message_from_row(row) if row else None
+
+    async def delete_messages_before(self, cutoff: datetime, limit: int = 1000) -> int:
+        """Удаляет письма старше cutoff, в том числе ящиков, созданных не через сервис"""
+        def _delete(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                return conn.execute(
+                    "DELETE FROM messages WHERE rowid IN (SELECT rowid FROM messages WHERE date < ? LIMIT ?)",
+                    (utc_isoformat(cutoff), limit)
+                ).rowcount
+        return await self._run(_delete)
+
+    @staticmethod
+    def _message_from_row(row) -> Message:
+        message_id, subject, sender, recipient, date, content, html_content = row
+        return Message(
+            message_id=message_id,
+            subject=subject,
+            sender=sender,
+            recipient=recipient,
+            date=datetime.fromisoformat(date),
+            content=content,
+            html_content=html_content
+        )
@@ -549,10 +549,54 @@ document.addEventListener('DOMContentLoaded', () => {
     let messages = JSON.parse(localStorage.getItem('messages') || '[]')
         .sort((a, b) => new Date(b.date) - new Date(a.date));
     let autoRefreshInterval = null;
+    let messageStream = null;
     
-    // Auto-refresh functionality
+    // Останавливает поток обновлений и резервный опрос
+    function stopAutoRefresh() {
+        if (messageStream) {
+            messageStream.close();
+            messageStream = null;
+        }
+        if (autoRefreshInterval) {
+            clearInterval(autoRefreshInterval);
+            autoRefreshInterval = null;
+        }
+    }
+    
+    // Auto-refresh functionality: сервер сам присылает новые письма через SSE,
+    // периодический опрос остается только как запасной вариант
     function startAutoRefresh() {
         console.log('Starting auto-refresh for:', currentEmail);
+        stopAutoRefresh();
+        
+        if (window.EventSource && currentEmail) {
+            const email = currentEmail;
+            messageStream = new EventSource(`/api/email/stream/${encodeURIComponent(email)}?view=summary`);
+            messageStream.addEventListener('messages', async (event) => {
+                if (email !== currentEmail) {
+                    return;
+                }
+                try {
+                    await applyMessages(JSON.parse(event.data));
+                } catch (error) {
+                    console.warn('Failed to apply streamed messages:', error);
+                }
+            });
+            messageStream.onerror = () => {
+                // EventSource сам переподключается; если соединение закрыто окончательно - переходим на опрос
+                if (messageStream && messageStream.readyState === EventSource.CLOSED) {
+                    console.warn('Message stream closed, falling back to polling');
+                    messageStream = null;
+                    startPolling();
+                }
+            };
+            return;
+        }
+        
+        startPolling();
+    }
+    
+    function startPolling() {
         if (autoRefreshInterval) {
             clearInterval(autoRefreshInterval);
         }
@@ -595,7 +639,8 @@ document.addEventListener('DOMContentLoaded', () => {
             
             // Race between the fetch and timeout
             const response = await Promise.race([
-                fetch(`/api/email/messages/${email}`),
+                // В списке нужны только заголовки, тело письма загружается при открытии
+                fetch(`/api/email/messages/${email}?view=summary`),
                 timeout
             ]);
             
@@ -606,32 +651,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const newMessages = await response.json();
             console.log('Received messages:', newMessages);
             
-            if (!Array.isArray(newMessages)) {
-                throw new Error('Неверный формат данных');
-            }
-            
-            // Создаем карту существующих сообщений для быстрого поиска
-            const existingMessages = new Map(messages.map(msg => [msg.message_id, msg]));
-            
-            // Обновляем только метаданные сообщений, сохраняя контент
-            newMessages.forEach(newMsg => {
-                const existingMsg = existingMessages.get(newMsg.message_id);
-                if (existingMsg) {
-                    // Сохраняем существующий контент
-                    newMsg.content = existingMsg.content || newMsg.content;
-                    newMsg.html_content = existingMsg.html_content || newMsg.html_content;
-                }
-                existingMessages.set(newMsg.message_id, newMsg);
-            });
-            
-            // Преобразуем Map обратно в массив и сортируем по дате
-            messages = Array.from(existingMessages.values())
-                .sort((a, b) => new Date(b.date) - new Date(a.date));
-            localStorage.setItem('messages', JSON.stringify(messages));
-            console.log('Updated messages cache:', messages);
-
-            await renderMessages(messages);
-            updateMessageCount(messages.length);
+            await applyMessages(newMessages);
             
             setTimeout(() => {
                 messagesContainer.classList.remove('updating');
@@ -653,6 +673,36 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    // Объединяет полученные письма с уже известными и перерисовывает список
+    async function applyMessages(newMessages) {
+        if (!Array.isArray(newMessages)) {
+            throw new Error('Неверный формат данных');
+        }
+        
+        // Создаем карту существующих сообщений для быстрого поиска
+        const existingMessages = new Map(messages.map(msg => [msg.message_id, msg]));
+        
+        // Обновляем только метаданные сообщений, сохраняя контент
+        newMessages.forEach(newMsg => {
+            const existingMsg = existingMessages.get(newMsg.message_id);
+            if (existingMsg) {
+                // Сохраняем существующий контент
+                newMsg.content = existingMsg.content || newMsg.content;
+                newMsg.html_content = existingMsg.html_content || newMsg.html_content;
+            }
+            existingMessages.set(newMsg.message_id, newMsg);
+        });
+        
+        // Преобразуем Map обратно в массив и сортируем по дате
+        messages = Array.from(existingMessages.values())
+            .sort((a, b) => new Date(b.date) - new Date(a.date));
+        localStorage.setItem('messages', JSON.stringify(messages));
+        console.log('Updated messages cache:', messages);
+
+        await renderMessages(messages);
+        updateMessageCount(messages.length);
+    }
+    
     // Update message count
     function updateMessageCount(count) {
         messageCount.textContent = `${count} ${getMessageWord(count)}`;
@@ -803,6 +853,11 @@ document.addEventListener('DOMContentLoaded', () => {
     function processMessageLinks(message) {
         let links = new Set();
         
+        // Ссылка, найденная сервером (в кратком списке тела письма нет)
+        if (message.verification_link) {
+            links.add(message.verification_link);
+        }
+        
         // Check subject
         if (message.subject) {
             const subjectLinks = extractLinksFromText(message.subject);
@@ -949,8 +1004,8 @@ document.addEventListener('DOMContentLoaded', () => {
             const cachedMessages = JSON.parse(localStorage.getItem('messages') || '[]');
             const cachedMessage = cachedMessages.find(msg => msg.message_id === messageId);
             
-            // Если есть кешированное сообщение, показываем его сразу
-            if (cachedMessage) {
+            // Если в кеше есть само письмо (а не только заголовок из списка), показываем его сразу
+            if (cachedMessage && (cachedMessage.content || cachedMessage.html_content)) {
                 console.log('Found message in cache:', cachedMessage);
                 displayMessage(cachedMessage);
                 
@@ -996,7 +1051,12 @@ document.addEventListener('DOMContentLoaded', () => {
             
                     if (message) {
                         // Сохраняем в кеш
-                        cachedMessages.push(message);
+                        const messageIndex = cachedMessages.findIndex(msg => msg.message_id === messageId);
+                        if (messageIndex !== -1) {
+                            cachedMessages[messageIndex] = message;
+                        } else {
+                            cachedMessages.push(message);
+                        }
                         localStorage.setItem('messages', JSON.stringify(cachedMessages));
                         displayMessage(message);
                     }
@@ -1588,10 +1648,7 @@ document.addEventListener('DOMContentLoaded', () => {
             messages = [];
             
             // Останавливаем автообновление
-            if (autoRefreshInterval) {
-                clearInterval(autoRefreshInterval);
-                autoRefreshInterval = null;
-            }
+            stopAutoRefresh();
 
             // Очищаем DOM элементы
             messageList.innerHTML = '';
@@ -1991,9 +2048,7 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // Cleanup on page unload
     window.addEventListener('beforeunload', () => {
-        if (autoRefreshInterval) {
-            clearInterval(autoRefreshInterval);
-        }
+        stopAutoRefresh();
     });
     
     // Add visibility change handler
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+import pytest
+
+# Тесты не пишут снапшоты метрик, логи и базу в рабочий каталог и не ходят в сеть
+_workdir = tempfile.mkdtemp(prefix="neuromail-tests-")
+os.environ.setdefault("METRICS_DIR", "")
+os.environ.setdefault("MAILBOX_POOL_SIZE", "0")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_workdir}/test.db")
+os.environ.setdefault("CACHE_URL", f"sqlite:///{_workdir}/cache.db")
+os.environ.setdefault("LOG_FILE", os.path.join(_workdir, "app.log"))
+os.environ.setdefault("UPSTREAM_BASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("MAIL_PROVIDERS", "fake")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Приложение запускается один раз: shutdown закрывает хранилище процесса"""
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def provider(client):
+    # MAIL_PROVIDERS=fake: ящики и письма живут в памяти
+    import main
+    return main.mail_providers.primary
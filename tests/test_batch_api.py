@@ -0,0 +1,78 @@
+import main
+
+
+def create(client, **body) -> dict:
+    response = client.post("/api/email/batch/create", json={"service": "temp-mail", **body})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_batch_create_returns_partial_results(client, provider, monkeypatch):
+    create_custom_mailbox = provider.create_custom_mailbox
+
+    async def flaky(username):
+        if username == "broken":
+            raise RuntimeError("upstream refused")
+        return await create_custom_mailbox(username)
+
+    monkeypatch.setattr(provider, "create_custom_mailbox", flaky)
+    data = create(client, usernames=["batch-ok", "broken", "batch-ok2"])
+    assert data["succeeded"] == 2
+    assert data["failed"] == 1
+    assert [item["status"] for item in data["results"]] == ["success", "error", "success"]
+    assert data["results"][1]["username"] == "broken"
+    assert data["results"][0]["email"] == "batch-ok@fake.local"
+
+
+def test_batch_size_above_the_limit_is_rejected(client, provider, monkeypatch):
+    monkeypatch.setattr(main.settings, "batch_max_items", 2)
+    emails = ["a@fake.local", "b@fake.local", "c@fake.local"]
+    assert client.post("/api/email/batch/create", json={"count": 3}).status_code == 400
+    assert client.post("/api/email/batch/messages", json={"emails": emails}).status_code == 400
+    assert client.post("/api/email/batch/delete", json={"emails": emails}).status_code == 400
+    assert client.post("/api/email/batch/messages", json={"emails": []}).status_code == 400
+    # Повторы адресов в лимит не засчитываются
+    assert client.post("/api/email/batch/messages", json={"emails": emails[:2] * 3}).status_code == 200
+    assert provider.mailboxes.keys().isdisjoint(emails)
+
+
+def test_batch_messages_deduplicates_and_honours_since_ids(client, provider):
+    first, second = (item["email"] for item in create(client, count=2)["results"])
+    old = provider.deliver(first, "Old code", "Your code is 111111")
+    provider.deliver(first, "New code", "Your code is 222222")
+    provider.deliver(second, "Welcome", "Your code is 333333")
+
+    response = client.post("/api/email/batch/messages", json={
+        "emails": [first, second, first],
+        "view": "summary",
+        "since_ids": {first: old["id"]}
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["email"] for item in data["results"]] == [first, second]
+    assert data["succeeded"] == 2 and data["failed"] == 0
+    by_email = {item["email"]: item for item in data["results"]}
+    assert [m["verification_code"] for m in by_email[first]["messages"]] == ["222222"]
+    assert [m["verification_code"] for m in by_email[second]["messages"]] == ["333333"]
+    assert "content" not in by_email[second]["messages"][0]
+
+
+def test_batch_delete_reports_each_mailbox(client, provider, monkeypatch):
+    kept, removed = (item["email"] for item in create(client, count=2)["results"])
+    delete_mailbox = provider.delete_mailbox
+
+    async def refuse(email):
+        if email == kept:
+            return False
+        return await delete_mailbox(email)
+
+    monkeypatch.setattr(provider, "delete_mailbox", refuse)
+    response = client.post("/api/email/batch/delete", json={
+        "emails": [removed, kept, removed, "missing@fake.local"]
+    })
+    data = response.json()
+    assert [(item["email"], item["status"]) for item in data["results"]] == [
+        (removed, "deleted"), (kept, "error"), ("missing@fake.local", "not_found")
+    ]
+    assert data["succeeded"] == 2 and data["failed"] == 1
+    assert removed not in provider.mailboxes
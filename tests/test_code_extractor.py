@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from models.message import Message
+from services import html_text
+from services.code_extractor import CodeExtractor
+
+
+def installed_backends():
+    names = []
+    for name, backend_cls in html_text.BACKENDS.items():
+        try:
+            backend_cls()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+@pytest.fixture(params=installed_backends())
+def extractor(request, monkeypatch):
+    monkeypatch.setattr(html_text, "_backend", html_text.BACKENDS[request.param]())
+    return CodeExtractor()
+
+
+def html_message(html, text=""):
+    return Message(message_id="1", date=datetime(2024, 1, 1), content=text, html_content=html)
+
+
+@pytest.mark.parametrize("html, code", [
+    ("<div>Your code is</div><div>123456</div>", "123456"),
+    ("<p>Code: 7781</p><p>Bye</p>", "7781"),
+    ("<table><tr><td>Your code</td><td>482913</td><td>Thanks</td></tr></table>", "482913"),
+    ("<table><tr><td>482913</td></tr><tr><td>Thanks for signing up</td></tr></table>", "482913"),
+    ("Use<br>901234<br>to sign in", "901234"),
+    ("<p>Your verification code: <b>AB12CD</b></p>", "AB12CD"),
+])
+def test_code_is_not_glued_to_neighbouring_blocks(extractor, html, code):
+    assert extractor.extract_message(html_message(html)).code == code
+
+
+def test_text_version_is_scanned_for_codes(extractor):
+    message = html_message("<div>Order</div><div>5555</div>", text="Your verification code: 123456")
+    assert extractor.extract_message(message).code == "123456"
+
+
+def test_link_is_taken_from_html_href(extractor):
+    html = '<p>Hello</p><a href="https://example.com/verify?token=abc">Confirm</a>'
+    message = html_message(html, text="Open the button in the HTML version")
+    assert extractor.extract_message(message).link == "https://example.com/verify?token=abc"
+
+
+def test_plain_text_link_without_html(extractor):
+    message = html_message(None, text="Go to https://example.com/confirm/xyz to finish")
+    assert extractor.extract_message(message).link == "https://example.com/confirm/xyz"
+
+
+def test_html_to_text_separates_blocks(extractor):
+    assert html_text.html_to_text("<div>Your code is</div><div>123456</div>").split() == ["Your", "code", "is", "123456"]
+
+
+def test_result_is_cached_by_message_id(extractor):
+    first = extractor.extract_message(html_message("<p>Code: 7781</p>"))
+    again = html_message("<p>Code: 7781</p>")
+    assert extractor.cached(again) is first
+    changed = html_message("<p>Code: 9999</p>")
+    assert extractor.cached(changed) is None
+    assert extractor.extract_message(changed).code == "9999"
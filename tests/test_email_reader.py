@@ -0,0 +1,38 @@
+import asyncio
+
+from config import Settings
+from models import message as message_module
+from services.email_reader import EmailReader
+from services.mail_providers import FakeMailProvider, ProviderRouter
+from services.shared_cache import SQLiteCacheBackend
+from services.storage import Storage
+
+
+def test_shared_cache_hits_reuse_converted_messages(tmp_path, monkeypatch):
+    conversions = []
+    original = message_module.html_to_text
+
+    def counting_html_to_text(html):
+        conversions.append(html)
+        return original(html)
+
+    monkeypatch.setattr(message_module, "html_to_text", counting_html_to_text)
+    provider = FakeMailProvider()
+    provider.deliver("a@fake.local", "Code", body_html="<div>Your code is</div><div>123456</div>")
+    backend = SQLiteCacheBackend(f"sqlite:///{tmp_path}/cache.db")
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    reader = EmailReader(Settings(inbox_cache_ttl=60), storage, ProviderRouter([provider]), backend)
+
+    async def scenario():
+        contents = []
+        for _ in range(5):
+            messages, _ = await reader.get_inbox("a@fake.local")
+            contents.append(messages[0].content)
+        await backend.close()
+        await storage.close()
+        return contents
+
+    contents = asyncio.run(scenario())
+    assert contents[0].split() == ["Your", "code", "is", "123456"]
+    assert len(set(contents)) == 1
+    assert len(conversions) == 1
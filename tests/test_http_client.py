@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from config import Settings
+from services.circuit_breaker import CircuitBreaker, RetryBudget
+from services.concurrency import UpstreamBusyError
+from services.http_client import UpstreamClient
+
+
+def test_queue_timeout_releases_the_half_open_probe():
+    client = UpstreamClient(Settings(upstream_max_in_flight=1, upstream_queue_timeout=0.05, upstream_rate_limit=0))
+    breaker = client.breakers.get("glitchy:see")
+    breaker.state = CircuitBreaker.OPEN
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+
+    async def scenario():
+        # Единственное место в upstream занято - проба упирается в очередь
+        async with client.limiter.slot("other"):
+            with pytest.raises(UpstreamBusyError):
+                await client.request("glitchy:see", "GET", "http://127.0.0.1:9/see")
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def failing_client(statuses, **overrides):
+    """Клиент, у которого upstream отвечает статусами из списка (последний повторяется)"""
+    settings = dict(upstream_rate_limit=0, retry_backoff_base=0.001, retry_backoff_cap=0.001,
+                    breaker_failure_threshold=100)
+    settings.update(overrides)
+    client = UpstreamClient(Settings(**settings))
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(statuses[min(len(calls), len(statuses)) - 1])
+
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, calls
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("glitchy:see", failure_threshold=3, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    # После reset_timeout пропускается одна проба; ее сбой снова открывает автомат
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_retry_budget_runs_out():
+    budget = RetryBudget(ratio=0.5, min_retries=2, window=60)
+    for _ in range(4):
+        budget.record_request()
+    # min_retries + ratio * 4 первичных запроса
+    assert [budget.try_retry() for _ in range(5)] == [True] * 4 + [False]
+    assert budget.exhausted == 1
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+    assert budget.snapshot() == {"requests": 6, "retries": 5, "exhausted": 2}
+
+
+def test_request_stops_at_max_attempts():
+    client, calls = failing_client([503], upstream_max_attempts=3)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.request("glitchy:see", "GET", "http://upstream/see")
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+    assert client.retry_budget.snapshot()["retries"] == 2
+
+
+def test_request_returns_the_first_success():
+    client, calls = failing_client([502, 200], upstream_max_attempts=3)
+    response = asyncio.run(client.request("glitchy:see", "GET", "http://upstream/see"))
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert client.breakers.get("glitchy:see").state == CircuitBreaker.CLOSED
+
+
+def test_request_does_not_retry_without_budget():
+    client, calls = failing_client([503], upstream_max_attempts=5)
+    client.retry_budget = RetryBudget(ratio=0, min_retries=1, window=60)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.request("glitchy:see", "GET", "http://upstream/see")
+
+    asyncio.run(scenario())
+    # Первый запрос израсходовал единственный повтор, второй ушел один раз
+    assert len(calls) == 3
+    assert client.retry_budget.exhausted == 2
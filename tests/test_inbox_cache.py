@@ -0,0 +1,86 @@
+import asyncio
+import time
+from datetime import datetime
+
+from models.message import Message
+from services.email_reader import InboxCache
+from services.shared_cache import SQLiteCacheBackend
+
+
+def make_messages(*ids):
+    return [Message(message_id=i, subject="s", date=datetime(2024, 1, 1), content=f"body {i}") for i in ids]
+
+
+def test_concurrent_requests_share_one_fetch():
+    cache = InboxCache(ttl=5.0)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return make_messages("1")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_fetch("a@x", fetch) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert len({etag for _, etag in results}) == 1
+
+
+def test_invalidate_forces_reload_and_changes_etag():
+    cache = InboxCache(ttl=60.0)
+    inbox = make_messages("1")
+
+    async def fetch():
+        return list(inbox)
+
+    async def scenario():
+        _, first = await cache.get_or_fetch("a@x", fetch)
+        inbox.extend(make_messages("2"))
+        _, cached = await cache.get_or_fetch("a@x", fetch)
+        await cache.invalidate("a@x")
+        messages, fresh = await cache.get_or_fetch("a@x", fetch)
+        return first, cached, fresh, messages
+
+    first, cached, fresh, messages = asyncio.run(scenario())
+    assert cached == first
+    assert fresh != first
+    assert [m.message_id for m in messages] == ["1", "2"]
+
+
+def test_max_age_bypasses_older_entry():
+    cache = InboxCache(ttl=60.0)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return make_messages("1")
+
+    async def scenario():
+        await cache.get_or_fetch("a@x", fetch)
+        await asyncio.sleep(0.02)
+        await cache.get_or_fetch("a@x", fetch, max_age=0.01)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_peer_wait_respects_max_age(tmp_path):
+    backend = SQLiteCacheBackend(f"sqlite:///{tmp_path}/cache.db")
+    cache = InboxCache(ttl=60.0, backend=backend)
+    stale = make_messages("old")
+
+    async def fetch():
+        return make_messages("new")
+
+    async def scenario():
+        # Запись двухсекундной давности и загрузка, которую держит другой воркер
+        await backend.set("inbox:a@x", (time.time() - 2, stale, "etag-old", -1), 60)
+        await backend.add("inbox-fetch:a@x", -1, 0.2)
+        messages, _ = await cache.get_or_fetch("a@x", fetch, max_age=1.0)
+        await backend.close()
+        return messages
+
+    messages = asyncio.run(scenario())
+    assert [m.message_id for m in messages] == ["new"]
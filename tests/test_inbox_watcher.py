@@ -0,0 +1,89 @@
+import asyncio
+
+from config import Settings
+from services.email_reader import EmailReader
+from services.inbox_watcher import InboxWatcher
+from services.mail_providers import FakeMailProvider, ProviderRouter
+from services.storage import Storage
+
+EMAIL = "wait@fake.local"
+
+
+def make_watcher(tmp_path, interval=0.02):
+    provider = FakeMailProvider()
+    provider.mailboxes[EMAIL] = []
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    reader = EmailReader(Settings(inbox_cache_ttl=interval), storage, ProviderRouter([provider]))
+    return provider, storage, InboxWatcher(reader, interval)
+
+
+def has_code(msg) -> bool:
+    return "code" in msg.body_text
+
+
+def test_waiters_share_one_poll(tmp_path):
+    provider, storage, watcher = make_watcher(tmp_path)
+    polls = []
+    list_messages = provider.list_messages
+
+    async def counting_list(email):
+        polls.append(email)
+        return await list_messages(email)
+
+    provider.list_messages = counting_list
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(watcher.wait_for(EMAIL, has_code, timeout=2)) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        subscribers = len(watcher._watches[EMAIL].subscribers)
+        polls_before = len(polls)
+        provider.deliver(EMAIL, "Code", "Your code is 123456")
+        found = await asyncio.gather(*waiters)
+        await storage.close()
+        return subscribers, polls_before, found
+
+    subscribers, polls_before, found = asyncio.run(scenario())
+    assert subscribers == 3
+    # За 0.1 с один опрос ящика делает ~5 запросов, три отдельных сделали бы ~15
+    assert polls_before <= 8
+    assert len({id(msg) for msg in found}) == 1
+    assert found[0].subject == "Code"
+    assert watcher.active_mailboxes == 0
+
+
+def test_wait_skips_messages_up_to_since_id(tmp_path):
+    provider, storage, watcher = make_watcher(tmp_path)
+    old = provider.deliver(EMAIL, "Old", "Your code is 111111")
+
+    async def scenario():
+        # Ящик уже известен процессу: since_id сопоставляется с его порядком писем
+        await watcher.reader.get_inbox(EMAIL)
+        skipped = await watcher.wait_for(EMAIL, has_code, timeout=0.1, since_id=old["id"])
+        waiting = asyncio.ensure_future(watcher.wait_for(EMAIL, has_code, timeout=2, since_id=old["id"]))
+        await asyncio.sleep(0.05)
+        provider.deliver(EMAIL, "New", "Your code is 222222")
+        found = await waiting
+        await storage.close()
+        return skipped, found
+
+    skipped, found = asyncio.run(scenario())
+    assert skipped is None
+    assert found.subject == "New"
+
+
+def test_wait_times_out_and_stops_polling(tmp_path):
+    provider, storage, watcher = make_watcher(tmp_path)
+    provider.deliver(EMAIL, "Newsletter", "No secrets here")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await watcher.wait_for(EMAIL, has_code, timeout=0.15)
+        elapsed = loop.time() - started
+        await storage.close()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(scenario())
+    assert result is None
+    assert 0.15 <= elapsed < 1
+    assert watcher.active_mailboxes == 0
@@ -0,0 +1,109 @@
+import asyncio
+import importlib
+
+import config
+from config import Settings
+from services.http_client import UpstreamClient
+from services.mail_providers import FakeMailProvider, ProviderRouter, build_router
+
+
+def router_names(**overrides):
+    settings = Settings(**overrides)
+    return [p.name for p in build_router(settings, UpstreamClient(settings)).providers]
+
+
+def test_fallback_is_opt_in(monkeypatch):
+    monkeypatch.delenv("MAIL_PROVIDERS", raising=False)
+    monkeypatch.delenv("FALLBACK_BASE_URL", raising=False)
+    defaults = importlib.reload(config).Settings.model_fields
+    assert defaults["mail_providers"].default == "glitchy"
+    assert defaults["fallback_base_url"].default == ""
+    assert router_names(mail_providers="glitchy") == ["glitchy"]
+
+
+def test_fallback_without_url_is_skipped():
+    assert router_names(mail_providers="glitchy,fallback", fallback_base_url="") == ["glitchy"]
+    assert router_names(
+        mail_providers="glitchy,fallback", fallback_base_url="https://mirror.example"
+    ) == ["glitchy", "fallback"]
+
+
+class SlowFake(FakeMailProvider):
+    """Фейковый провайдер с отдельным именем и возможностью упасть"""
+
+    def __init__(self, name, latency=0.0, domain="fake.local", fail=False):
+        super().__init__(latency=latency, domain=domain)
+        self.name = name
+        self.fail = fail
+        self.calls = 0
+
+    async def list_messages(self, email):
+        self.calls += 1
+        await self._delay()
+        if self.fail:
+            raise RuntimeError("upstream is down")
+        return list(self.mailboxes.get(email, []))
+
+    async def create_mailbox(self):
+        if self.fail:
+            raise RuntimeError("upstream is down")
+        return await super().create_mailbox()
+
+
+def make_router(*providers):
+    return ProviderRouter(list(providers), hedge_default_delay=0.02)
+
+
+def test_reads_skip_providers_that_do_not_own_the_mailbox():
+    owner = SlowFake("owner", latency=0.1, domain="owner.mail")
+    other = SlowFake("other", domain="other.mail")
+    owner.deliver("a@owner.mail", "Your code")
+    router = make_router(owner, other)
+
+    messages = asyncio.run(router.list_messages("a@owner.mail"))
+    assert [m["subject"] for m in messages] == ["Your code"]
+    assert other.calls == 0
+
+
+def test_empty_replica_answer_waits_for_the_owner():
+    owner = SlowFake("owner", latency=0.1, domain="shared.mail")
+    replica = SlowFake("replica", domain="shared.mail")
+    owner.deliver("a@shared.mail", "Your code")
+    router = make_router(owner, replica)
+
+    async def scenario():
+        messages = await router.list_messages("a@shared.mail")
+        message = await router.get_message("a@shared.mail", messages[0]["id"])
+        return messages, message
+
+    messages, message = asyncio.run(scenario())
+    assert [m["subject"] for m in messages] == ["Your code"]
+    assert message is not None and message["subject"] == "Your code"
+    assert replica.calls == 1
+    assert router.hedged_requests >= 1
+
+
+def test_empty_replica_answer_is_used_when_the_owner_fails():
+    owner = SlowFake("owner", latency=0.05, domain="shared.mail", fail=True)
+    replica = SlowFake("replica", domain="shared.mail")
+    router = make_router(owner, replica)
+
+    assert asyncio.run(router.list_messages("a@shared.mail")) == []
+
+
+def test_created_mailbox_is_owned_by_the_provider_that_created_it():
+    primary = SlowFake("primary", domain="primary.mail", fail=True)
+    backup = SlowFake("backup", domain="backup.mail")
+    backup.domains = set()
+    router = make_router(primary, backup)
+
+    async def scenario():
+        email = await router.create_mailbox()
+        backup.deliver(email, "Welcome")
+        return email, await router.list_messages(email)
+
+    email, messages = asyncio.run(scenario())
+    assert email.endswith("@backup.mail")
+    assert [p.name for p in router.owners(email)] == ["backup"]
+    assert [m["subject"] for m in messages] == ["Welcome"]
+    assert primary.calls == 0
@@ -0,0 +1,43 @@
+import asyncio
+
+from config import Settings
+from services.email_creator import EmailCreator
+from services.mail_providers import FakeMailProvider, ProviderRouter
+from services.mailbox_pool import MailboxPool
+
+
+def test_expired_mailboxes_are_deleted_upstream():
+    provider = FakeMailProvider()
+    creator = EmailCreator(Settings(), None, ProviderRouter([provider]))
+    pool = MailboxPool(creator, size=2, max_age=0.05)
+
+    async def scenario():
+        pool.start()
+        await asyncio.sleep(0.2)
+        # Выдача тоже выбрасывает устаревшие ящики
+        await asyncio.sleep(0.06)
+        pool.acquire()
+        await pool.stop()
+
+    asyncio.run(scenario())
+    assert pool.expired > 0
+    assert pool.delete_failures == 0
+    # У провайдера остались только выданные ящики
+    assert pool.stats()["depth"] == 0
+    assert len(provider.mailboxes) == pool.hits
+
+
+def test_stop_deletes_unissued_mailboxes_upstream():
+    provider = FakeMailProvider()
+    creator = EmailCreator(Settings(), None, ProviderRouter([provider]))
+    pool = MailboxPool(creator, size=3, max_age=60)
+
+    async def scenario():
+        pool.start()
+        await asyncio.sleep(0.2)
+        assert pool.stats()["depth"] == 3
+        await pool.stop()
+
+    asyncio.run(scenario())
+    assert pool.delete_failures == 0
+    assert provider.mailboxes == {}
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from config import Settings
+from models.email_account import EmailAccount
+from services.email_reader import EmailReader
+from services.mail_providers import FakeMailProvider, ProviderRouter
+from services.mailbox_sweeper import MailboxSweeper
+from services.storage import Storage
+
+
+def test_sweep_removes_expired_mailboxes_in_batches(tmp_path):
+    provider = FakeMailProvider()
+    providers = ProviderRouter([provider])
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    reader = EmailReader(Settings(), storage, providers)
+    sweeper = MailboxSweeper(storage, reader, providers, ttl=3600, batch_size=2)
+    claims = []
+    claim = storage.claim_expired_accounts
+
+    async def counting_claim(*args):
+        emails = await claim(*args)
+        claims.append(len(emails))
+        return emails
+
+    storage.claim_expired_accounts = counting_claim
+    now = datetime.now()
+
+    async def scenario():
+        for i in range(5):
+            email = await provider.create_custom_mailbox(f"old{i}")
+            await storage.add_account(EmailAccount(
+                email=email, password="", service="fake", created_at=now - timedelta(hours=2)
+            ))
+        fresh = await provider.create_custom_mailbox("fresh")
+        await storage.add_account(EmailAccount(email=fresh, password="", service="fake", created_at=now))
+        removed = await sweeper.sweep()
+        accounts = await storage.list_accounts()
+        await storage.close()
+        return removed, accounts
+
+    removed, accounts = asyncio.run(scenario())
+    assert removed == 5
+    assert claims == [2, 2, 1]
+    assert [a.email for a in accounts] == ["fresh@fake.local"]
+    assert list(provider.mailboxes) == ["fresh@fake.local"]
+    assert sweeper.expired == 5
+    assert sweeper.upstream_failures == 0
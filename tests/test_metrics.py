@@ -0,0 +1,50 @@
+import asyncio
+import json
+import os
+import threading
+
+from services.metrics import MetricsRegistry
+
+
+def make_registry(tmp_path, depth):
+    registry = MetricsRegistry()
+    gauge = registry.gauge("pool_depth", "Ready mailboxes")
+    registry.add_collector(lambda: gauge.set(depth[0]))
+    registry.configure(str(tmp_path))
+    return registry
+
+
+def test_periodic_flush_updates_gauges_from_collectors(tmp_path):
+    depth = [3]
+    registry = make_registry(tmp_path, depth)
+
+    async def scenario():
+        registry.start(0.01)
+        await asyncio.sleep(0.05)
+        depth[0] = 7
+        await asyncio.sleep(0.05)
+        await registry.stop()
+
+    asyncio.run(scenario())
+    data = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+    assert data["metrics"]["pool_depth"] == [[[], 7.0]]
+
+
+def test_export_reads_files_off_the_event_loop(tmp_path):
+    depth = [2]
+    registry = make_registry(tmp_path, depth)
+    # Снимок другого живого воркера с его текущим значением
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(
+        {"pid": os.getppid(), "metrics": {"pool_depth": [[[], 5.0]]}}
+    ))
+    threads = []
+    render = registry.render
+
+    def tracking_render(snapshot=None):
+        threads.append(threading.current_thread())
+        return render(snapshot)
+
+    registry.render = tracking_render
+    output = asyncio.run(registry.export())
+    assert "pool_depth 7" in output
+    assert threads and threads[0] is not threading.main_thread()
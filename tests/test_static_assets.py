@@ -0,0 +1,94 @@
+import asyncio
+import os
+import threading
+
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from services.page_cache import PageCache
+from services.static_assets import IMMUTABLE, AssetManifest, CompressedStaticFiles
+
+
+def write(path, content, mtime):
+    path.write_text(content)
+    os.utime(path, (mtime, mtime))
+
+
+def make_site(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    write(static / "app.js", "console.log(1)", 1_000_000)
+    manifest = AssetManifest(str(static)).build()
+    pages = PageCache(check_interval=0)
+
+    def render():
+        manifest.refresh()
+        return f'<script src="{manifest.url("app.js")}"></script>'
+
+    pages.register("index", render, [str(static / "app.js")])
+    return static, manifest, pages
+
+
+def test_changed_asset_gets_a_new_version_in_the_page(tmp_path):
+    static, manifest, pages = make_site(tmp_path)
+    old_url = manifest.url("app.js")
+
+    async def scenario():
+        assert old_url in (await pages.get("index")).body.decode()
+        write(static / "app.js", "console.log(2)", 1_000_100)
+        # Пока новая версия рендерится, отдается предыдущая
+        assert old_url in (await pages.get("index")).body.decode()
+        await pages._building["index"]
+        return (await pages.get("index")).body.decode()
+
+    body = asyncio.run(scenario())
+    assert old_url not in body
+    assert manifest.url("app.js") in body
+
+
+def test_rebuild_does_not_block_the_event_loop(tmp_path):
+    source = tmp_path / "page.html"
+    write(source, "v1", 1_000_000)
+    release = threading.Event()
+    renders = []
+
+    def render():
+        renders.append(source.read_text())
+        if len(renders) > 1:
+            release.wait(5)
+        return source.read_text()
+
+    pages = PageCache(check_interval=0)
+    pages.register("page", render, [str(source)])
+
+    async def scenario():
+        # Параллельные первые запросы ждут один рендер
+        first = await asyncio.gather(pages.get("page"), pages.get("page"))
+        write(source, "v2", 1_000_100)
+        # Рендер висит в пуле, а запросы сразу получают старую версию
+        stale = await asyncio.wait_for(asyncio.gather(*(pages.get("page") for _ in range(3))), 1)
+        release.set()
+        await pages._building["page"]
+        return first, stale, await pages.get("page")
+
+    first, stale, fresh = asyncio.run(scenario())
+    assert [page.body for page in first] == [b"v1", b"v1"]
+    assert [page.body for page in stale] == [b"v1"] * 3
+    assert fresh.body == b"v2"
+    assert len(renders) == 2
+
+
+def test_stale_version_is_not_served_as_immutable(tmp_path):
+    static, manifest, _ = make_site(tmp_path)
+    app = Starlette(routes=[Mount("/static", CompressedStaticFiles(directory=str(static), manifest=manifest))])
+    client = TestClient(app)
+    old_url = manifest.url("app.js")
+    assert client.get(old_url).headers["cache-control"] == IMMUTABLE
+
+    # Файл поменяли, а главную с новым ?v= еще никто не запрашивал
+    write(static / "app.js", "console.log(2)", 1_000_100)
+    response = client.get(old_url)
+    assert response.text == "console.log(2)"
+    assert response.headers["cache-control"] == "no-cache"
+    assert client.get(manifest.url("app.js")).headers["cache-control"] == IMMUTABLE
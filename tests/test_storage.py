@@ -0,0 +1,112 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from models.email_account import EmailAccount
+from models.message import Message
+from services.storage import Storage
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    """Локальная зона сервера впереди UTC, как у ревьюера"""
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_message_dates_compare_in_utc(tmp_path, local_tz):
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    now = datetime.now()
+    # Upstream отдает aware-даты в UTC, сервис считает срок от naive локального времени
+    recent = Message(message_id="recent", date=datetime.now(timezone.utc) - timedelta(hours=8))
+    old = Message(message_id="old", date=datetime.now(timezone.utc) - timedelta(hours=12))
+    local = Message(message_id="local", date=now - timedelta(hours=1))
+
+    async def scenario():
+        await storage.save_messages("a@fake.local", [recent, old, local])
+        since = await storage.get_messages("a@fake.local", since=now - timedelta(hours=9))
+        deleted = await storage.delete_messages_before(now - timedelta(hours=10))
+        left = await storage.get_messages("a@fake.local")
+        await storage.close()
+        return since, deleted, left
+
+    since, deleted, left = asyncio.run(scenario())
+    assert [m.message_id for m in since] == ["local", "recent"]
+    assert deleted == 1
+    assert {m.message_id for m in left} == {"recent", "local"}
+    assert all(m.date.tzinfo is not None for m in left)
+
+
+def account(email, created_hours_ago, accessed_hours_ago=None, is_active=True, now=None):
+    now = now or datetime.now()
+    return EmailAccount(
+        email=email, password="", service="fake",
+        created_at=now - timedelta(hours=created_hours_ago),
+        last_accessed=now - timedelta(hours=accessed_hours_ago) if accessed_hours_ago is not None else None,
+        is_active=is_active
+    )
+
+
+def test_claim_expired_accounts(tmp_path):
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    now = datetime.now()
+
+    async def claim(idle_before):
+        return await storage.claim_expired_accounts(
+            now - timedelta(hours=24), idle_before, 100, now - timedelta(minutes=10)
+        )
+
+    async def scenario():
+        for item in (
+            account("old@fake.local", 30, now=now),
+            account("idle@fake.local", 5, accessed_hours_ago=3, now=now),
+            account("never-read@fake.local", 5, now=now),
+            account("fresh@fake.local", 5, accessed_hours_ago=0.5, now=now),
+            # Помечены упавшим воркером час и три минуты назад
+            account("stale-claim@fake.local", 5, accessed_hours_ago=1, is_active=False, now=now),
+            account("recent-claim@fake.local", 30, accessed_hours_ago=0.05, is_active=False, now=now),
+        ):
+            await storage.add_account(item)
+        # "" вместо idle_before: время простоя не учитывается
+        without_idle = await claim(None)
+        with_idle = await claim(now - timedelta(hours=2))
+        again = await claim(now - timedelta(hours=2))
+        claimed = await storage.get_account("idle@fake.local")
+        await storage.close()
+        return without_idle, with_idle, again, claimed
+
+    without_idle, with_idle, again, claimed = asyncio.run(scenario())
+    assert sorted(without_idle) == ["old@fake.local", "stale-claim@fake.local"]
+    assert sorted(with_idle) == ["idle@fake.local", "never-read@fake.local"]
+    # Только что забранные аккаунты другой проход не забирает
+    assert again == []
+    assert not claimed.is_active
+
+
+def test_claim_expired_accounts_respects_limit(tmp_path):
+    storage = Storage(f"sqlite:///{tmp_path}/db.db")
+    now = datetime.now()
+
+    async def scenario():
+        for i in range(5):
+            await storage.add_account(account(f"old{i}@fake.local", 30 + i, now=now))
+        batches = []
+        while True:
+            batch = await storage.claim_expired_accounts(
+                now - timedelta(hours=24), None, 2, now - timedelta(minutes=10)
+            )
+            batches.append(batch)
+            if len(batch) < 2:
+                break
+        await storage.close()
+        return batches
+
+    batches = asyncio.run(scenario())
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    # Сначала самые старые
+    assert batches[0] == ["old4@fake.local", "old3@fake.local"]
@@ -0,0 +1,35 @@
+import asyncio
+
+import main
+
+
+class DisconnectingRequest:
+    """Клиент, который отключается после первой проверки"""
+
+    def __init__(self):
+        self.checks = 0
+
+    async def is_disconnected(self) -> bool:
+        self.checks += 1
+        return True
+
+
+def test_stream_does_not_subscribe_until_iterated():
+    asyncio.run(main.stream_messages("idle@tmp.x", DisconnectingRequest(), view="full"))
+    assert main.inbox_watcher.active_mailboxes == 0
+
+
+def test_stream_unsubscribes_when_client_leaves():
+    async def scenario():
+        response = await main.stream_messages("gone@tmp.x", DisconnectingRequest(), view="full")
+        chunks = response.body_iterator
+        first = await chunks.__anext__()
+        subscribed = main.inbox_watcher.active_mailboxes
+        rest = [chunk async for chunk in chunks]
+        return first, subscribed, rest
+
+    first, subscribed, rest = asyncio.run(scenario())
+    assert first.startswith("retry:")
+    assert subscribed == 1
+    assert rest == []
+    assert main.inbox_watcher.active_mailboxes == 0
@@ -0,0 +1,48 @@
+import main
+
+
+def new_mailbox(client) -> str:
+    response = client.post("/api/email/batch/create", json={"count": 1})
+    return response.json()["results"][0]["email"]
+
+
+def wait(client, email, **params) -> dict:
+    response = client.get(f"/api/email/codes/{email}/wait", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_wait_filters_by_sender(client, provider):
+    email = new_mailbox(client)
+    provider.deliver(email, "Promo", "Use code 111111 at checkout", sender="shop@example.com")
+    provider.deliver(email, "Sign in", "Your code is 222222", sender="Robot <noreply@service.io>")
+    provider.deliver(email, "Later promo", "Use code 333333", sender="shop@example.com")
+
+    assert wait(client, email, timeout=1)["verification_code"] == "333333"
+    found = wait(client, email, timeout=1, sender="SERVICE.io")
+    assert found["status"] == "found"
+    assert found["verification_code"] == "222222"
+    assert found["subject"] == "Sign in"
+
+
+def test_wait_skips_messages_up_to_since_id(client, provider):
+    email = new_mailbox(client)
+    old = provider.deliver(email, "Old", "Your code is 111111")
+    messages = client.get(f"/api/email/messages/{email}").json()
+    assert messages
+
+    assert wait(client, email, timeout=0.2, since_id=old["id"])["status"] == "timeout"
+    new = provider.deliver(email, "New", "Your code is 222222")
+    found = wait(client, email, timeout=3, since_id=old["id"])
+    assert found["verification_code"] == "222222"
+    assert found["message_id"] == new["id"]
+
+
+def test_wait_returns_timeout(client, provider):
+    email = new_mailbox(client)
+    provider.deliver(email, "Newsletter", "We miss you, come back soon")
+    assert wait(client, email, timeout=0.2) == {
+        "status": "timeout", "verification_code": None, "verification_link": None,
+        "message_id": None, "subject": None, "sender": None, "date": None
+    }
+    assert main.inbox_watcher.active_mailboxes == 0